@@ -1,3 +1,4 @@
+import src.cache as cache
 import src.client as client
 import src.execution as execution
 import src.handler as handler
@@ -6,5 +7,5 @@ import src.timer as timer
 import src.util as util
 
 __all__ = [
-    client, execution, model, handler, timer, util,
+    cache, client, execution, model, handler, timer, util,
 ]
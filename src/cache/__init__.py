@@ -0,0 +1,9 @@
+from src.cache.result import ResultCache, CachedResult
+from src.cache.source import SourceCache, SourceEntry
+
+__all__ = [
+    ResultCache.__name__,
+    CachedResult.__name__,
+    SourceCache.__name__,
+    SourceEntry.__name__,
+]
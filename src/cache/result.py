@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union, TYPE_CHECKING
+from urllib.parse import urlsplit, urlunsplit
+
+from src.model.media_type import MediaType
+from src.util.aux import Watermark
+from src.util.logger import root_logger
+
+if TYPE_CHECKING:
+    import src.execution.task as task_pkg
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# rough bookkeeping size of an entry without stored media (link, key and row overhead)
+ENTRY_OVERHEAD_BYTES = 256
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """A previously uploaded cut result.
+
+    Attributes:
+        key             The content key of the cut (see :func:`result_cache_key`).
+        link            The imgur link of the uploaded cut.
+        media_type      The media type of the uploaded cut.
+        size            The accounted size of the entry in bytes.
+        media_path      The path to the stored output bytes or None if they were not stored.
+    """
+    key: str
+    link: str
+    media_type: MediaType
+    size: int
+    media_path: Optional[str]
+
+
+def _normalize_source(media_url: str) -> str:
+    # the query string is not part of the source identity (e.g. `?source=fallback` on v.redd.it)
+    scheme, netloc, path, _, _ = urlsplit(media_url)
+    return urlunsplit((scheme.lower(), netloc.lower(), path, '', ''))
+
+
+def _normalize_watermark(watermark: Optional[Watermark]) -> str:
+    if watermark is None:
+        return 'none'
+    return f'{watermark.text}|{tuple(watermark.position)}|{tuple(watermark.color)}'
+
+
+def result_cache_key(
+        media_url: str, start: float, end: Optional[float], watermark: Optional[Watermark] = None,
+        output_type: Optional[MediaType] = None
+) -> str:
+    """Returns the content key of a cut from its source identity, the normalized range, the watermark settings and
+    the output media type if the cut is transcoded.
+    """
+    end_ms = 'inf' if end is None else int(round(end))
+    raw = f'{_normalize_source(media_url)}#{int(round(start))}-{end_ms}#{_normalize_watermark(watermark)}'
+    if output_type is not None and output_type != MediaType.GIF:
+        raw += f'#{output_type.name.lower()}'  # keys of untranscoded cuts are unchanged
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def result_cache_key_for(config: task_pkg.TaskConfig) -> str:
+    return result_cache_key(
+        media_url=config.media_url, start=config.start, end=config.end, watermark=config.watermark,
+        output_type=config.output_type,
+    )
+
+
+class ResultCache(object):
+    """A size-bounded LRU cache of uploaded cut results with an on-disk backing store that survives restarts.
+
+    The index lives in a SQLite database in `directory`; optionally stored output bytes are kept as individual
+    files next to it. The cache is thread-safe since cuts are performed in executor threads.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_entries: int, store_media: bool = False):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._store_media = store_media
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self._directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self._directory, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, link TEXT NOT NULL, media_type TEXT NOT NULL, size INTEGER NOT NULL, '
+            'media_path TEXT, accessed REAL NOT NULL)'
+        )
+        self._db.commit()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            'SELECT key, link, media_type, size, media_path FROM results ORDER BY accessed ASC'
+        ).fetchall()
+        for key, link, media_type, size, media_path in rows:
+            if media_path is not None and not os.path.isfile(media_path):
+                media_path = None
+            self._entries[key] = CachedResult(
+                key=key, link=link, media_type=MediaType[media_type], size=size, media_path=media_path
+            )
+            self._total_bytes += size
+        root_logger.info(f'Loaded {len(self._entries)} cached result(s) ({self._total_bytes} bytes).')
+        with self._lock:
+            self._evict()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            return entry
+
+    def put(self, key: str, link: str, media_type: MediaType, media: Optional[Buffer] = None) -> CachedResult:
+        """Stores the upload `link` (and the output bytes if configured) under `key`.
+        """
+        media_path: Optional[str] = None
+        size = ENTRY_OVERHEAD_BYTES
+        if self._store_media and media is not None:
+            media_path = os.path.join(self._directory, f'{key}.{media_type.name.lower()}')
+            tmp_path = f'{media_path}.tmp'
+            with open(tmp_path, mode='wb') as fp:
+                fp.write(media)
+            os.replace(tmp_path, media_path)  # atomically publish the stored media
+            size += memoryview(media).nbytes
+        entry = CachedResult(key=key, link=link, media_type=media_type, size=size, media_path=media_path)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous.size
+                if previous.media_path not in (None, media_path):
+                    self._remove_file(previous.media_path)
+            self._entries[key] = entry
+            self._total_bytes += size
+            self._db.execute(
+                'INSERT OR REPLACE INTO results (key, link, media_type, size, media_path, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, link, media_type.name, size, media_path, time.time())
+            )
+            self._evict()
+            self._db.commit()
+        return entry
+
+    def _evict(self) -> None:
+        # must be called with the lock held
+        while self._entries and (self._total_bytes > self._max_bytes or len(self._entries) > self._max_entries):
+            key, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+            if entry.media_path is not None:
+                self._remove_file(entry.media_path)
+            root_logger.debug(f'Evicted cached result {key}.')
+        self._db.commit()
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,258 @@
+import hashlib
+import math
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from tempfile import NamedTemporaryFile
+from typing import Callable, Dict, Optional, TypeVar
+
+import requests
+
+from src.client.download import capped_chunks, shared_session
+from src.util.logger import task_logger
+from src.util.media_buffer import MediaBuffer
+
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class SourceEntry:
+    """A cached source media file.
+
+    Attributes:
+        url             The media url the entry was downloaded from.
+        path            The path of the cached file.
+        size            The size of the cached file in bytes.
+        etag            The `ETag` response header of the download, if any.
+        last_modified   The `Last-Modified` response header of the download, if any.
+        validated_at    The (monotonic) time at which the entry was last validated against the host.
+    """
+    url: str
+    path: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float
+
+
+class _Flight(object):
+    """An in-flight download that concurrent tasks for the same url wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: Optional[SourceEntry] = None
+        self.error: Optional[BaseException] = None
+
+
+class SourceCache(object):
+    """A byte-budgeted on-disk cache of source media keyed by media url.
+
+    Entries are validated with `ETag`/`Last-Modified` conditional requests once they are older than
+    `revalidate_seconds`, handed out as read-only memory maps and evicted least recently used first once the cached
+    bytes exceed `max_bytes`. Concurrent requests for the same url share a single download. Downloads of sources
+    larger than `max_source_bytes` are aborted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, revalidate_seconds: float = 60,
+                 session: Optional[requests.Session] = None, max_source_bytes: Optional[int] = None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._revalidate_seconds = revalidate_seconds
+        self._max_source_bytes = max_source_bytes
+        self._session = shared_session() if session is None else session
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, SourceEntry]' = OrderedDict()
+        self._in_flight: Dict[str, _Flight] = {}
+        self._total_bytes = 0
+        os.makedirs(self._directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self._directory, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sources ('
+            'url TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, etag TEXT, last_modified TEXT, '
+            'accessed REAL NOT NULL)'
+        )
+        self._db.commit()
+        self._load()
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._entries
+
+    def size_of(self, url: str) -> Optional[int]:
+        """Returns the size of the cached source of `url` (without validating it) or None if it is not cached."""
+        entry = self._entries.get(url)
+        return entry.size if entry is not None else None
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            'SELECT url, path, size, etag, last_modified FROM sources ORDER BY accessed ASC'
+        ).fetchall()
+        with self._lock:
+            for url, path, size, etag, last_modified in rows:
+                if not os.path.isfile(path):
+                    self._db.execute('DELETE FROM sources WHERE url = ?', (url,))
+                    continue
+                # entries from a previous run must be revalidated before use
+                self._entries[url] = SourceEntry(
+                    url=url, path=path, size=size, etag=etag, last_modified=last_modified, validated_at=-math.inf
+                )
+                self._total_bytes += size
+            self._evict()
+            self._db.commit()
+
+    def open(self, url: str) -> Optional[mmap.mmap]:
+        """Returns a read-only memory map of the source media at `url` or None if the host did not serve it.
+
+        The media is downloaded at most once for concurrent callers and is reused from disk as long as the host
+        confirms it is unchanged.
+        """
+        return self._open(url, handout=self._map)
+
+    def open_buffer(self, url: str) -> Optional[MediaBuffer]:
+        """Like :meth:`open`, but returns a :class:`MediaBuffer` backed by a hard link of the cached file.
+
+        The path of the buffer stays valid (e.g. as an ffmpeg input) even if the entry is evicted or replaced while
+        it is in use; closing the buffer removes the link.
+        """
+        return self._open(url, handout=self._link)
+
+    def _open(self, url: str, handout: Callable[[SourceEntry], T]) -> Optional[T]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and time.monotonic() - entry.validated_at < self._revalidate_seconds:
+                self._touch(entry)
+                return handout(entry)
+            flight = self._in_flight.get(url)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._in_flight[url] = _Flight()
+        if not is_leader:
+            task_logger.debug(f'Waiting for in-flight download of {url}.')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._handout_or_reopen(flight.entry, handout) if flight.entry is not None else None
+        try:
+            flight.entry = self._fetch(url=url, cached=entry)
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+            flight.done.set()
+        return self._handout_or_reopen(flight.entry, handout) if flight.entry is not None else None
+
+    def _fetch(self, url: str, cached: Optional[SourceEntry]) -> Optional[SourceEntry]:
+        headers = {}
+        if cached is not None:
+            if cached.etag is not None:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified is not None:
+                headers['If-Modified-Since'] = cached.last_modified
+        with self._session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and cached is not None:
+                task_logger.debug(f'Cached source is still valid: {url}')
+                entry = replace(cached, validated_at=time.monotonic())
+                with self._lock:
+                    if url in self._entries:
+                        self._entries[url] = entry
+                        self._touch(entry)
+                        return entry
+                # evicted in the meantime, download unconditionally
+                return self._fetch(url=url, cached=None)
+            if response.status_code != 200:
+                task_logger.warning(f'Failed to fetch source ({response.status_code}): {url}')
+                return None
+            with NamedTemporaryFile(mode='wb', dir=self._directory, suffix='.part', delete=False) as fp:
+                try:
+                    for chunk in capped_chunks(response, self._max_source_bytes, chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        fp.write(chunk)
+                except BaseException:
+                    fp.close()
+                    self._remove_file(fp.name)
+                    raise
+                size = fp.tell()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+        if size == 0:
+            os.remove(fp.name)
+            return None
+        path = os.path.join(self._directory, f'{hashlib.sha256(url.encode("utf-8")).hexdigest()}.bin')
+        entry = SourceEntry(
+            url=url, path=path, size=size, etag=etag, last_modified=last_modified, validated_at=time.monotonic()
+        )
+        with self._lock:
+            os.replace(fp.name, path)  # open memory maps of a previous version stay valid
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self._total_bytes -= previous.size
+            self._entries[url] = entry
+            self._total_bytes += size
+            self._db.execute(
+                'INSERT OR REPLACE INTO sources (url, path, size, etag, last_modified, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, path, size, etag, last_modified, time.time())
+            )
+            # never evict the entry we are about to hand out; if it exceeds the budget on its own, it is the first
+            # entry to be evicted by the next download
+            self._evict(keep=url)
+            self._db.commit()
+        return entry
+
+    def _map(self, entry: SourceEntry) -> mmap.mmap:
+        with open(entry.path, mode='rb') as fp:
+            # the mapping stays valid after the file is closed and even after it is evicted (unlinked)
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _link(self, entry: SourceEntry) -> MediaBuffer:
+        path = os.path.join(self._directory, f'{uuid.uuid4().hex}.link')
+        os.link(entry.path, path)  # no copy, the link shares the data of the cached file
+        return MediaBuffer.from_path(path, owned=True)
+
+    def _handout_or_reopen(self, entry: SourceEntry, handout: Callable[[SourceEntry], T]) -> Optional[T]:
+        try:
+            return handout(entry)
+        except FileNotFoundError:
+            return self._open(entry.url, handout=handout)  # evicted by a concurrent download in the meantime
+
+    def _touch(self, entry: SourceEntry) -> None:
+        # must be called with the lock held
+        self._entries.move_to_end(entry.url)
+        self._db.execute('UPDATE sources SET accessed = ? WHERE url = ?', (time.time(), entry.url))
+        self._db.commit()
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        # must be called with the lock held
+        for url in list(self._entries):
+            if self._total_bytes <= self._max_bytes:
+                break
+            if url == keep:
+                continue
+            entry = self._entries.pop(url)
+            self._total_bytes -= entry.size
+            self._db.execute('DELETE FROM sources WHERE url = ?', (url,))
+            self._remove_file(entry.path)
+            task_logger.debug(f'Evicted cached source {url}.')
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        # the (shared) session is owned by the caller
+        with self._lock:
+            self._db.close()
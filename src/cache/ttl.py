@@ -0,0 +1,45 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar('V')
+
+
+class TtlCache(Generic[V]):
+    """A small in-memory cache whose entries expire `ttl_seconds` after they were put.
+
+    Beyond `max_entries` the least recently put entries are evicted first.
+
+    Attributes:
+        ttl_seconds     The lifetime of an entry in seconds.
+        max_entries     The maximum number of entries.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, Tuple[float, V]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        self._expire()
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def put(self, key: Hashable, value: V) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (self._clock() + self.ttl_seconds, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _expire(self) -> None:
+        # entries are ordered by their expiry since all of them live equally long
+        now = self._clock()
+        while self._entries and next(iter(self._entries.values()))[0] <= now:
+            self._entries.popitem(last=False)
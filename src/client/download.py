@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from tempfile import SpooledTemporaryFile
+from typing import IO, Iterator, Mapping, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.util.exception import MediaTooLargeException
+from src.util.logger import task_logger
+from src.util.metrics import DOWNLOADED_BYTES
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# the maximum size of a (oEmbed provider) web page
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+_shared_session: Optional[requests.Session] = None
+_shared_session_lock = threading.Lock()
+
+
+def shared_session(pool_connections: int = 16, pool_maxsize: int = 16) -> requests.Session:
+    """Returns the blocking HTTP session shared by all downloads of this process (e.g. of a cut worker).
+
+    Connections are kept alive per host, so repeated downloads from the same host (e.g. `v.redd.it`) neither reconnect
+    nor repeat the TLS handshake.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            _shared_session.mount('http://', adapter)
+            _shared_session.mount('https://', adapter)
+        return _shared_session
+
+
+def check_content_length(headers: Mapping[str, str], url: str, max_bytes: Optional[int]) -> None:
+    """Raises :class:`MediaTooLargeException` before the body is read if the announced size exceeds `max_bytes`."""
+    try:
+        length = int(headers.get('Content-Length', ''))
+    except ValueError:
+        return  # unknown (e.g. chunked), the streamed size is checked instead
+    if max_bytes is not None and length > max_bytes:
+        raise MediaTooLargeException(f'Media of {length} bytes exceeds the maximum of {max_bytes} bytes: {url}')
+
+
+def capped_chunks(response: requests.Response, max_bytes: Optional[int],
+                  chunk_size: int = DOWNLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    """Yields the body of a streamed response and aborts the download once it exceeds `max_bytes`."""
+    check_content_length(response.headers, url=response.url, max_bytes=max_bytes)
+    size = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        size += len(chunk)
+        DOWNLOADED_BYTES.inc(len(chunk))
+        if max_bytes is not None and size > max_bytes:
+            raise MediaTooLargeException(f'Media exceeds the maximum of {max_bytes} bytes: {response.url}')
+        yield chunk
+
+
+class MediaDownloader(object):
+    """The asynchronous download service of the event loop.
+
+    All downloads share one connection pool that keeps connections alive per host; at most `max_concurrency`
+    downloads run at once and at most `connections_per_host` of them to the same host. Downloads are aborted as soon
+    as the announced (`Content-Length`) or the streamed size exceeds `max_bytes` and bodies larger than `spool_bytes`
+    are spooled to a temporary file in `spool_dir` instead of being held in memory.
+
+    Attributes:
+        max_concurrency         The maximum number of concurrent downloads.
+        connections_per_host    The maximum number of concurrent connections to a single host.
+        keepalive_seconds       The time an idle connection is kept alive for reuse.
+        timeout                 The timeout of a download in seconds; connecting times out after a tenth of it.
+        max_bytes               The maximum size of a download in bytes or None for no limit.
+        spool_bytes             The size in bytes from which on a download is spooled to disk.
+        spool_dir               The directory of the spooled downloads or None for the default temporary directory.
+    """
+
+    def __init__(self, max_concurrency: int = 8, connections_per_host: int = 4, keepalive_seconds: float = 60,
+                 timeout: float = 300, max_bytes: Optional[int] = None, spool_bytes: int = 8 * 1024 * 1024,
+                 spool_dir: Optional[str] = None):
+        self.max_concurrency = max_concurrency
+        self.connections_per_host = connections_per_host
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=timeout / 10)
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.spool_dir = spool_dir
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _init_session(self) -> None:
+        # the session and the semaphore are bound to the running event loop, hence they are created lazily
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    limit_per_host=self.connections_per_host,
+                    keepalive_timeout=self.keepalive_seconds,
+                ),
+                timeout=self.timeout,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def download(self, url: str, max_bytes: Optional[int] = None) -> Optional[IO[bytes]]:
+        """Downloads the resource at `url` into a (spooled) temporary file.
+
+        Args:
+            url: The url of the resource.
+            max_bytes: The maximum size of the resource in bytes; defaults to the maximum size of the downloader.
+
+        Returns:
+            The temporary file positioned at its start, which is removed once it is closed, or None if the host did
+            not serve the resource.
+
+        Raises:
+            MediaTooLargeException: If the resource exceeds the maximum size.
+        """
+        self._init_session()
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        async with self._semaphore:
+            async with self._session.get(url) as response:
+                if response.status != 200:
+                    task_logger.warning(f'Failed to download ({response.status}): {url}')
+                    return None
+                check_content_length(response.headers, url=url, max_bytes=max_bytes)
+                fp = SpooledTemporaryFile(max_size=self.spool_bytes, mode='w+b', dir=self.spool_dir)
+                try:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                        fp.write(chunk)
+                        DOWNLOADED_BYTES.inc(len(chunk))
+                        if max_bytes is not None and fp.tell() > max_bytes:
+                            # leaving the response context closes the connection, which aborts the download
+                            raise MediaTooLargeException(f'Media exceeds the maximum of {max_bytes} bytes: {url}')
+                except BaseException:
+                    fp.close()
+                    raise
+        fp.seek(0)
+        return fp
+
+    async def content_length(self, url: str) -> Optional[int]:
+        """Returns the size of the resource at `url` announced by a `HEAD` request or None if it is not announced."""
+        self._init_session()
+        async with self._semaphore:
+            try:
+                async with self._session.head(url, allow_redirects=True) as response:
+                    if response.status != 200:
+                        return None
+                    return int(response.headers['Content-Length'])
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as err:
+                task_logger.debug(f'Failed to look up the size ({type(err).__name__}): {url}')
+                return None
+
+    async def fetch_page(self, url: str) -> Optional[bytes]:
+        """Returns the content of the web page at `url` or None if the host did not serve it (or was unreachable)."""
+        try:
+            fp = await self.download(url, max_bytes=MAX_PAGE_BYTES)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            task_logger.warning(f'Failed to fetch the page ({type(err).__name__}): {url}')
+            return None
+        if fp is None:
+            return None
+        with fp:
+            return fp.read()
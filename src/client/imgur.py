@@ -1,12 +1,95 @@
+import asyncio
+import io
 import logging
+import os
+import time
+import tracemalloc
 from dataclasses import dataclass
-from typing import Union, Any
+from typing import Any, Dict, Optional, Tuple, Union
 
-import requests
+import aiohttp
+from aiohttp.payload import Payload
 
+from src.util import tracing
+from src.util.exception import UploadFailureException
+from src.util.media_buffer import MediaBuffer
 
-# import aiohttp
-# from aiohttp import ClientResponse
+# responses of these statuses are transient (rate limits, overload) and the upload is retried
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+# the maximum delay honored of a `Retry-After` header
+MAX_RETRY_AFTER_SECONDS = 60
+
+
+def _is_file(value: Any) -> bool:
+    return isinstance(value, io.IOBase) and not isinstance(value, io.BytesIO)
+
+
+class BufferPayload(Payload):
+    """A multipart payload that is written from (zero-copy) slices of a buffer.
+
+    Writing slices of :attr:`CHUNK_BYTES` and waiting for the transport to drain between them keeps the transport
+    from buffering a copy of the unsent remainder of a large buffer.
+    """
+    CHUNK_BYTES = 64 * 1024
+
+    def __init__(self, value: memoryview, *args, **kwargs):
+        kwargs.setdefault('content_type', 'application/octet-stream')
+        super().__init__(value.cast('B'), *args, **kwargs)
+        self._size = self._value.nbytes
+
+    def decode(self, encoding: str = 'utf-8', errors: str = 'strict') -> str:
+        return bytes(self._value).decode(encoding, errors)
+
+    async def write(self, writer) -> None:
+        for offset in range(0, self._size, self.CHUNK_BYTES):
+            await writer.write(self._value[offset:offset + self.CHUNK_BYTES])
+            await writer.drain()
+
+
+@dataclass(frozen=True)
+class UploadStats:
+    """The stats of an upload.
+
+    Attributes:
+        attempts        The number of attempts (1 if the upload was not retried).
+        payload_bytes   The size of the uploaded media in bytes.
+        bytes_sent      The number of request body bytes sent over all attempts, i.e. the payload and the multipart
+                        framing of every attempt.
+        seconds         The duration of the upload including retries.
+        peak_memory     The peak of the memory allocated by python during the upload in bytes if `tracemalloc` is
+                        tracing, None otherwise; it is only accurate for uploads that do not overlap.
+    """
+    attempts: int
+    payload_bytes: int
+    bytes_sent: int
+    seconds: float
+    peak_memory: Optional[int]
+
+
+class _UploadStatsRecorder(object):
+    def __init__(self):
+        self.attempts = 0
+        self.payload_bytes = 0
+        self.bytes_sent = 0
+        self._t0 = time.perf_counter()
+        self._tracing = tracemalloc.is_tracing()
+        if self._tracing:
+            self._traced_base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+    def done(self) -> UploadStats:
+        return UploadStats(
+            attempts=self.attempts,
+            payload_bytes=self.payload_bytes,
+            bytes_sent=self.bytes_sent,
+            seconds=time.perf_counter() - self._t0,
+            peak_memory=tracemalloc.get_traced_memory()[1] - self._traced_base if self._tracing else None,
+        )
+
+
+async def _on_request_chunk_sent(session, trace_config_ctx, params: aiohttp.TraceRequestChunkSentParams) -> None:
+    if isinstance(trace_config_ctx.trace_request_ctx, _UploadStatsRecorder):
+        trace_config_ctx.trace_request_ctx.bytes_sent += memoryview(params.chunk).nbytes
 
 
 @dataclass
@@ -72,25 +155,60 @@ class ImgurResponse:
 
 
 class ImgurClient:
+    """An asynchronous imgur API client with a persistent connection pool.
+
+    Uploads are streamed as multipart bodies from the file objects in the payload, at most `max_concurrency` uploads
+    are sent at once and transient failures (connection errors, timeouts, rate limits and server errors) are retried
+    with exponential backoff.
+
+    Attributes:
+        client_id           The imgur client id.
+        client_secret       The imgur client secret.
+        max_concurrency     The maximum number of concurrent uploads (and pooled connections).
+        timeout             The timeout of an upload request in seconds; connecting times out after a tenth of it.
+        max_retries         The maximum number of retries of a failed upload.
+        backoff_seconds     The delay before the first retry, doubled with every further retry.
+    """
     api_version: int = 3
     api_url: str
 
-    def __init__(self, client_id, client_secret=None):
+    def __init__(self, client_id, client_secret=None, max_concurrency: int = 4, timeout: float = 300,
+                 max_retries: int = 3, backoff_seconds: float = 1, api_url: Optional[str] = None):
         self.logger = logging.getLogger(name='ImgurClient')
         self.client_id = client_id
         self.client_secret = client_secret
         self.headers = {
             'Authorization': f'Client-ID {self.client_id}'
         }
-        self.api_url = f'https://api.imgur.com/{self.api_version}'
-        self._default_request_params = {
-            'raise_for_status': False,
-        }
+        self.api_url = f'https://api.imgur.com/{self.api_version}' if api_url is None else api_url
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=timeout / 10)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
 
     def __del__(self):
         del self.client_id
         del self.client_secret
 
+    def _init_session(self) -> None:
+        # the session and the semaphore are bound to the running event loop, hence they are created lazily
+        if self._session is None or self._session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_chunk_sent.append(_on_request_chunk_sent)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=self.timeout,
+                trace_configs=[trace_config],
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
     # account
 
     async def authenticate(self):
@@ -98,25 +216,98 @@ class ImgurClient:
 
     # image
 
-    def upload(self, upload_payload: dict, anon: bool = False) -> ImgurResponseData:
-        # response: ClientResponse
-        # imgur_response: ImgurResponse
+    async def upload(self, upload_payload: Dict[str, Any], anon: bool = False) -> Dict[str, Any]:
+        """Uploads an image or a video and returns the data of the imgur response, e.g. with the `link` of the upload.
+
+        See :meth:`upload_with_stats`.
+        """
+        data, _ = await self.upload_with_stats(upload_payload=upload_payload, anon=anon)
+        return data
+
+    async def upload_with_stats(self, upload_payload: Dict[str, Any],
+                                anon: bool = False) -> Tuple[Dict[str, Any], UploadStats]:
+        """Uploads an image or a video as a binary multipart body.
+
+        Args:
+            upload_payload: The fields of the upload (see :class:`UploadPayload`); the `image` and `video` fields
+                may be buffers (a :class:`MediaBuffer`, a :class:`io.BytesIO` or a memoryview), which are sent as a
+                whole without copying them, or binary file objects, which are streamed in chunks from their position.
+            anon: Whether to upload anonymously, i.e. without the client authorization.
+
+        Returns:
+            The data of the imgur response, e.g. with the `link` of the upload, and the stats of the upload.
+
+        Raises:
+            UploadFailureException: If the upload is rejected or still fails after all retries.
+        """
+        self._init_session()
         url = f'{self.api_url}/upload'
-        data = upload_payload
-        video = data.pop('video', None)
-        _post_params = {
-            # **self._default_request_params,
-            'url': url,
-            'headers': {
-                **(self.headers if not anon else {}),
-            },
-            'data': data,
-        }
-        if video is not None:
-            _post_params['files'] = [('video', video)]
-        # async with aiohttp.ClientSession() as session:
-        #     async with session.post(**_post_params) as response:
-        with requests.Session() as s:
-            with s.post(**_post_params) as response:
-                imgur_response = response.json()
-                return imgur_response['data']
+        headers = {**(self.headers if not anon else {})}
+        # file objects are read from their current position again on every attempt
+        offsets = {k: v.tell() for k, v in upload_payload.items() if _is_file(v)}
+        stats = _UploadStatsRecorder()
+        with tracing.span('upload', anon=anon) as span:
+            async with self._semaphore:
+                for attempt in range(self.max_retries + 1):
+                    for k, offset in offsets.items():
+                        upload_payload[k].seek(offset)
+                    delay = self.backoff_seconds * 2 ** attempt
+                    stats.attempts += 1
+                    span.set('attempts', stats.attempts)
+                    try:
+                        form, stats.payload_bytes = self._form_data(upload_payload)
+                        span.set('bytes', stats.payload_bytes)
+                        async with self._session.post(url, headers=headers, data=form, trace_request_ctx=stats) as r:
+                            span.set('status', r.status)
+                            if r.status not in RETRY_STATUSES:
+                                return await self._response_data(r), stats.done()
+                            delay = self._retry_after(r, default=delay)
+                            reason = f'status {r.status}'
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                        reason = f'{type(err).__name__}: {err}'
+                    if attempt < self.max_retries:
+                        self.logger.warning(
+                            f'Upload attempt {attempt + 1} failed ({reason}). Retrying in {delay:.1f}s...'
+                        )
+                        await asyncio.sleep(delay)
+            raise UploadFailureException(f'Upload failed after {self.max_retries + 1} attempts ({reason}).')
+
+    @staticmethod
+    def _form_data(upload_payload: Dict[str, Any]) -> Tuple[aiohttp.FormData, int]:
+        """Returns the multipart form of the upload and the size of its binary fields."""
+        form = aiohttp.FormData()
+        size = 0
+        for name, value in upload_payload.items():
+            if isinstance(value, (MediaBuffer, io.BytesIO, bytes, bytearray, memoryview)):
+                # sent as a whole from the buffer (or the memory map of its file) itself: neither read into a copy nor
+                # base64 encoded
+                view = value.getbuffer() if isinstance(value, (MediaBuffer, io.BytesIO)) else memoryview(value)
+                form.add_field(name, BufferPayload(view), filename=name)
+                size += view.nbytes
+            elif _is_file(value):
+                # streamed in chunks instead of being read into memory as a whole
+                filename = os.path.basename(getattr(value, 'name', name))
+                form.add_field(name, value, filename=filename, content_type='application/octet-stream')
+                size += os.fstat(value.fileno()).st_size - value.tell()
+            else:
+                form.add_field(name, str(value))
+        return form, size
+
+    @staticmethod
+    async def _response_data(response: aiohttp.ClientResponse) -> Dict[str, Any]:
+        try:
+            imgur_response = await response.json(content_type=None)
+        except ValueError:
+            raise UploadFailureException(f'Upload failed with status {response.status} and an invalid response.')
+        if not imgur_response.get('success', False):
+            raise UploadFailureException(
+                f'Upload failed with status {response.status}: {imgur_response.get("data", {}).get("error")}'
+            )
+        return imgur_response['data']
+
+    @staticmethod
+    def _retry_after(response: aiohttp.ClientResponse, default: float) -> float:
+        try:
+            return min(float(response.headers['Retry-After']), MAX_RETRY_AFTER_SECONDS)
+        except (KeyError, ValueError):
+            return default
@@ -0,0 +1,171 @@
+import re
+import struct
+from typing import IO, List, Optional
+
+import requests
+
+from src.client.download import shared_session
+from src.util import mp4_utilities
+from src.util.logger import task_logger
+from src.util.media_buffer import MediaBuffer
+from src.util.metrics import DOWNLOADED_BYTES
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+# the maximum number of top-level boxes that are inspected while looking for the `moov` (and `sidx`) box
+MAX_TOP_LEVEL_BOXES = 16
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class _RangeReader(object):
+    """Reads byte ranges of a single resource and keeps track of the downloaded bytes."""
+
+    def __init__(self, session: requests.Session, url: str, probe_bytes: int):
+        self._session = session
+        self.url = url
+        self.fetched = 0
+        self.probe = b''
+        self.probe, self.total = self._get(0, probe_bytes)
+
+    def _get(self, start: int, end: int):
+        """Returns the bytes [start, end) and the total size of the resource."""
+        with self._session.get(self.url, headers={'Range': f'bytes={start}-{end - 1}'}, stream=True) as response:
+            if response.status_code != 206:
+                # the body is not consumed, so hosts ignoring the range header do not cost a full download
+                raise RangeNotSupported(f'Host answered range request with {response.status_code}.')
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+            if match is None or match.group(3) == '*':
+                raise RangeNotSupported('Host did not send the total size of the resource.')
+            content = response.content
+        self.fetched += len(content)
+        DOWNLOADED_BYTES.inc(len(content))
+        return content, int(match.group(3))
+
+    def read(self, start: int, end: int) -> bytes:
+        """Returns the bytes [start, end) either from the already fetched probe or with a range request."""
+        end = min(end, self.total)
+        if end <= len(self.probe):
+            return self.probe[start:end]
+        return self._get(start, end)[0]
+
+
+class PartialMediaFetcher(object):
+    """Fetches only the bytes of a progressive or `sidx` indexed fragmented MP4/MOV needed to cut a time range.
+
+    The `moov` box is read with small range requests and the requested range is mapped to sample (or subsegment)
+    byte ranges via the stts/stss/stsz/stsc/stco sample tables. For progressive files the fetched bytes are written at
+    their original offsets into a sparse file, so the untouched sample tables stay valid and the holes cost no disk
+    space. For fragmented files the header and the selected self-contained fragments are concatenated into a minimal
+    file which keeps the original timestamps of the fragments. Whenever a partial fetch is not possible, None is
+    returned so that the caller falls back to a full download.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, min_duration: float = 30, max_ratio: float = 0.5,
+                 probe_bytes: int = 64 * 1024, max_gap: int = 64 * 1024):
+        self._session = shared_session() if session is None else session
+        self._min_duration = min_duration
+        self._max_ratio = max_ratio
+        self._probe_bytes = probe_bytes
+        self._max_gap = max_gap
+
+    def is_worthwhile(self, duration: Optional[float], start_ms: float, end_ms: Optional[float]) -> bool:
+        """Returns True if the media is long enough and the requested range small enough to fetch it partially.
+
+        Args:
+            duration: The total duration of the media in seconds, if known.
+            start_ms: The start of the requested range in milliseconds.
+            end_ms: The end of the requested range in milliseconds.
+        """
+        if duration is None or end_ms is None or duration < self._min_duration:
+            return False
+        return (end_ms - start_ms) / (duration * 1000) <= self._max_ratio
+
+    def fetch(self, url: str, start_ms: float, end_ms: float, suffix: str = '') -> Optional[MediaBuffer]:
+        """Returns a file backed buffer (deleted on close) with the media needed to cut [start_ms, end_ms] or None."""
+        try:
+            return self._fetch(url=url, start=start_ms / 1000, end=end_ms / 1000, suffix=suffix)
+        except RangeNotSupported as err:
+            task_logger.info(f'Falling back to a full download: {err}')
+        except (ValueError, IndexError, KeyError, struct.error) as err:
+            task_logger.warning(f'Failed to parse the MP4 structure, falling back to a full download: {err}')
+        return None
+
+    @staticmethod
+    def _find_top_level_boxes(reader: _RangeReader) -> List[mp4_utilities.Mp4Box]:
+        boxes: List[mp4_utilities.Mp4Box] = []
+        offset = 0
+        while offset < reader.total and len(boxes) < MAX_TOP_LEVEL_BOXES:
+            header = reader.read(offset, offset + 16)
+            box = mp4_utilities.parse_box_header(header, base_offset=offset)
+            if box is None or (box.size < box.header_size and header[:4] != b'\x00\x00\x00\x00'):
+                raise ValueError(f'Invalid box header at offset {offset}.')
+            if header[:4] == b'\x00\x00\x00\x00':
+                # the last box extends to the end of the file
+                box = mp4_utilities.Mp4Box(type=box.type, offset=offset, size=reader.total - offset, header_size=8)
+            boxes.append(box)
+            types = {b.type for b in boxes}
+            if box.type == 'moof' or 'moov' in types and ('sidx' in types or box.type == 'mdat'):
+                break  # moov is known and either the index or the media data follows it
+            offset = box.end
+        return boxes
+
+    def _fetch(self, url: str, start: float, end: float, suffix: str) -> Optional[MediaBuffer]:
+        reader = _RangeReader(session=self._session, url=url, probe_bytes=self._probe_bytes)
+        boxes = self._find_top_level_boxes(reader)
+        moov = next((box for box in boxes if box.type == 'moov'), None)
+        if moov is None:
+            raise ValueError('No moov box found.')
+        moov_bytes = reader.read(moov.offset, moov.end)
+
+        # on disk from the start, as progressive media is written sparsely at its original offsets
+        output = MediaBuffer.on_disk(suffix=suffix)
+        try:
+            if mp4_utilities.is_fragmented(moov_bytes, base_offset=moov.offset):
+                self._write_fragments(reader, output, boxes, moov_bytes, start=start, end=end)
+            else:
+                self._write_samples(reader, output, moov, moov_bytes, start=start, end=end)
+            output.flush()
+        except BaseException:
+            output.close()
+            raise
+        task_logger.info(f'Partially fetched {reader.fetched} of {reader.total} bytes of {url}.')
+        output.seek(0)
+        return output
+
+    def _write_samples(self, reader: _RangeReader, output: IO[bytes], moov: mp4_utilities.Mp4Box,
+                       moov_bytes: bytes, start: float, end: float) -> None:
+        tracks = mp4_utilities.parse_tracks(moov_bytes, base_offset=moov.offset)
+        if not tracks:
+            raise ValueError('No supported tracks found.')
+        # progressive layout: keep every box at its original offset, leave the unneeded samples as holes
+        output.truncate(reader.total)
+        output.seek(0)
+        output.write(reader.probe)
+        output.seek(moov.offset)
+        output.write(moov_bytes)
+        for range_start, range_end in mp4_utilities.sample_byte_ranges(tracks, start, end, max_gap=self._max_gap):
+            output.seek(range_start)
+            output.write(reader.read(range_start, range_end))
+
+    @staticmethod
+    def _write_fragments(reader: _RangeReader, output: IO[bytes], boxes: List[mp4_utilities.Mp4Box],
+                         moov_bytes: bytes, start: float, end: float) -> None:
+        sidx = next((box for box in boxes if box.type == 'sidx'), None)
+        if sidx is None:
+            raise RangeNotSupported('Fragmented media without segment index.')
+        segments = mp4_utilities.parse_sidx(reader.read(sidx.offset, sidx.end), base_offset=sidx.offset)
+        if not segments:
+            raise RangeNotSupported('Hierarchical or empty segment index.')
+        selected = mp4_utilities.select_segments(segments, start=start, end=end)
+        range_start, range_end = selected[0].offset, selected[-1].offset + selected[-1].size
+        fragments = reader.read(range_start, range_end)
+        if mp4_utilities.has_absolute_base_offsets(fragments, base_offset=range_start):
+            raise RangeNotSupported('Fragments use absolute base data offsets.')
+        # minimal layout: the file type, the movie header and the selected self-contained fragments
+        ftyp = next((box for box in boxes if box.type == 'ftyp'), None)
+        if ftyp is not None:
+            output.write(reader.read(ftyp.offset, ftyp.end))
+        output.write(moov_bytes)
+        output.write(fragments)
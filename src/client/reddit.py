@@ -1,41 +1,108 @@
-from typing import AsyncIterator
+from typing import Dict, Iterable, List, Optional
 from typing import Union
 
 import asyncpraw
 from asyncpraw.models import Comment
 from asyncpraw.models import Message
+from asyncpraw.models import Submission
+from asyncprawcore import Requestor
 
+from src.cache.ttl import TtlCache
 from src.util.config import REDDIT_CLIENT_ID
 from src.util.config import REDDIT_CLIENT_SECRET
 from src.util.config import REDDIT_PASSWORD
 from src.util.config import REDDIT_USERNAME
 from src.util.config import USER_AGENT
+from src.util.logger import root_logger
+
+
+class CountingRequestor(Requestor):
+    """A requestor that counts the HTTP requests sent to the reddit API."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingRequestor, self).__init__(*args, **kwargs)
+        self.requests = 0
+
+    async def request(self, *args, **kwargs):
+        self.requests += 1
+        return await super(CountingRequestor, self).request(*args, **kwargs)
 
 
 class RedditClient:
-    def __init__(self):
-        self._instance = asyncpraw.Reddit(
+    """The reddit client of the bot that ingests the inbox with as few API requests as possible.
+
+    The inbox is paged once per fetch (100 items per request), the submissions of all mentions are loaded in batches
+    of 100 fullnames and kept for `submission_cache_seconds`, so that mentions of the same submission share one load,
+    and items are marked read in batches of 25.
+
+    Attributes:
+        submission_cache_seconds    The time a loaded submission is reused for further mentions.
+    """
+
+    def __init__(self, submission_cache_seconds: float = 60, instance: Optional[asyncpraw.Reddit] = None):
+        self.submission_cache_seconds = submission_cache_seconds
+        self._instance = instance if instance is not None else asyncpraw.Reddit(
             user_agent=USER_AGENT,
             client_id=REDDIT_CLIENT_ID,
             client_secret=REDDIT_CLIENT_SECRET,
             username=REDDIT_USERNAME,
             password=REDDIT_PASSWORD,
             ratelimit_seconds='60000',
+            requestor_class=CountingRequestor,
         )
+        self._submissions: TtlCache[Submission] = TtlCache(ttl_seconds=submission_cache_seconds)
 
-    async def has_new_message(self) -> bool:
-        """Checks whether a new message is in the inbox.
+    @property
+    def api_calls(self) -> int:
+        """The number of requests sent to the reddit API so far."""
+        return getattr(self._instance.requestor, 'requests', 0)
+
+    async def fetch_new_messages(self) -> List[Union[Comment, Message]]:
+        """Returns all unread inbox items, paging the inbox once."""
+        return [item async for item in self._instance.inbox.unread(limit=None)]
+
+    async def load_submissions(self, items: Iterable[Union[Comment, Message]]) -> List[Union[Comment, Message]]:
+        """Loads the submissions of the given inbox items in batches and attaches them to the items.
+
+        Submissions are looked up by fullname, once for all items that refer to the same submission, and recently
+        loaded submissions are reused from the cache.
 
         Returns:
-            True if there are messages in the inbox, False otherwise.
+            The items with a loaded submission; private messages and mentions of deleted submissions are left out.
         """
-        inbox = self._instance.inbox.unread(limit=None)
-        # return any([True async for _ in inbox])
-        try:
-            await inbox.__anext__()
-            return True
-        except StopAsyncIteration:
-            return False
-
-    def fetch_new_messages(self) -> AsyncIterator[Union[Comment, Message]]:
-        return self._instance.inbox.unread(limit=None)
+        items = list(items)
+        loaded = set()
+        pending: Dict[str, List[Union[Comment, Message]]] = {}
+        for item in items:
+            submission: Optional[Submission] = getattr(item, 'submission', None)  # lazy, no request is sent
+            if submission is None:
+                continue
+            cached = self._submissions.get(submission.fullname)
+            if cached is not None:
+                item.submission = cached
+                loaded.add(id(item))
+            else:
+                pending.setdefault(submission.fullname, []).append(item)
+        if pending:
+            async for submission in self._instance.info(fullnames=list(pending)):
+                self._submissions.put(submission.fullname, submission)
+                for item in pending.pop(submission.fullname, []):
+                    item.submission = submission
+                    loaded.add(id(item))
+        for fullname in pending:
+            root_logger.warning(f'Submission {fullname} could not be loaded.')
+        return [item for item in items if id(item) in loaded]
+
+    def inbox_item(self, fullname: str) -> Union[Comment, Message]:
+        """Returns the (lazy) inbox item of `fullname` to reply to without a request, e.g. in another process than
+        the one that fetched it.
+        """
+        kind, _, item_id = fullname.partition('_')
+        if kind == 't1':
+            return Comment(self._instance, id=item_id)
+        return Message(self._instance, {'id': item_id, 'name': fullname})
+
+    async def mark_read(self, items: List[Union[Comment, Message]]) -> None:
+        """Marks the given inbox items read; asyncpraw sends them in chunks of 25, the most reddit accepts per request."""
+        if items:
+            await self._instance.inbox.mark_read(list(items))
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import dataclasses
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from src.execution.scheduling import cut_range_seconds, estimate_cpu_seconds
+from src.model.admission import AdmissionOutcome
+from src.model.media_type import MediaType
+
+if TYPE_CHECKING:
+    from src.client.media import PartialMediaFetcher
+    from src.execution.task import TaskConfig
+
+
+def _megabytes(size: float) -> str:
+    return f'{size / (1024 * 1024):.0f}MB'
+
+
+@dataclass(frozen=True)
+class Admission:
+    """The decision about a request before its source is fetched.
+
+    Attributes:
+        outcome     Whether the request is cut as it is, clamped, downgraded or rejected.
+        config      The task config to cut, i.e. the clamped or downgraded one (the requested one if it is rejected).
+        reasons     Why the request was clamped, downgraded or rejected, in the words of a reply.
+    """
+    outcome: AdmissionOutcome
+    config: TaskConfig
+    reasons: Tuple[str, ...] = ()
+
+    @property
+    def reason(self) -> str:
+        return '; '.join(self.reasons)
+
+
+class AdmissionControl(object):
+    """Decides before any media bytes are fetched whether a request fits the budgets of a cut.
+
+    It only uses what is known up front: the requested range, the duration reddit reports for videos and the size of
+    the source (e.g. the `Content-Length` of a `HEAD` request). A request is
+        - clamped to the duration budget and to the range whose stream copy fits the output budget (the upload limit),
+        - downgraded (without watermark, then without transcode) if its estimated CPU time exceeds the CPU budget and
+        - rejected if its download exceeds the byte budget or if even the downgraded cut exceeds the CPU budget.
+    A budget of 0 is not enforced.
+
+    Attributes:
+        max_source_bytes    The budget of bytes a request downloads (of the requested range if it is partially
+                            fetched).
+        max_cut_seconds     The budget of the length of the requested range in seconds.
+        max_output_bytes    The budget of the estimated size of a cut video, e.g. the upload limit of imgur.
+        max_cpu_seconds     The budget of the estimated CPU seconds of a cut (see :func:`estimate_cpu_seconds`).
+    """
+
+    def __init__(self, max_source_bytes: int = 0, max_cut_seconds: float = 0, max_output_bytes: int = 0,
+                 max_cpu_seconds: float = 0):
+        self.max_source_bytes = max_source_bytes
+        self.max_cut_seconds = max_cut_seconds
+        self.max_output_bytes = max_output_bytes
+        self.max_cpu_seconds = max_cpu_seconds
+
+    def admit(self, config: TaskConfig, source_bytes: Optional[int] = None,
+              partial_fetcher: Optional[PartialMediaFetcher] = None) -> Admission:
+        """Returns the decision about the request of `config`.
+
+        Args:
+            config: The task config of the request.
+            source_bytes: The size of the source or None if it is not known before it is fetched.
+            partial_fetcher: The fetcher of the requested range of long videos or None if sources are fetched in full.
+        """
+        outcome: AdmissionOutcome = AdmissionOutcome.ADMIT
+        reasons: List[str] = []
+
+        clamped_seconds: Optional[float] = self._clamped_seconds(config, source_bytes=source_bytes, reasons=reasons)
+        if clamped_seconds is not None:
+            outcome = AdmissionOutcome.CLAMP
+            config = dataclasses.replace(config, end=config.start + clamped_seconds * 1000)
+
+        fetch_bytes: Optional[float] = self._fetch_bytes(config, source_bytes=source_bytes,
+                                                         partial_fetcher=partial_fetcher)
+        if 0 < self.max_source_bytes < (fetch_bytes or 0):
+            reasons.append(f'the source is {_megabytes(fetch_bytes)}, more than the '
+                           f'{_megabytes(self.max_source_bytes)} I download')
+            return Admission(AdmissionOutcome.REJECT, config=config, reasons=tuple(reasons))
+
+        if 0 < self.max_cpu_seconds < estimate_cpu_seconds(config):
+            if config.watermark is not None:
+                reasons.append('the watermark is left out to keep the cut within my time limit')
+                config = dataclasses.replace(config, watermark=None)
+                outcome = AdmissionOutcome.DOWNGRADE
+            if self.max_cpu_seconds < estimate_cpu_seconds(config) and config.media_type == MediaType.GIF and \
+                    config.output_type not in (None, MediaType.GIF):
+                reasons.append(f'the GIF is not converted to {config.output_type.name} to keep the cut within my '
+                               f'time limit')
+                config = dataclasses.replace(config, output_type=MediaType.GIF)
+                outcome = AdmissionOutcome.DOWNGRADE
+            if self.max_cpu_seconds < estimate_cpu_seconds(config):
+                reasons.append(f'the cut would take about {estimate_cpu_seconds(config):.0f}s, more than the '
+                               f'{self.max_cpu_seconds:.0f}s I spend on a cut')
+                return Admission(AdmissionOutcome.REJECT, config=config, reasons=tuple(reasons))
+        return Admission(outcome, config=config, reasons=tuple(reasons))
+
+    def _clamped_seconds(self, config: TaskConfig, source_bytes: Optional[int], reasons: List[str]) -> Optional[float]:
+        # the range is only clamped if its length is known, i.e. a GIF without an end is bounded by its handler
+        if config.end is None and config.duration is None:
+            return None
+        requested: float = cut_range_seconds(config)
+        allowed: float = requested
+        if 0 < self.max_cut_seconds < allowed:
+            allowed = self.max_cut_seconds
+            reasons.append(f'the requested {requested:.0f}s are cut to the first {allowed:.0f}s, the most I cut')
+        if self.max_output_bytes > 0 and config.media_type != MediaType.GIF and config.duration and source_bytes:
+            # a stream copy of the range has about the bitrate of the source
+            bytes_per_second: float = source_bytes / config.duration
+            if allowed * bytes_per_second > self.max_output_bytes:
+                allowed = max(int(self.max_output_bytes / bytes_per_second), 1)
+                reasons.append(f'the cut is shortened to {allowed:.0f}s to stay within the '
+                               f'{_megabytes(self.max_output_bytes)} upload limit')
+        return allowed if allowed < requested else None
+
+    @staticmethod
+    def _fetch_bytes(config: TaskConfig, source_bytes: Optional[int],
+                     partial_fetcher: Optional[PartialMediaFetcher]) -> Optional[float]:
+        if source_bytes is None:
+            return None
+        if partial_fetcher is not None and config.media_type in (MediaType.MP4, MediaType.MOV) and \
+                partial_fetcher.is_worthwhile(duration=config.duration, start_ms=config.start, end_ms=config.end):
+            # only the samples of the requested range are fetched
+            return source_bytes * cut_range_seconds(config) / config.duration
+        return source_bytes
@@ -1,24 +1,46 @@
 import asyncio
-import base64
-from typing import AsyncIterator, Optional
+import contextvars
+import functools
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Set
 from typing import Union
 
 from asyncpraw.models import Message
 from asyncpraw.reddit import Comment
 
 import src.execution.task as t
+from src.cache.result import ResultCache, result_cache_key_for
+from src.cache.source import SourceCache
+from src.client.download import MediaDownloader
+from src.client.media import PartialMediaFetcher
 from src.client.imgur import ImgurClient
 from src.client.reddit import RedditClient
+from src.execution.admission import Admission, AdmissionControl
+from src.execution.job import CutJob, CutOutput
+from src.execution.journal import JournalEntry, TaskJournal
+from src.execution.record import CutRecord, UploadRecord
+from src.execution.pool import CutWorkerPool
+from src.execution.scheduling import ShortestJobFirstQueue, estimate_cut_seconds
+from src.execution.transport import StageQueue
+from src.handler.strategy import CutStrategy
+from src.model.admission import AdmissionOutcome
+from src.model.cut_mode import CutPolicy
 from src.model.execution_mode import ExecutionMode
 from src.model.media_type import MediaType
 from src.model.result import Result
+from src.model.task_stage import TaskStage
 from src.model.task_state import TaskConfigState
 from src.model.task_state import TaskState
-from src.util import decorator, config
-from src.util.exception import TaskFailureException
+from src.util import config
+from src.util import metrics
+from src.util import tracing
+from src.util.exception import MediaTooLargeException, TaskFailureException, UploadFailureException
 from src.util.logger import cut_logger
 from src.util.logger import root_logger
 from src.util.logger import upload_logger
+from src.util.media_buffer import MediaBuffer
 
 
 # from imgurpython import ImgurClient
@@ -29,27 +51,141 @@ def log_broad_exception(err, logger=cut_logger) -> None:
 
 
 class AioController(object):
+    """Dictates the workflow of the bot: the inbox is fetched into the input (cut) queue, whose tasks are cut into
+    the output (upload) queue, whose results are uploaded and answered.
+
+    All stages run on the event loop of one process with asyncio queues between them, or each stage runs in processes
+    of its own (see :mod:`src.main`) with :class:`StageQueue` s over a shared transport between them.
+    """
     # asyncio queue's: https://stackoverflow.com/a/24704950/2402281
-    input_queue: asyncio.Queue
-    output_queue: asyncio.Queue
+    input_queue: Union[asyncio.Queue, StageQueue]
+    output_queue: Union[asyncio.Queue, StageQueue]
 
-    def __init__(self, input_queue: asyncio.Queue, output_queue: asyncio.Queue,
-                 mode: ExecutionMode = ExecutionMode.NORMAL):
+    def __init__(self, input_queue: Union[asyncio.Queue, StageQueue], output_queue: Union[asyncio.Queue, StageQueue],
+                 mode: ExecutionMode = ExecutionMode.NORMAL, result_cache: Optional[ResultCache] = None,
+                 source_cache: Optional[SourceCache] = None, cut_strategy: Optional[CutStrategy] = None,
+                 journal: Optional[TaskJournal] = None):
         self._mode = mode
         self.output_queue = output_queue
         self.input_queue = input_queue
         self.reddit = None
         self.imgur = None
+        self.result_cache = result_cache
+        self.source_cache = source_cache
+        self.partial_fetcher = None
+        self.admission: Optional[AdmissionControl] = None
+        self.cut_strategy = cut_strategy
+        self._init_cut_strategy()
+        self.cut_pool: Optional[CutWorkerPool] = None
+        self.downloader: Optional[MediaDownloader] = None
+        self.journal = journal
+        # fullnames of the messages whose requests are in the stages; their messages stay unread until they are answered
+        self._active: Set[str] = set()
+        # answered (or failed) messages that are marked read with the next fetch
+        self._answered: List[Message] = []
+        # cache keys of the cuts that are queued or running and the further messages that requested the same cut
+        self._in_flight: Dict[str, List[Message]] = {}
+        # delayed requeues of invalid tasks and of messages attached to failed cuts; the loop only keeps weak
+        # references to its tasks
+        self._requeues: Set[asyncio.Task] = set()
+        self._init_metrics()
+
+    def _init_metrics(self) -> None:
+        # the queue depths are read when the metrics are scraped
+        metrics.QUEUE_DEPTH.labels('input').set_function(self.input_queue.qsize)
+        metrics.QUEUE_DEPTH.labels('output').set_function(self.output_queue.qsize)
 
     def _init_reddit_client(self) -> None:
         if self.reddit is None:
             root_logger.info('Initializing async reddit client.')
-            self.reddit: RedditClient = RedditClient()
+            self.reddit: RedditClient = RedditClient(submission_cache_seconds=config.REDDIT_SUBMISSION_CACHE_SECONDS)
 
     def _init_imgur_client(self) -> None:
         if self.imgur is None:
-            root_logger.info('Initializing sync imgur client.')
-            self.imgur: ImgurClient = ImgurClient(config.IMGUR_CLIENT_ID, config.IMGUR_CLIENT_SECRET)
+            root_logger.info('Initializing async imgur client.')
+            self.imgur: ImgurClient = ImgurClient(
+                config.IMGUR_CLIENT_ID, config.IMGUR_CLIENT_SECRET,
+                max_concurrency=config.IMGUR_UPLOAD_CONCURRENCY,
+                timeout=config.IMGUR_TIMEOUT_SECONDS,
+                max_retries=config.IMGUR_MAX_RETRIES,
+                backoff_seconds=config.IMGUR_RETRY_BACKOFF_SECONDS,
+            )
+
+    def _init_result_cache(self) -> None:
+        if self.result_cache is None:
+            root_logger.info('Initializing cut result cache.')
+            self.result_cache: ResultCache = ResultCache(
+                directory=config.RESULT_CACHE_DIR,
+                max_bytes=config.RESULT_CACHE_MAX_BYTES,
+                max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+                store_media=config.RESULT_CACHE_STORE_MEDIA,
+            )
+
+    def _init_source_cache(self) -> None:
+        if self.source_cache is None and config.SOURCE_CACHE_ENABLED:
+            root_logger.info('Initializing source media cache.')
+            self.source_cache: SourceCache = SourceCache(
+                directory=config.SOURCE_CACHE_DIR,
+                max_bytes=config.SOURCE_CACHE_MAX_BYTES,
+                revalidate_seconds=config.SOURCE_CACHE_REVALIDATE_SECONDS,
+                max_source_bytes=config.DOWNLOAD_MAX_BYTES,
+            )
+
+    def _init_journal(self) -> None:
+        if self.journal is None and config.TASK_JOURNAL_ENABLED:
+            root_logger.info('Initializing request journal.')
+            self.journal: TaskJournal = TaskJournal(
+                directory=config.TASK_JOURNAL_DIR, retention_seconds=config.TASK_JOURNAL_RETENTION_SECONDS
+            )
+            _pending: List[JournalEntry] = self.journal.pending()
+            if len(_pending) > 0:
+                root_logger.info(f'{len(_pending)} unanswered request(s) resume once their messages are fetched.')
+
+    def _init_partial_fetcher(self) -> None:
+        if self.partial_fetcher is None and config.PARTIAL_FETCH_ENABLED:
+            root_logger.info('Initializing partial media fetcher.')
+            self.partial_fetcher: PartialMediaFetcher = PartialMediaFetcher(
+                min_duration=config.PARTIAL_FETCH_MIN_DURATION_SECONDS,
+                max_ratio=config.PARTIAL_FETCH_MAX_RATIO,
+            )
+
+    def _init_admission(self) -> None:
+        if self.admission is None and config.ADMISSION_ENABLED:
+            root_logger.info('Initializing admission control.')
+            self.admission: AdmissionControl = AdmissionControl(
+                max_source_bytes=config.ADMISSION_MAX_SOURCE_BYTES,
+                max_cut_seconds=config.ADMISSION_MAX_CUT_SECONDS,
+                max_output_bytes=config.ADMISSION_MAX_OUTPUT_BYTES,
+                max_cpu_seconds=config.ADMISSION_MAX_CPU_SECONDS,
+            )
+
+    def _init_cut_strategy(self) -> None:
+        if self.cut_strategy is None:
+            root_logger.info(f'Initializing cut strategy with {config.CUT_POLICY} policy.')
+            self.cut_strategy: CutStrategy = CutStrategy(
+                policy=CutPolicy(config.CUT_POLICY),
+                keyframe_tolerance_ms=config.CUT_KEYFRAME_TOLERANCE_MS,
+            )
+
+    def _init_downloader(self) -> None:
+        if self.downloader is None:
+            root_logger.info('Initializing async media downloader.')
+            self.downloader: MediaDownloader = MediaDownloader(
+                max_concurrency=config.DOWNLOAD_CONCURRENCY,
+                connections_per_host=config.DOWNLOAD_CONNECTIONS_PER_HOST,
+                keepalive_seconds=config.DOWNLOAD_KEEPALIVE_SECONDS,
+                timeout=config.DOWNLOAD_TIMEOUT_SECONDS,
+                max_bytes=config.DOWNLOAD_MAX_BYTES,
+                spool_bytes=config.DOWNLOAD_SPOOL_BYTES,
+                spool_dir=config.DOWNLOAD_SPOOL_DIR,
+            )
+
+    def _init_cut_pool(self) -> None:
+        if self.cut_pool is None and config.CUT_WORKERS > 0:
+            root_logger.info(f'Initializing cut worker pool with {config.CUT_WORKERS} processes.')
+            self.cut_pool: CutWorkerPool = CutWorkerPool(
+                max_workers=config.CUT_WORKERS, output_dir=config.CUT_OUTPUT_DIR
+            )
 
     # async def run(self, *args, **kwargs) -> None:
     #     self._init_reddit_client()
@@ -63,113 +199,573 @@ class AioController(object):
         """
         # todo custom logger
         self._init_reddit_client()
+        self._init_result_cache()
+        self._init_source_cache()
+        self._init_partial_fetcher()
+        self._init_downloader()
+        self._init_journal()
+        self._init_admission()
         root_logger.info('Fetching new messages...')
         try:
             await self._fill_task_queue_from_reddit()
         except Exception as err:
+            metrics.FAILURES.labels('inbox').inc()
             log_broad_exception(err, logger=root_logger)
 
-    @decorator.run_in_executor
-    def work(self) -> None:
-        """Performs the work (GIF or VID cutting) on the input queue and writes the results in the output queue.
+    def start_consumers(self, loop: asyncio.AbstractEventLoop, cut_concurrency: int,
+                        upload_concurrency: int) -> List[asyncio.Task]:
+        """Starts the long-lived consumers of the input (cut) and output (upload) queue.
+
+        The number of consumers of a stage limits its concurrency, while bounded queues put back pressure on the
+        previous stage.
+        """
+        root_logger.info(f'Starting {cut_concurrency} cut and {upload_concurrency} upload consumers.')
+        return [loop.create_task(self._consume(self.work, logger=cut_logger)) for _ in range(cut_concurrency)] + [
+            loop.create_task(self._consume(self.upload_and_answer, logger=upload_logger))
+            for _ in range(upload_concurrency)
+        ]
+
+    @staticmethod
+    async def _consume(step, logger) -> None:
+        while True:
+            try:
+                await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                log_broad_exception(err, logger=logger)
+
+    async def work(self) -> None:
+        """Performs the work (GIF or VID cutting) of the next task on the input queue and writes the result in the
+        output queue. Waits until a task is available.
         """
-        cut_logger.info('Working on input queue...')
-        _task = self._read_from_input_queue()
-        if _task is None:
-            # todo modify controller state?
+        self._init_cut_pool()
+        _task: t.Task = await self._get(self.input_queue)
+        try:
+            self._observe_queue_wait(_task, queue='input')
+            if _task.is_state([TaskState.DROP, TaskState.DONE]):
+                cut_logger.info('Dropping task from input queue...')
+                cut_logger.debug(f'Task: {_task}')
+                self._fail_task(_task)
+                return  # get already removed task from queue, just need to return
+            elif _task.is_state(TaskState.INVALID):
+                # put task back into input queue after a while
+                cut_logger.info('Task is invalid. Putting back into input queue...')
+                cut_logger.debug(f'Task: {_task}')
+                self._schedule_requeue(task=_task)
+            elif _task.is_state(TaskState.VALID):
+                with tracing.span('cut', trace_id=_task.trace_id):
+                    cut_logger.info('Task is valid. May the cutting begin!')
+                    if self.cut_pool is None:
+                        _result = await self._run_in_executor(self._exert_task, _task)
+                    else:
+                        _result = await self._exert_task_in_pool(task=_task)
+                    cut_logger.debug(f'Obtained task result: {_result}')
+                    self._observe_cut_result(_result)
+                    if _result is not None:
+                        await self._run_in_executor(self._checkpoint_cut, _result)
+                    if _result is None or not await self._write_result_to_output_queue(result=_result):
+                        self._fail_task(_task)
+        finally:
+            self._task_done(self.input_queue, _task)
+
+    async def _get(self, queue: Union[asyncio.Queue, StageQueue]) -> Union[t.Task, Result]:
+        # waits for the next item of the queue; records received from another process become tasks and results again
+        while True:
+            _item: Union[t.Task, Result, CutRecord, UploadRecord] = await queue.get()
+            try:
+                if isinstance(_item, CutRecord):
+                    return self._task_from_record(_item)
+                if isinstance(_item, UploadRecord):
+                    return self._result_from_record(_item)
+                return _item
+            except Exception as err:
+                # e.g. the media of the record is gone: it would fail every time it is received
+                root_logger.error(f'Dropping {_item} ({type(err).__name__}): {err}')
+                queue.ack(_item)
+                queue.task_done()
+
+    @staticmethod
+    def _task_done(queue: Union[asyncio.Queue, StageQueue], item: Union[t.Task, Result]) -> None:
+        # a record received from another process is leased until its stage is done with it
+        if isinstance(queue, StageQueue):
+            queue.ack(item)
+        queue.task_done()
+
+    def _task_from_record(self, record: CutRecord) -> t.Task:
+        self._init_source_cache()
+        self._init_partial_fetcher()
+        self._init_journal()
+        _task = t.Task(
+            config=record.to_config(), source_cache=self.source_cache, partial_fetcher=self.partial_fetcher,
+            cut_strategy=self.cut_strategy, max_download_bytes=config.DOWNLOAD_MAX_BYTES,
+        )
+        _task.enqueued_at = time.monotonic() - (time.time() - record.enqueued_at)
+        _task.lease = record.lease
+        return _task
+
+    def _result_from_record(self, record: UploadRecord) -> Result:
+        self._init_reddit_client()
+        self._init_journal()
+        _result = Result(
+            MediaBuffer.from_path(record.media_path, owned=True) if record.media_path is not None else None,
+            media_type=record.media_type, message=self.reddit.inbox_item(record.message_id),
+            upload_link=record.upload_link, cache_key=record.cache_key, trace_id=record.trace_id,
+        )
+        _result.enqueued_at = time.monotonic() - (time.time() - record.enqueued_at)
+        _result.lease = record.lease
+        return _result
+
+    async def mark_answered_read(self) -> None:
+        """Marks the messages answered (or failed) in this process read; a process that fetches the inbox does so
+        with every fetch.
+        """
+        self._init_reddit_client()
+        try:
+            await self.reddit.mark_read(self._take_answered())
+        except Exception as err:
+            metrics.FAILURES.labels('inbox').inc()
+            log_broad_exception(err, logger=root_logger)
+
+    @staticmethod
+    async def _run_in_executor(function, *args):
+        # the thread continues the trace of the current span (the executor does not copy the context by itself)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(contextvars.copy_context().run, function, *args)
+        )
+
+    def _schedule_requeue(self, task: Optional[t.Task] = None, messages: Optional[List[Message]] = None) -> None:
+        _coroutine = self._requeue_later(task=task) if task is not None else self._requeue_messages(messages=messages)
+        _requeue: asyncio.Task = asyncio.get_running_loop().create_task(_coroutine)
+        self._requeues.add(_requeue)
+        _requeue.add_done_callback(self._requeues.discard)
+
+    async def close(self) -> None:
+        """Cancels the pending requeues and closes the clients and the cut worker pool."""
+        for _requeue in list(self._requeues):
+            _requeue.cancel()
+        await asyncio.gather(*self._requeues, return_exceptions=True)
+        if self.downloader is not None:
+            await self.downloader.close()
+        if self.imgur is not None:
+            await self.imgur.close()
+        if self.cut_pool is not None:
+            self.cut_pool.close()
+        if self.journal is not None:
+            self.journal.close()  # answered messages that are still unread are marked read after the restart
+
+    async def _requeue_later(self, task: t.Task) -> None:
+        await asyncio.sleep(config.INVALID_TASK_RETRY_SECONDS)
+        task.enqueued_at = time.monotonic()
+        await self.input_queue.put(task)
+
+    async def _requeue_messages(self, messages: List[Message]) -> None:
+        # one after another: the first message gets a task of its own again and the others attach to it
+        for _message in messages:
+            try:
+                await self._reddit_message_to_input_queue(message=_message)
+            except Exception as err:
+                log_broad_exception(err)
+
+    @staticmethod
+    @metrics.guarded
+    def _observe_queue_wait(item: Union[t.Task, Result], queue: str) -> None:
+        _enqueued_at: Optional[float] = getattr(item, 'enqueued_at', None)
+        if _enqueued_at is not None:
+            metrics.QUEUE_WAIT_SECONDS.labels(queue).observe(time.monotonic() - _enqueued_at)
+
+    @staticmethod
+    @metrics.guarded
+    def _observe_admission(admission: Admission) -> None:
+        metrics.ADMISSIONS.labels(admission.outcome.value).inc()
+
+    @staticmethod
+    @metrics.guarded
+    def _observe_cut_result(result: Optional[Result]) -> None:
+        if result is None:
+            metrics.FAILURES.labels('cut').inc()
             return
-        if _task.is_state([TaskState.DROP, TaskState.DONE]):
-            cut_logger.info('Dropping task from input queue...')
-            cut_logger.debug(f'Task: {_task}')
-            return  # get already removed task from queue, just need to return
-        elif _task.is_state(TaskState.INVALID):
-            # put task back into input queue
-            cut_logger.info('Task is invalid. Putting back into input queue...')
-            cut_logger.debug(f'Task: {_task}')
-            self.input_queue.put_nowait(_task)
-        elif _task.is_state(TaskState.VALID):
-            cut_logger.info('Task is valid. May the cutting begin!')
-            _result = self._exert_task(task=_task)
-            cut_logger.debug(f'Obtained task result: {_result}')
-            _outcome = self._write_result_to_output_queue(result=_result)
-            if _outcome:
-                pass  # possible clean up
+        _size: Optional[int] = getattr(result.media_stream, 'size', None)  # only media buffers know their size
+        if _size is not None:
+            metrics.OUTPUT_BYTES.labels(result.media_type.name.lower()).observe(_size)
+
+    @staticmethod
+    @metrics.guarded
+    def _observe_cut(media_type: MediaType, fetch_seconds: float, cut_seconds: float, cpu_seconds: float) -> None:
+        _label: str = media_type.name.lower()
+        metrics.FETCH_SECONDS.labels(_label).observe(fetch_seconds)
+        metrics.CUT_SECONDS.labels(_label).observe(cut_seconds)
+        metrics.CUT_CPU_SECONDS.labels(_label).observe(cpu_seconds)
+
+    async def _exert_task_in_pool(self, task: t.Task) -> Optional[Result]:
+        cut_logger.info('Handling task in cut worker pool...')
+        _source: Optional[MediaBuffer] = None
+        _t0: float = time.perf_counter()
+        try:
+            # the source cache of this process is shared by all workers, they cut the cached source by its path
+            _source = await self._run_in_executor(task.prefetch_source)
+            _fetch_seconds: float = time.perf_counter() - _t0
+            self._checkpoint(task.config.message, TaskStage.DOWNLOADED)
+            _job: CutJob = CutJob.from_config(
+                task.config, source_path=_source.path if _source is not None else None,
+                parent_span_id=tracing.TRACER.current_span.span_id if tracing.TRACER.current_span else None,
+            )
+            _output: CutOutput = await asyncio.wrap_future(self.cut_pool.submit(_job))
+            tracing.TRACER.export(_output.spans)
+        except TaskFailureException as err:
+            cut_logger.error(f'Task failed: {err}')
+            return None
+        except Exception as err:
+            log_broad_exception(err)
+            return None
+        finally:
+            if _source is not None:
+                _source.close()  # removes the link of the cached source
+        metrics.DOWNLOADED_BYTES.inc(_output.downloaded_bytes)
+        self._observe_cut(task.config.media_type, fetch_seconds=_fetch_seconds + _output.fetch_seconds,
+                          cut_seconds=_output.cut_seconds, cpu_seconds=_output.cpu_seconds)
+        return Result(
+            MediaBuffer.from_path(_output.path, owned=True), media_type=_output.media_type, message=task.config.message,
+            cache_key=result_cache_key_for(task.config), trace_id=task.trace_id,
+        )
 
-    # @decorator.run_in_executor
     async def upload_and_answer(self) -> None:
-        _result: Result
+        """Uploads the next result on the output queue and answers the request in reddit. Waits until a result is
+        available.
+        """
+        _result: Result = await self._get(self.output_queue)
+        _is_cut: bool = not _result.is_uploaded  # rather than a cached result
+        _answered: bool = False
+        try:
+            self._observe_queue_wait(_result, queue='output')
+            with tracing.span('deliver', trace_id=_result.trace_id, cached=not _is_cut):
+                _answered = await self._upload_and_answer(result=_result)
+        finally:
+            if _is_cut:
+                self._release_in_flight(_result)
+            self._finish(_result.message, TaskStage.REPLIED if _answered else TaskStage.FAILED)
+            if _result.media_stream is not None:
+                _result.media_stream.close()  # releases the memory or removes the spilled file of the cut media
+            self._task_done(self.output_queue, _result)
+
+    async def _upload_and_answer(self, result: Result) -> bool:
         if self._mode == ExecutionMode.TEST:
-            _result = self._read_result_from_output_queue(logger=upload_logger)
-            if _result is None:  # fixme
-                return
+            if result.media_stream is None:
+                upload_logger.debug(f'Cached result has no media stream: {result}')
+                return True
             filename = 'test.gif'  # fixme change extension by hand when in TEST mode
             with open(filename, mode='wb') as fp:
                 # if _result.media_type == MediaType.GIF:
                 #     # save GIF into named temp file for upload with deprecated imgur lib...
                 #     _result.media_stream.save(fp=fp, format='GIF', save_all=True)
                 # else:
-                fp.write(_result.media_stream.getvalue())
+                fp.write(result.media_stream.getbuffer())
             upload_logger.debug(f'Created file: {filename}')
-            return
+            return True
         self._init_imgur_client()  # make sure imgur client is connected
         self._init_reddit_client()  # make sure reddit client is connected
-        _result = self._read_result_from_output_queue(logger=upload_logger)
-        if _result is None:  # fixme
-            upload_logger.warning('Received NoneType result.')
-            return
+        self._init_result_cache()
+        if result.is_uploaded:
+            upload_logger.info(f'Reusing uploaded result: {result}')
+            upload_link = result.upload_link
         else:
-            upload_logger.info(f'Uploading result: {_result}')
-        upload_link = self._upload_to_imgur(result=_result)
-        await self._answer_in_reddit(message=_result.message, upload_link=upload_link)
+            upload_logger.info(f'Uploading result: {result}')
+            try:
+                upload_link = await self._upload_to_imgur(result=result)
+            except UploadFailureException as err:
+                metrics.FAILURES.labels('upload').inc()
+                upload_logger.error(f'Upload failed: {err}')
+                return False
+            result.upload_link = upload_link
+            self._cache_result(result=result)
+            self._checkpoint(result.message, TaskStage.UPLOADED, upload_link=upload_link, media_type=result.media_type,
+                             artifact_path=None)
+        await self._answer_in_reddit(message=result.message, upload_link=upload_link)
+        # messages that requested the same cut while it was in flight are answered from the shared result; the result
+        # is cached by now, so later requests are answered from the cache
+        for _message in self._in_flight.pop(result.cache_key, []) if result.cache_key is not None else []:
+            _stage: TaskStage = TaskStage.FAILED
+            try:
+                await self._answer_in_reddit(message=_message, upload_link=upload_link)
+                _stage = TaskStage.REPLIED
+            except Exception as err:
+                log_broad_exception(err, logger=upload_logger)
+            finally:
+                self._finish(_message, _stage)
+        return True
+
+    def _release_in_flight(self, item: Union[t.Task, Result]) -> None:
+        # the cut of a task or result failed or was dropped: it is no longer in flight
+        _key: Optional[str] = item.cache_key if isinstance(item, Result) else result_cache_key_for(item.config)
+        _waiting: List[Message] = self._in_flight.pop(_key, [])
+        if len(_waiting) > 0:
+            # give each of the attached (still unread) messages the attempt it would have had alone
+            root_logger.warning(f'Requeueing {len(_waiting)} message(s) waiting for the failed cut: {_key}')
+            for _message in _waiting:
+                self._active.discard(self._message_id(_message))
+            self._schedule_requeue(messages=_waiting)
+
+    def _fail_task(self, task: t.Task) -> None:
+        self._release_in_flight(task)
+        self._finish(task.config.message, TaskStage.FAILED)
+
+    @staticmethod
+    def _message_id(message: Message) -> Optional[str]:
+        # the fullname is unique across comments (mentions) and private messages
+        return getattr(message, 'fullname', None)
+
+    def _checkpoint(self, message: Message, stage: TaskStage, **fields) -> None:
+        """Records in the journal that the request of the message completed `stage`."""
+        _id: Optional[str] = self._message_id(message)
+        if self.journal is None or _id is None:
+            return
+        try:
+            self.journal.advance(_id, stage, **fields)
+        except sqlite3.Error as err:
+            root_logger.warning(f'Failed to record stage {stage.name} of {_id} ({type(err).__name__}): {err}')
+
+    def _checkpoint_cut(self, result: Result) -> None:
+        # the cut media is kept as an artifact of the journal until it is uploaded, a restart uploads it from there
+        _id: Optional[str] = self._message_id(result.message)
+        if self.journal is None or _id is None or not isinstance(result.media_stream, MediaBuffer):
+            return
+        _path: str = self.journal.artifact_path(_id, result.media_type)
+        try:
+            result.media_stream.persist(_path)
+        except OSError as err:
+            root_logger.warning(f'Failed to keep the cut of {_id} ({type(err).__name__}): {err}')
+            return
+        result.media_stream = MediaBuffer.from_path(_path, owned=True)  # removed once it is uploaded
+        self._checkpoint(result.message, TaskStage.CUT, media_type=result.media_type, artifact_path=_path)
+
+    def _finish(self, message: Message, stage: TaskStage) -> None:
+        """Records the terminal `stage` of the request of the message, which is marked read with the next fetch."""
+        self._active.discard(self._message_id(message))
+        self._checkpoint(message, stage)
+        self._answered.append(message)
 
     async def _fill_task_queue_from_reddit(self) -> None:
-        if not await self.reddit.has_new_message():
+        _api_calls: int = self.reddit.api_calls
+        _t0: float = time.perf_counter()
+        _messages: List[Union[Comment, Message]] = await self.reddit.fetch_new_messages()
+        # requests answered by the processes of another stage are read by now
+        self._active.intersection_update(self._message_id(_m) for _m in _messages)
+        # messages stay unread until they are answered: skip the ones in the stages and the answered ones that are
+        # marked read with this fetch
+        _seen: Set[str] = self._active | {self._message_id(_m) for _m in self._answered}
+        _messages = [_m for _m in _messages if self._message_id(_m) is None or self._message_id(_m) not in _seen]
+        if len(_messages) == 0:
+            metrics.INBOX_FETCH_SECONDS.observe(time.perf_counter() - _t0)
             root_logger.info('No new message received.')
+            await self.reddit.mark_read(self._take_answered())
             return None
-        messages: AsyncIterator[Union[Comment, Message]] = self.reddit.fetch_new_messages()
-        async for message in messages:
-            root_logger.info('New message received.')
-            root_logger.debug(f'Received message: {message.body}')
-            await self._reddit_message_to_input_queue(message=message)
-
-    async def _reddit_message_to_input_queue(self, message: Message) -> None:
-        await message.submission.load()  # fetch submission
-        _task_config: t.TaskConfig = t.TaskConfigFactory.from_message(message=message)
+        root_logger.info(f'{len(_messages)} new messages received.')
+        _mentions: List[Union[Comment, Message]] = await self.reddit.load_submissions(_messages)
+        metrics.INBOX_FETCH_SECONDS.observe(time.perf_counter() - _t0)
+        # messages without a (loadable) submission cannot be cut, they are only marked read
+        _loaded = {id(_m) for _m in _mentions}
+        _read: List[Union[Comment, Message]] = [_m for _m in _messages if id(_m) not in _loaded]
+        try:
+            for message in _mentions:
+                root_logger.debug(f'Received message: {message.body}')
+                try:
+                    await self._reddit_message_to_input_queue(message=message)
+                except Exception as err:
+                    # one failing request must not hold up the messages after it
+                    log_broad_exception(err, logger=root_logger)
+        finally:
+            # in one call with the messages answered since the last fetch
+            await self.reddit.mark_read(_read + self._take_answered())
+            _api_calls = self.reddit.api_calls - _api_calls
+            root_logger.info(
+                f'Ingested {len(_messages)} messages with {_api_calls} reddit API calls '
+                f'({_api_calls * 100 / len(_messages):.1f} per 100 messages).'
+            )
+
+    def _take_answered(self) -> List[Message]:
+        _answered, self._answered = self._answered, []
+        return _answered
+
+    async def _reddit_message_to_input_queue(self, message: Message) -> bool:
+        """Puts the task (or the cached result) of the message with a loaded submission into the next stage's queue.
+
+        Every message starts a trace, whose ID is carried by its task (config) and result through all stages. The
+        message stays unread until it is answered; a request recorded in the journal resumes after its last stage. A
+        new cut is checked against the budgets of the admission control first, which may clamp or downgrade it or
+        reject it with a reply that tells why.
+
+        Returns:
+            True if the message was handed to the next stage (or was answered before), False otherwise.
+        """
+        with tracing.span('ingest', trace_id=tracing.new_trace_id(), message=getattr(message, 'id', None)) as _span:
+            _handed_over: bool = await self._message_to_next_stage(message=message, trace_id=_span.trace_id)
+            _span.set('handed_over', _handed_over)
+            return _handed_over
+
+    async def _message_to_next_stage(self, message: Message, trace_id: str) -> bool:
+        _id: Optional[str] = self._message_id(message)
+        _entry: Optional[JournalEntry] = self.journal.get(_id) if self.journal is not None and _id is not None else None
+        if _entry is not None:
+            if _entry.stage.is_terminal:
+                # answered before a restart, only the read mark was lost
+                root_logger.info(f'Request {_id} was {_entry.stage.name.lower()} before, marking it read.')
+                self._answered.append(message)
+                return True
+            root_logger.info(f'Resuming request {_id} after stage {_entry.stage.name.lower()}.')
+            trace_id = _entry.trace_id or trace_id
+            _resumed: Optional[Result] = self._resumed_result(message=message, entry=_entry)
+            if _resumed is not None:
+                return await self._put_into_next_stage(
+                    message=message, item=_resumed, queue=self.output_queue, cache_key=_entry.cache_key
+                )
+        _oembed_page: Optional[bytes] = None
+        _oembed_page_url: Optional[str] = t.TaskConfigFactory.oembed_page_url(message=message)
+        if _oembed_page_url is not None:
+            try:
+                with tracing.span('download', source='oembed_page'):
+                    _oembed_page = await self.downloader.fetch_page(_oembed_page_url)
+            except MediaTooLargeException as err:
+                root_logger.warning(f'Skipping oEmbed provider page: {err}')
+        _task_config: t.TaskConfig = t.TaskConfigFactory.from_message(
+            message=message, oembed_page=_oembed_page, gif_output_type=MediaType[config.GIF_OUTPUT_FORMAT.upper()],
+            trace_id=trace_id,
+        )
         root_logger.debug(f'Extracted task config from message: {_task_config}')
         if _task_config.is_state(TaskConfigState.INVALID):
             root_logger.warning('Task config state is invalid!')
             root_logger.debug(f'Task config: {_task_config}')
-            return
-        root_logger.info('Attempting to put task into input queue...')
-        try:
+            # it would be invalid with every fetch: the message is marked read with the next one
+            self._finish(message, TaskStage.FAILED)
+            return False
+        _cache_key: str = result_cache_key_for(_task_config)
+        _is_new_cut: bool = _cache_key not in self.result_cache and _cache_key not in self._in_flight
+        _source_bytes: Optional[int] = None
+        if _is_new_cut and (self.admission is not None or isinstance(self.input_queue, ShortestJobFirstQueue)):
+            _source_bytes = await self._source_bytes(_task_config)
+        if _is_new_cut and self.admission is not None:
+            # check the cut against the budgets before any media bytes are fetched
+            _admission: Admission = self._admit(task_config=_task_config, source_bytes=_source_bytes)
+            if _admission.outcome == AdmissionOutcome.REJECT:
+                await self._reject(message=message, trace_id=trace_id, admission=_admission)
+                return False
+            if _admission.config is not _task_config:
+                _task_config = _admission.config
+                _cache_key = result_cache_key_for(_task_config)
+        _cached = self.result_cache.get(_cache_key)
+        _item: Union[t.Task, Result]
+        if _cached is not None:
+            # identical cut was uploaded before: skip download, cut and upload and answer right away
+            root_logger.info('Found cached cut result. Attempting to put result into output queue...')
+            _item = Result(
+                None, media_type=_cached.media_type, message=message, upload_link=_cached.link, cache_key=_cache_key,
+                trace_id=trace_id,
+            )
+            _queue = self.output_queue
+        elif _cache_key in self._in_flight:
+            # an identical cut is queued or running: reply from its result instead of cutting again
+            self._activate(message=message, trace_id=trace_id, cache_key=_cache_key)
+            self._in_flight[_cache_key].append(message)
+            root_logger.info(
+                f'Attached message to the in-flight cut ({len(self._in_flight[_cache_key])} extra reply target(s)).'
+            )
+            return True
+        else:
+            root_logger.info('Attempting to put task into input queue...')
             # Cannot use multiprocessing.Queue because can't pickle local object
             # 'UserSubreddit._dict_depreciated_wrapper.<locals>.wrapper' from Message
-            await self.input_queue.put(t.Task(config=_task_config))
-        except ValueError:
-            root_logger.error(f'Queue is closed.')
-        except asyncio.QueueFull:
-            root_logger.error(f'Queue is full.')
-            root_logger.debug(f'Input queue: {self.input_queue}')
+            _item = t.Task(
+                config=_task_config, source_cache=self.source_cache, partial_fetcher=self.partial_fetcher,
+                cut_strategy=self.cut_strategy, max_download_bytes=config.DOWNLOAD_MAX_BYTES,
+            )
+            _item.cost = estimate_cut_seconds(_task_config, source_bytes=_source_bytes)
+            _queue = self.input_queue
+        return await self._put_into_next_stage(message=message, item=_item, queue=_queue, cache_key=_cache_key)
+
+    async def _source_bytes(self, task_config: t.TaskConfig) -> Optional[int]:
+        # the size of the source is checked against the byte budget and refines the cost estimate of a task
+        _cached_bytes = self.source_cache.size_of(task_config.media_url) if self.source_cache is not None else None
+        if _cached_bytes is not None or self.downloader is None:
+            return _cached_bytes
+        with tracing.span('download', source='head'):
+            return await self.downloader.content_length(task_config.media_url)
+
+    def _admit(self, task_config: t.TaskConfig, source_bytes: Optional[int]) -> Admission:
+        with tracing.span('admission', source_bytes=source_bytes) as _span:
+            _admission: Admission = self.admission.admit(
+                task_config, source_bytes=source_bytes, partial_fetcher=self.partial_fetcher
+            )
+            _span.set('outcome', _admission.outcome.value)
+            if _admission.outcome != AdmissionOutcome.ADMIT:
+                _span.set('reason', _admission.reason)
+                root_logger.info(f'Admission of {task_config.media_url}: {_admission.outcome.value}, '
+                                 f'{_admission.reason}.')
+        self._observe_admission(_admission)
+        return _admission
+
+    async def _reject(self, message: Message, trace_id: str, admission: Admission) -> None:
+        # the request is answered with the reason instead of a cut, so that it is not fetched again
+        self._activate(message=message, trace_id=trace_id, cache_key=None)
+        try:
+            await self._answer_rejection_in_reddit(message=message, reason=admission.reason)
         except Exception as err:
-            log_broad_exception(err)
-        else:
-            await message.mark_read()
-        root_logger.debug(f'Input queue size: {self.input_queue.qsize()}')
+            log_broad_exception(err, logger=root_logger)
+        finally:
+            self._finish(message, TaskStage.FAILED)
+
+    def _resumed_result(self, message: Message, entry: JournalEntry) -> Optional[Result]:
+        # an uploaded cut only needs the reply, a kept cut only the upload; earlier stages start over (the source
+        # cache makes the download cheap)
+        if entry.stage == TaskStage.UPLOADED and entry.upload_link is not None:
+            return Result(
+                None, media_type=entry.media_type, message=message, upload_link=entry.upload_link,
+                cache_key=entry.cache_key, trace_id=entry.trace_id,
+            )
+        if entry.stage == TaskStage.CUT and entry.artifact_path is not None and os.path.isfile(entry.artifact_path):
+            return Result(
+                MediaBuffer.from_path(entry.artifact_path, owned=True), media_type=entry.media_type, message=message,
+                cache_key=entry.cache_key, trace_id=entry.trace_id,
+            )
+        return None
 
-    def _read_from_input_queue(self) -> t.Task:
-        _task: t.Task
+    def _activate(self, message: Message, trace_id: str, cache_key: Optional[str]) -> None:
+        # the request is in the stages from now on: it is recorded and further fetches of its message are skipped
+        _id: Optional[str] = self._message_id(message)
+        if _id is None:
+            return
+        self._active.add(_id)
+        if self.journal is not None:
+            try:
+                self.journal.ingest(_id, trace_id=trace_id, cache_key=cache_key)
+            except sqlite3.Error as err:
+                root_logger.warning(f'Failed to record request {_id} ({type(err).__name__}): {err}')
+
+    async def _put_into_next_stage(self, message: Message, item: Union[t.Task, Result], queue: asyncio.Queue,
+                                   cache_key: Optional[str]) -> bool:
+        _is_cut: bool = isinstance(item, t.Task) or not item.is_uploaded
+        if _is_cut and cache_key is not None and not isinstance(queue, StageQueue):
+            # before waiting for the queue, identical requests attach from now on (only to cuts of this process)
+            self._in_flight[cache_key] = []
+        self._activate(message=message, trace_id=item.trace_id, cache_key=cache_key)
         try:
-            cut_logger.info('Attempting to immediately get task from input queue without blocking...')
-            _task = self.input_queue.get_nowait()
+            item.enqueued_at = time.monotonic()
+            await queue.put(item)  # waits while the next stage is saturated
         except ValueError:
-            cut_logger.error(f'Queue is closed.')
-        except asyncio.QueueEmpty:
-            cut_logger.warning(f'Queue is empty.')
-            cut_logger.debug(f'Input queue: {self.input_queue}')
+            root_logger.error(f'Queue is closed.')
+        except asyncio.QueueFull:
+            root_logger.error(f'Queue is full.')
+            root_logger.debug(f'Queue: {queue}')
         except Exception as err:
             log_broad_exception(err)
         else:
-            return _task
+            return True
+        finally:
+            root_logger.debug(
+                f'Input queue size: {self.input_queue.qsize()}, output queue size: {self.output_queue.qsize()}'
+            )
+        self._active.discard(self._message_id(message))
+        if _is_cut:
+            self._release_in_flight(item)
+        return False
 
     # noinspection PyMethodMayBeStatic
     def _exert_task(self, task: t.Task) -> Result:
@@ -177,22 +773,23 @@ class AioController(object):
             # _gif: GifImageFile
             cut_logger.info('Handling task...')
             try:
-                result: Result = task.handle()
+                result: Result = task.handle()  # sets the trace ID of the result
+                result.cache_key = result_cache_key_for(task.config)
+                self._observe_cut(task.config.media_type, fetch_seconds=task.fetch_seconds,
+                                  cut_seconds=task.cut_seconds, cpu_seconds=task.cut_cpu_seconds)
                 return result
             except TaskFailureException as err:
                 cut_logger.error(f'Task failed: {err}')
             except Exception as err:
                 log_broad_exception(err)
 
-    def _write_result_to_output_queue(self, result: Result) -> bool:
+    async def _write_result_to_output_queue(self, result: Result) -> bool:
         try:
             cut_logger.info('Putting task result into output queue...')
-            self.output_queue.put_nowait(result)
+            result.enqueued_at = time.monotonic()
+            await self.output_queue.put(result)  # waits while the upload stage is saturated
         except ValueError:
             cut_logger.error(f'Queue is closed.')
-        except asyncio.QueueFull:
-            cut_logger.error(f'Queue is full.')
-            cut_logger.debug(f'Output queue: {self.output_queue}')
         except Exception as err:
             log_broad_exception(err)
         else:
@@ -200,53 +797,71 @@ class AioController(object):
             return True
         return False
 
-    def _read_result_from_output_queue(self, logger) -> Optional[Result]:
-        # todo custom logger
-        try:
-            logger.info('Attempting to immediately get task from output queue without blocking...')
-            _result: Result = self.output_queue.get_nowait()
-        except ValueError:
-            logger.error(f'Queue is closed.')
-        except asyncio.QueueEmpty:
-            logger.warning(f'Queue is empty.')
-            logger.debug(f'Output queue: {self.output_queue}')
-        except Exception as err:
-            log_broad_exception(err)
-        else:
-            return _result
-
-    # @decorator.run_in_executor
-    def _upload_to_imgur(self, result: Result) -> str:
-        # self.imgur
-        # todo worth to have this async because of io
+    async def _upload_to_imgur(self, result: Result) -> str:
         # with NamedTemporaryFile(mode='wb', suffix='.gif') as fp:
         # save GIF into named temp file for upload with deprecated imgur lib...
         # result.gif.save(fp=fp, format='GIF', save_all=True, duration=result)
         # res = self.imgur.upload_from_path(path=fp.name, anon=False)
+        # the media is sent as a binary multipart file straight from the result buffer (no copy, no base64)
         anon = False
         if result.media_type == MediaType.GIF:
-            payload = {'image': base64.b64encode(result.media_stream.getvalue()), 'type': 'base64'}
+            payload = {'image': result.media_stream, 'type': 'file'}
             anon = True
-            # payload = {'image': result.media_stream}
         else:
             payload = {
                 'type': 'file',
                 'disable_audio': '0',
                 'video': result.media_stream
             }
-        res = self.imgur.upload(upload_payload=payload, anon=anon)
+        res, stats = await self.imgur.upload_with_stats(upload_payload=payload, anon=anon)
+        metrics.UPLOAD_SECONDS.labels(result.media_type.name.lower()).observe(stats.seconds)
+        _peak_memory = f', peak memory {stats.peak_memory} bytes' if stats.peak_memory is not None else ''
+        upload_logger.info(
+            f'Uploaded {stats.payload_bytes} bytes ({stats.bytes_sent} bytes on the wire, {stats.attempts} attempt(s)) '
+            f'in {stats.seconds:.2f}s{_peak_memory}'
+        )
         upload_logger.debug(f'Upload to imgur: {res.get("link")}')
         return res.get('link')
 
+    def _cache_result(self, result: Result) -> None:
+        if result.cache_key is None:
+            return
+        try:
+            _media = result.media_stream.getbuffer() if result.media_stream is not None else None
+            self.result_cache.put(
+                key=result.cache_key, link=result.upload_link, media_type=result.media_type, media=_media
+            )
+            if _media is not None:
+                _media.release()
+        except Exception as err:
+            log_broad_exception(err, logger=upload_logger)
+
     # @decorator.run_in_executor
     # noinspection PyMethodMayBeStatic
     async def _answer_in_reddit(self, message: Message, upload_link: str) -> None:
         # todo refactor answer into reddit client
         # reply with link to the just cut gif and mark as unread
+        try:
+            with tracing.span('reply'):
+                await message.reply(f'Here is your cut GIF: {upload_link}\n{self._bot_footer()}')
+        except Exception:
+            metrics.FAILURES.labels('reply').inc()
+            raise
+        # m.mark_read()  # done
+        upload_logger.info('Reddit reply sent!')
+
+    async def _answer_rejection_in_reddit(self, message: Message, reason: str) -> None:
+        try:
+            with tracing.span('reply', rejected=True):
+                await message.reply(f'Sorry, I cannot cut this one: {reason}.\n{self._bot_footer()}')
+        except Exception:
+            metrics.FAILURES.labels('reply').inc()
+            raise
+        root_logger.info(f'Reddit reply sent, the request was rejected: {reason}.')
+
+    @staticmethod
+    def _bot_footer() -> str:
         issue_link = f'https://www.reddit.com/message/compose/?to=domac&subject={config.REDDIT_USERNAME}%20issue&message=' \
                      f'Add a link to the gif or comment in your message%2C I%27m not always sure which request is ' \
                      f'being reported. Thanks for helping me out! '
-        bot_footer = f"---\n\n^(I am a bot.) [^(Report an issue)]({issue_link})"
-        await message.reply(f'Here is your cut GIF: {upload_link}\n{bot_footer}')
-        # m.mark_read()  # done
-        upload_logger.info('Reddit reply sent!')
+        return f"---\n\n^(I am a bot.) [^(Report an issue)]({issue_link})"
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+from src.util.aux import Watermark
+from src.util.tracing import Span
+
+if TYPE_CHECKING:
+    from src.execution.task import TaskConfig
+
+
+@dataclass(frozen=True)
+class CutJob:
+    """A compact and picklable cut job that is decoupled from the reddit message it was requested in.
+
+    Attributes:
+        media_url       The url to the media.
+        media_type      The media type of the resource requested for cutting.
+        extension       The file extension of the media.
+        start           The start time in milliseconds from where to cut the media.
+        end             The end time in milliseconds to stop the cut of the media.
+        duration        The total duration of the media in seconds or None if it is computed in the handler.
+        watermark       The optional watermark settings applied to the cut media.
+        output_type     The media type a GIF is cut to or None to keep the media type of the source.
+        source_path     The path of the source media fetched by the controller process or None if the worker fetches
+                        (or streams) it itself.
+        trace_id        The ID of the trace of the request.
+        parent_span_id  The ID of the span of the controller process the spans of the worker are nested in.
+    """
+    media_url: str
+    media_type: MediaType
+    extension: str
+    start: float
+    end: Optional[float]
+    duration: Optional[float]
+    watermark: Optional[Watermark]
+    output_type: Optional[MediaType]
+    source_path: Optional[str] = None
+    trace_id: Optional[str] = None
+    parent_span_id: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config: TaskConfig, source_path: Optional[str] = None,
+                    parent_span_id: Optional[str] = None) -> CutJob:
+        return cls(
+            media_url=config.media_url,
+            media_type=config.media_type,
+            extension=config.extension,
+            start=config.start,
+            end=config.end,
+            duration=config.duration,
+            watermark=config.watermark,
+            output_type=config.output_type,
+            source_path=source_path,
+            trace_id=config.trace_id,
+            parent_span_id=parent_span_id,
+        )
+
+    def to_config(self) -> TaskConfig:
+        """Returns a task config without a reddit message for cutting the job in a worker process."""
+        from src.execution.task import TaskConfig
+        return TaskConfig(
+            message=None,
+            media_type=self.media_type,
+            start=self.start,
+            end=self.end,
+            watermark=self.watermark,
+            state=TaskConfigState.VALID,
+            is_oembed=False,
+            is_crosspost=False,
+            media_url=self.media_url,
+            duration=self.duration,
+            extension=self.extension,
+            output_type=self.output_type,
+            trace_id=self.trace_id,
+        )
+
+
+@dataclass(frozen=True)
+class CutOutput:
+    """The output of a cut job that is handed back by file path instead of pickled bytes.
+
+    Attributes:
+        path                The path of the file holding the cut media; the receiver is responsible for removing it.
+        media_type          The media type of the cut media.
+        size                The size of the cut media in bytes.
+        fetch_seconds       The wall time of fetching the cached or partially fetched source media.
+        cut_seconds         The wall time of the cut (including the download if the media is cut while downloading).
+        cpu_seconds         The CPU time of the cut including the ffmpeg processes of the worker.
+        downloaded_bytes    The number of bytes downloaded for the job.
+        spans               The trace spans of the job, exported by the controller.
+    """
+    path: str
+    media_type: MediaType
+    size: int
+    fetch_seconds: float = 0
+    cut_seconds: float = 0
+    cpu_seconds: float = 0
+    downloaded_bytes: int = 0
+    spans: Tuple[Span, ...] = ()
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from src.model.media_type import MediaType
+from src.model.task_stage import TaskStage
+from src.util.logger import root_logger
+
+# the columns besides the stage that a request records on its way through the stages
+_FIELDS = ('trace_id', 'cache_key', 'media_type', 'artifact_path', 'upload_link')
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    """The last completed stage of a request and what is needed to resume it from there.
+
+    Attributes:
+        message_id      The fullname of the inbox message of the request, e.g. `t1_abc`.
+        stage           The last completed stage.
+        trace_id        The ID of the trace of the request.
+        cache_key       The result cache key of the cut or None if the config of the request was not extracted yet.
+        media_type      The media type of the cut media or None before the cut.
+        artifact_path   The path of the cut media that awaits its upload or None.
+        upload_link     The imgur link of the uploaded cut or None before the upload.
+        updated         The time of the last stage change as a unix timestamp.
+    """
+    message_id: str
+    stage: TaskStage
+    trace_id: Optional[str]
+    cache_key: Optional[str]
+    media_type: Optional[MediaType]
+    artifact_path: Optional[str]
+    upload_link: Optional[str]
+    updated: float
+
+
+class TaskJournal(object):
+    """A durable record of the stage each request reached, so that a restarted bot resumes requests instead of
+    redoing (or repeating) them.
+
+    The journal is a SQLite database in WAL mode in `directory`: stage changes are appended to the write-ahead log
+    without rewriting the database, and with `synchronous=NORMAL` a commit does not wait for an fsync (a crash of the
+    process loses nothing, a power loss at most the last commits). Cut media that awaits its upload is kept as an
+    artifact file in `directory/artifacts`. Entries are removed `retention_seconds` after their last stage change.
+
+    The journal is thread-safe since stages are recorded in executor threads as well.
+    """
+
+    def __init__(self, directory: str, retention_seconds: float = 7 * 24 * 3600):
+        self._directory = directory
+        self._artifact_dir = os.path.join(directory, 'artifacts')
+        self._retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        os.makedirs(self._artifact_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self._directory, 'journal.sqlite3'), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'message_id TEXT PRIMARY KEY, stage INTEGER NOT NULL, trace_id TEXT, cache_key TEXT, media_type TEXT, '
+            'artifact_path TEXT, upload_link TEXT, updated REAL NOT NULL)'
+        )
+        self._db.commit()
+        self.prune()
+
+    @property
+    def journal_mode(self) -> str:
+        with self._lock:
+            return self._db.execute('PRAGMA journal_mode').fetchone()[0]
+
+    def artifact_path(self, message_id: str, media_type: MediaType) -> str:
+        """Returns the path the cut media of the request is kept at until it is uploaded."""
+        return os.path.join(self._artifact_dir, f'{message_id}.{media_type.name.lower()}')
+
+    def get(self, message_id: str) -> Optional[JournalEntry]:
+        with self._lock:
+            row = self._db.execute(
+                f'SELECT message_id, stage, {", ".join(_FIELDS)}, updated FROM tasks WHERE message_id = ?',
+                (message_id,)
+            ).fetchone()
+        return self._entry(row) if row is not None else None
+
+    def pending(self) -> List[JournalEntry]:
+        """Returns the entries of the requests that were not replied to (or failed) yet, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT message_id, stage, {", ".join(_FIELDS)}, updated FROM tasks '
+                f'WHERE stage NOT IN (?, ?) ORDER BY updated ASC',
+                (TaskStage.REPLIED.value, TaskStage.FAILED.value)
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def ingest(self, message_id: str, trace_id: Optional[str] = None, cache_key: Optional[str] = None) -> None:
+        """Records the request of the message unless it is recorded already."""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR IGNORE INTO tasks (message_id, stage, trace_id, cache_key, updated) VALUES (?, ?, ?, ?, ?)',
+                (message_id, TaskStage.INGESTED.value, trace_id, cache_key, time.time())
+            )
+            self._db.commit()
+
+    def advance(self, message_id: str, stage: TaskStage, **fields) -> None:
+        """Records that the request completed `stage` together with `fields` (see :class:`JournalEntry`).
+
+        A request never moves back to an earlier stage, e.g. when a requeued message is ingested again.
+        """
+        if any(name not in _FIELDS for name in fields):
+            raise ValueError(f'Unknown journal fields: {sorted(set(fields) - set(_FIELDS))}')
+        values = {name: value.name if isinstance(value, MediaType) else value for name, value in fields.items()}
+        assignments = ''.join(f', {name} = ?' for name in values)
+        with self._lock:
+            self._db.execute(
+                f'UPDATE tasks SET stage = ?, updated = ?{assignments} WHERE message_id = ? AND stage <= ?',
+                (stage.value, time.time(), *values.values(), message_id, stage.value)
+            )
+            self._db.commit()
+
+    def prune(self) -> None:
+        """Removes the entries (and artifacts) that did not change within the retention time."""
+        with self._lock:
+            cutoff = time.time() - self._retention_seconds
+            expired = self._db.execute(
+                'SELECT artifact_path FROM tasks WHERE updated < ? AND artifact_path IS NOT NULL', (cutoff,)
+            ).fetchall()
+            for artifact_path, in expired:
+                self._remove_file(artifact_path)
+            deleted = self._db.execute('DELETE FROM tasks WHERE updated < ?', (cutoff,)).rowcount
+            self._db.commit()
+        if deleted > 0:
+            root_logger.info(f'Pruned {deleted} expired journal entries.')
+
+    @staticmethod
+    def _entry(row) -> JournalEntry:
+        message_id, stage, trace_id, cache_key, media_type, artifact_path, upload_link, updated = row
+        return JournalEntry(
+            message_id=message_id, stage=TaskStage(stage), trace_id=trace_id, cache_key=cache_key,
+            media_type=MediaType[media_type] if media_type is not None else None, artifact_path=artifact_path,
+            upload_link=upload_link, updated=updated,
+        )
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+import resource
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional
+
+from src.execution.job import CutJob, CutOutput
+from src.util.logger import cut_logger
+from src.util import tracing
+from src.util.metrics import DOWNLOADED_BYTES
+
+# per worker process resources, created once by the pool initializer
+_output_dir: Optional[str] = None
+_max_download_bytes: Optional[int] = None
+_partial_fetcher = None
+_cut_strategy = None
+
+
+def _init_worker(output_dir: str) -> None:
+    # workers are spawned (not forked), so the resources are created from the configuration in every process
+    # the source cache is owned by the controller process, which hands cached sources to the workers by path, so that
+    # its byte budget, its index and the single download per url hold across all workers
+    global _output_dir, _max_download_bytes, _partial_fetcher, _cut_strategy
+    from src.client.media import PartialMediaFetcher
+    from src.handler.strategy import CutStrategy
+    from src.model.cut_mode import CutPolicy
+    from src.util import config
+
+    _output_dir = output_dir
+    _max_download_bytes = config.DOWNLOAD_MAX_BYTES
+    if config.PARTIAL_FETCH_ENABLED:
+        _partial_fetcher = PartialMediaFetcher(
+            min_duration=config.PARTIAL_FETCH_MIN_DURATION_SECONDS,
+            max_ratio=config.PARTIAL_FETCH_MAX_RATIO,
+        )
+    _cut_strategy = CutStrategy(
+        policy=CutPolicy(config.CUT_POLICY), keyframe_tolerance_ms=config.CUT_KEYFRAME_TOLERANCE_MS
+    )
+    cut_logger.info(f'Initialized cut worker process {os.getpid()}.')
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_cut_job(job: CutJob) -> CutOutput:
+    """Cuts `job` in a worker process and writes the cut media to a file in the output directory.
+
+    A worker runs one job at a time, so the downloaded bytes and the CPU time of the ffmpeg processes of the job are
+    the growth of the counters of the process; they are handed back with the output to be recorded by the controller,
+    and so are the trace spans of the job.
+    """
+    from src.execution.task import Task
+
+    downloaded_bytes, children_cpu_seconds = DOWNLOADED_BYTES.value, _children_cpu_seconds()
+    task = Task(
+        config=job.to_config(), partial_fetcher=_partial_fetcher, cut_strategy=_cut_strategy,
+        max_download_bytes=_max_download_bytes, source_path=job.source_path,
+    )
+    with tracing.TRACER.collecting() as spans:
+        with tracing.span('cut_worker', trace_id=job.trace_id, parent_id=job.parent_span_id, pid=os.getpid()):
+            result = task.handle()
+            path = os.path.join(_output_dir, f'{uuid.uuid4().hex}.{result.media_type.name.lower()}')
+            result.media_stream.persist(path)  # moved if it was spilled to disk
+    return CutOutput(
+        path=path, media_type=result.media_type, size=os.path.getsize(path),
+        fetch_seconds=task.fetch_seconds, cut_seconds=task.cut_seconds,
+        cpu_seconds=task.cut_cpu_seconds + _children_cpu_seconds() - children_cpu_seconds,
+        downloaded_bytes=int(DOWNLOADED_BYTES.value - downloaded_bytes),
+        spans=tuple(spans),
+    )
+
+
+class CutWorkerPool(object):
+    """A pool of cut worker processes, so that cutting (e.g. GIF decoding and encoding) is not bound by the GIL.
+
+    Only the compact :class:`CutJob` is pickled to the workers and only the :class:`CutOutput` (a file path) is
+    pickled back.
+    """
+
+    def __init__(self, max_workers: int, output_dir: str):
+        self._output_dir = output_dir
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            # forking the event loop process (with its threads and open connections) is unsafe
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self._output_dir,),
+        )
+
+    def submit(self, job: CutJob) -> 'Future[CutOutput]':
+        return self._executor.submit(run_cut_job, job)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
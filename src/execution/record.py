@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from src.cache.result import result_cache_key_for
+from src.execution.job import CutJob
+from src.model.media_type import MediaType
+from src.util.aux import Watermark
+from src.util.media_buffer import MediaBuffer
+
+if TYPE_CHECKING:
+    from src.execution.task import Task
+    from src.model.result import Result
+
+
+@dataclass(frozen=True)
+class MessageRef:
+    """Stands in for the reddit message of a request in a process that only knows its fullname, e.g. a cutter.
+
+    Attributes:
+        fullname        The fullname of the message, e.g. `t1_abc` for a mention.
+    """
+    fullname: Optional[str]
+
+
+def _message_id(message) -> Optional[str]:
+    return getattr(message, 'fullname', None)
+
+
+def _enqueued_at(item) -> float:
+    # monotonic clocks are per process: the time the item waited so far is carried as a unix timestamp
+    enqueued_at: Optional[float] = getattr(item, 'enqueued_at', None)
+    return time.time() - (time.monotonic() - enqueued_at) if enqueued_at is not None else time.time()
+
+
+@dataclass(frozen=True)
+class CutRecord:
+    """The serializable record of a task that is passed from the ingesting to a cutting process.
+
+    Attributes:
+        message_id      The fullname of the message of the request.
+        cache_key       The result cache key of the cut.
+        job             The cut job of the task (see :class:`CutJob`).
+        enqueued_at     The time the record was put into the transport as a unix timestamp.
+        lease           The lease of the record by the receiving process; None until it is received.
+    """
+    message_id: Optional[str]
+    cache_key: str
+    job: CutJob
+    enqueued_at: float
+    lease: Optional[str] = None
+
+    @classmethod
+    def from_task(cls, task: Task) -> CutRecord:
+        return cls(
+            message_id=_message_id(task.config.message), cache_key=result_cache_key_for(task.config),
+            job=CutJob.from_config(task.config), enqueued_at=_enqueued_at(task),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = asdict(self.job)
+        job['media_type'] = self.job.media_type.name
+        job['output_type'] = self.job.output_type.name if self.job.output_type is not None else None
+        if self.job.watermark is not None:
+            job['watermark'] = {'text': self.job.watermark.text, 'position': list(self.job.watermark.position),
+                                'color': list(self.job.watermark.color)}
+        return {'message_id': self.message_id, 'cache_key': self.cache_key, 'job': job,
+                'enqueued_at': self.enqueued_at}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], lease: Optional[str] = None) -> CutRecord:
+        job = dict(data['job'])
+        job['media_type'] = MediaType[job['media_type']]
+        job['output_type'] = MediaType[job['output_type']] if job['output_type'] is not None else None
+        if job['watermark'] is not None:
+            watermark = job['watermark']
+            job['watermark'] = Watermark(
+                text=watermark['text'], position=tuple(watermark['position']), color=tuple(watermark['color'])
+            )
+        return cls(message_id=data['message_id'], cache_key=data['cache_key'], job=CutJob(**job),
+                   enqueued_at=data['enqueued_at'], lease=lease)
+
+    def to_config(self):
+        """Returns the task config of the record, whose message is a :class:`MessageRef`."""
+        return replace(self.job.to_config(), message=MessageRef(fullname=self.message_id))
+
+
+@dataclass(frozen=True)
+class UploadRecord:
+    """The serializable record of a cut (or cached) result that is passed from a cutting (or the ingesting) process
+    to an uploading process.
+
+    The cut media is handed over as a file, so the processes have to share the file system of its path.
+
+    Attributes:
+        message_id      The fullname of the message of the request.
+        media_type      The media type of the cut media.
+        cache_key       The result cache key of the cut or None.
+        trace_id        The ID of the trace of the request.
+        media_path      The path of the cut media, owned by the receiving process, or None for an uploaded result.
+        upload_link     The imgur link of an uploaded (cached) result or None.
+        enqueued_at     The time the record was put into the transport as a unix timestamp.
+        lease           The lease of the record by the receiving process; None until it is received.
+    """
+    message_id: Optional[str]
+    media_type: MediaType
+    cache_key: Optional[str]
+    trace_id: Optional[str]
+    media_path: Optional[str]
+    upload_link: Optional[str]
+    enqueued_at: float
+    lease: Optional[str] = None
+
+    @classmethod
+    def from_result(cls, result: Result) -> UploadRecord:
+        media_path: Optional[str] = None
+        if result.media_stream is not None:
+            if not isinstance(result.media_stream, MediaBuffer):
+                raise TypeError(f'Cannot hand over the media of {result} to another process.')
+            media_path = result.media_stream.release_file()
+        return cls(
+            message_id=_message_id(result.message), media_type=result.media_type, cache_key=result.cache_key,
+            trace_id=result.trace_id, media_path=media_path,
+            upload_link=result.upload_link if result.is_uploaded else None, enqueued_at=_enqueued_at(result),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data['media_type'] = self.media_type.name
+        del data['lease']
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], lease: Optional[str] = None) -> UploadRecord:
+        return cls(**{**data, 'media_type': MediaType[data['media_type']], 'lease': lease})
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+
+from src.model.media_type import MediaType
+
+if TYPE_CHECKING:
+    from src.execution.task import TaskConfig
+
+# a rough model of the seconds a cut takes, fitted to the cases of tests/benchmark.py on one CPU
+FIXED_SECONDS = 0.05  # probing, process start-up and the hand-over of the result
+SECONDS_PER_CUT_SECOND = {  # per second of the requested range
+    MediaType.GIF: 0.02,  # spliced frames or a palette re-encode of the range
+    MediaType.MP4: 0.1,  # stream copy or smart-cut of the range
+    MediaType.MOV: 0.1,
+    MediaType.WEBM: 0.1,
+}
+WATERMARK_SECONDS_PER_CUT_SECOND = 0.5  # every frame is decoded, drawn on and encoded again
+TRANSCODE_SECONDS_PER_CUT_SECOND = 0.2  # a GIF cut that is transcoded to MP4 or WEBM
+DOWNLOAD_BYTES_PER_SECOND = 20 * 1024 * 1024
+# assumed when the size or range of a source is not known before it is fetched
+VIDEO_BYTES_PER_SECOND = 512 * 1024
+UNKNOWN_SOURCE_BYTES = 8 * 1024 * 1024
+UNKNOWN_CUT_SECONDS = 10
+
+
+def cut_range_seconds(config: TaskConfig) -> float:
+    """Returns the length of the requested range in seconds, up to the end of the media if it is known."""
+    end: Optional[float] = config.end
+    if config.duration is not None:
+        end = config.duration * 1000 if end is None else min(end, config.duration * 1000)
+    if end is None:
+        return UNKNOWN_CUT_SECONDS
+    return max(end - config.start, 0) / 1000
+
+
+def estimate_cut_seconds(config: TaskConfig, source_bytes: Optional[int] = None) -> float:
+    """Estimates the seconds the fetch and cut of a task take from what is known before its source is fetched.
+
+    Args:
+        config: The config of the task: its media type, requested range and the duration of the media if known.
+        source_bytes: The size of the source, e.g. from the `Content-Length` of a `HEAD` request, or None.
+    """
+    if source_bytes is None:
+        source_bytes = (
+            int(config.duration * VIDEO_BYTES_PER_SECOND)
+            if config.duration is not None and config.media_type != MediaType.GIF else UNKNOWN_SOURCE_BYTES
+        )
+    return source_bytes / DOWNLOAD_BYTES_PER_SECOND + estimate_cpu_seconds(config)
+
+
+def estimate_cpu_seconds(config: TaskConfig) -> float:
+    """Estimates the CPU seconds the cut of a task takes (without its fetch) from its range, media type and work."""
+    per_second: float = SECONDS_PER_CUT_SECOND.get(config.media_type, max(SECONDS_PER_CUT_SECOND.values()))
+    if config.watermark is not None:
+        per_second += WATERMARK_SECONDS_PER_CUT_SECOND
+    if config.media_type == MediaType.GIF and config.output_type not in (None, MediaType.GIF):
+        per_second += TRANSCODE_SECONDS_PER_CUT_SECOND
+    return FIXED_SECONDS + cut_range_seconds(config) * per_second
+
+
+class ShortestJobFirstQueue(asyncio.Queue):
+    """A queue that hands out the task with the lowest estimated cost first instead of the oldest one.
+
+    Tasks carry their estimated cut seconds as `cost` and the (monotonic) time they were queued as `enqueued_at`.
+    The priority of a waiting task is its cost less `aging` times the seconds it waited, so that expensive tasks are
+    not starved: a task is served before any task that is queued more than `cost / aging` seconds after it. Since all
+    waiting tasks age alike, the priority is the static key `cost + aging * enqueued_at` of a heap. Tasks without a
+    cost are served in the order they were queued.
+
+    Attributes:
+        aging   The seconds of cost a waiting task makes up for per second it waits; 0 is pure shortest job first.
+    """
+
+    def __init__(self, maxsize: int = 0, aging: float = 0.1):
+        self.aging = aging
+        super(ShortestJobFirstQueue, self).__init__(maxsize=maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: List[Tuple[float, int, Any]] = []
+        self._counter = itertools.count()  # keeps tasks with equal keys in the order they were queued
+
+    def _key(self, item: Any) -> float:
+        cost: float = getattr(item, 'cost', None) or 0
+        enqueued_at: Optional[float] = getattr(item, 'enqueued_at', None)
+        return cost + self.aging * (enqueued_at if enqueued_at is not None else time.monotonic())
+
+    def _put(self, item: Any) -> None:
+        heapq.heappush(self._queue, (self._key(item), next(self._counter), item))
+
+    def _get(self) -> Any:
+        return heapq.heappop(self._queue)[-1]
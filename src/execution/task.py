@@ -1,225 +1,179 @@
 import math
 import os
 import re
+import time
 from dataclasses import dataclass
-from io import BytesIO
-from typing import Dict, Callable, Tuple
+from typing import Dict, Tuple
 from typing import List
 from typing import Optional
 from typing import Union
 from urllib.parse import parse_qs, urlparse
 
 import PIL
-import requests
-from PIL.Image import Image
 from asyncpraw.models import Message
-from asyncpraw.models import Submission
 from bs4 import BeautifulSoup
 
 import src.handler as handler_pkg
 import src.model.result as result_pkg
+from src.cache.source import SourceCache
+from src.client.download import capped_chunks, shared_session
+from src.client.media import PartialMediaFetcher
+from src.handler.strategy import CutStrategy
 from src.model.media_type import MediaType
 from src.model.task_state import TaskConfigState
 from src.model.task_state import TaskState
-from src.util import exception, gif_utilities
 from src.util.aux import Watermark
-from src.util.aux import noop_image, fix_start_end_swap
+from src.util.aux import fix_start_end_swap
 from src.util.aux import watermark_image
-from src.util.exception import TaskFailureException, OembedFailureException
+from src.util.exception import MediaTooLargeException, OembedFailureException, TaskFailureException
+from src.util import tracing
 from src.util.logger import root_logger, task_logger
+from src.util.media_buffer import MediaBuffer
 
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
 
-@dataclass
+
+@dataclass(frozen=True)
 class TaskConfig:
-    """A task configuration which is not serializable.
+    """A resolved and immutable task configuration which is not serializable.
+
+    All attributes are resolved exactly once by :class:`TaskConfigFactory` so that accessing them (e.g. in a log
+    statement) never performs any network I/O.
 
     Attributes:
         message         The reddit message object.
         media_type      The media type of the resource requested for cutting.
         start           The start time in milliseconds from where to cut the MediaType.
         end             The end time in milliseconds to stop the cut of the MediaType.
-        watermark       An optional callable that watermarks the cut media.
+        watermark       The optional watermark settings applied to the cut media.
         state           The state of this :class:~`TaskConfig`.
         is_oembed       A flag indicating if the media is embedded via the oEmbed format (https://oembed.com/).
-        is_video        A flag indicating if the media is a video.
-        is_gif          A flag indicating if the media is a gif.
         is_crosspost    A flag indicating if the media is crossposted.
         media_url       The url to the media.
-        duration        The total duration of the media in seconds read from the `message`.
+        duration        The total duration of the media in seconds or None if it is only known after fetching
+                        the media (e.g. for GIFs), in which case it is computed in the specific handler.
         extension       The file extension of the media.
+        output_type     The media type a GIF is cut to (GIF, MP4 or WEBM) or None to keep the media type of the source.
+        trace_id        The ID of the trace of the request (see :mod:`src.util.tracing`).
     """
+    __slots__ = (
+        'message', 'media_type', 'start', 'end', 'watermark', 'state', 'is_oembed', 'is_crosspost', 'media_url',
+        'duration', 'extension', 'output_type', 'trace_id',
+    )
     message: Message
-    media_type: MediaType
+    media_type: Optional[MediaType]
     start: float
     end: Optional[float]
-    watermark: Callable[[PIL.Image.Image], PIL.Image.Image]
-
-    def __init__(
-            self, message: Message, start: float, end: Optional[float], media_type: MediaType, watermark:
-            Optional[Watermark] = None
-    ):
-        self.message = message
-        self.media_type = media_type
-        self.__is_video = self.media_type in [MediaType.MP4, MediaType.MOV, MediaType.WEBM]
-        self.__is_gif = self.media_type == MediaType.GIF
-        if hasattr(message.submission, 'crosspost_parent'):
-            self.__is_crosspost = message.submission.crosspost_parent is not None
-        else:
-            self.__is_crosspost = False
-        start_ms, end_ms = fix_start_end_swap(start=start, end=end)
-        start_ms = max(start_ms, 0)  # put a realistic lower bound on end
-        if self.duration is not None:
-            # duration could be None here, will be computed in the specific handler
-            end_ms = min(end_ms or math.inf, self.duration * 1000)  # put a realistic upper bound on end
-        self.start = start_ms
-        self.end = end_ms
-        self.watermark = noop_image if watermark is None else lambda img: watermark_image(img, watermark)
-        self._state = TaskConfigState.VALID
-
-    def __repr__(self) -> str:
-        return f'TaskConfig(message: {self.message}, media_type: {self.media_type}, start: {self.start}, ' \
-               f'end: {self.end}, watermark: {self.watermark}, state: {self.state}, is_oembed: {self.is_oembed}, ' \
-               f'is_video: {self.is_video}, is_gif: {self.is_gif}, is_crosspost: {self.is_crosspost}, ' \
-               f'duration: {self.duration}, extension: {self.extension}, media_url: {self.media_url})'
-
-    @property
-    def state(self) -> TaskConfigState:
-        return self._state
+    watermark: Optional[Watermark]
+    state: TaskConfigState
+    is_oembed: bool
+    is_crosspost: bool
+    media_url: str
+    duration: Optional[float]
+    extension: Optional[str]
+    output_type: Optional[MediaType]
+    trace_id: Optional[str]
 
     def is_state(self, state: Union[TaskConfigState, List[TaskConfigState]]) -> bool:
-        return self._state in state if state is List else self._state == state
-
-    @property
-    def is_oembed(self) -> bool:
-        # full oembed spec: https://oembed.com/#section2
-        # media is a dynamic attribute on submission
-        if not hasattr(self.message.submission, 'media'):
-            return False
-        return bool(self.message.submission.media.get('oembed', False))
+        return self.state in state if isinstance(state, list) else self.state == state
 
     @property
     def is_video(self) -> bool:
-        return self.__is_video
+        return self.media_type in [MediaType.MP4, MediaType.MOV, MediaType.WEBM]
 
     @property
     def is_gif(self) -> bool:
-        return self.__is_gif
+        return self.media_type == MediaType.GIF
 
-    @property
-    def is_crosspost(self) -> bool:
-        return self.__is_crosspost
+    def apply_watermark(self, image: PIL.Image.Image) -> PIL.Image.Image:
+        """Watermarks the `image` in place if watermark settings are configured.
+        """
+        if self.watermark is None:
+            return image
+        return watermark_image(image, self.watermark)
 
-    @property
-    def media_url(self) -> str:
-        # todo do this in __init__ and store in a "_variable"
-        _submission: Submission = self.message.submission
-        if self.is_oembed:
-            return self.__get_oembed()[0]
-        elif self.is_gif:
-            if self.is_crosspost:
-                return ''  # todo
-            else:
-                return _submission.url
-        elif self.is_video:
-            if self.is_crosspost:
-                reddit_video = _submission.crosspost_parent_list[0].get('secure_media').get('reddit_video')
-            else:
-                reddit_video = _submission.secure_media.get('reddit_video', {})
-            media_url = reddit_video.get('fallback_url', '')
-            if media_url == '':
-                self._state = TaskConfigState.INVALID
-            return media_url
-        else:
-            raise exception.TaskConfigFailureException('Cannot parse attribute media_url.')
 
-    @property
-    def duration(self) -> Optional[float]:
-        # todo do this in __init__ and store in a "_variable"
-        if self.is_gif:
-            # AFAIK there is no duration sent when we are dealing with a GIF
-            with requests.get(self.media_url, stream=True) as resp:
-                if resp.ok:
-                    self._state = TaskConfigState.VALID
-                    # read whole file via StreamReader into BytesIO
-                    _stream = BytesIO(resp.raw.read())
-                    _stream.seek(0)
-                    return gif_utilities.get_gif_duration(image=PIL.Image.open(_stream))
-                else:
-                    self._state = TaskConfigState.INVALID
-                    return math.nan
-        elif self.is_video:
-            _submission: Submission = self.message.submission
-            if self.is_crosspost:
-                reddit_video = _submission.crosspost_parent_list[0].get('secure_media').get('reddit_video')
-            else:
-                reddit_video = _submission.secure_media.get('reddit_video', {})
-            return reddit_video.get('duration')
-        else:
-            # self._state = TaskState.INVALID  # duration will be computed in the specific handler if None
-            return None
+@dataclass(frozen=True)
+class _MediaSource:
+    media_type: MediaType
+    media_url: str
+    extension: str
+    duration: Optional[float]
 
-    @property
-    def extension(self) -> Optional[str]:
-        # todo do this in __init__ and store in a "_variable"
-        ext: Optional[str]
-        _submission: Submission = self.message.submission
-        if self.is_oembed:
-            return self.__get_oembed()[-1]
-        elif self.is_gif:
-            if self.is_crosspost:
-                ext = None  # todo how to handle crossposted gifs?
-            else:
-                ext = os.path.splitext(_submission.url)[-1][1:]
-        elif self.is_video:
-            if self.is_crosspost:
-                # todo make sure it always works with index 0 (should be the first post)
-                reddit_video = _submission.crosspost_parent_list[0].get('secure_media').get('reddit_video')
-            else:
-                reddit_video = _submission.secure_media.get('reddit_video', {})
-            ext = os.path.splitext(reddit_video.get('scrubber_media_url', [' ']))[-1][1:]
-        else:
-            self._state = TaskState.INVALID
-            ext = None
-        if ext == '' or ext is None:
-            ext = None
-            self._state = TaskConfigState.INVALID
-        return ext
-
-    def __get_oembed(self) -> Tuple[str, str, str]:
-        """Returns a tuple with the source url, the media MIME-type and the media extension.
+
+class TaskConfigFactory(object):
+    @classmethod
+    def from_message(cls, message: Message, watermark: Optional[Watermark] = None,
+                     oembed_page: Optional[bytes] = None, gif_output_type: MediaType = MediaType.GIF,
+                     trace_id: Optional[str] = None) -> TaskConfig:
+        """Resolves all attributes of a :class:`TaskConfig` from a (loaded) reddit message without any network I/O.
+
+        Args:
+            message: The loaded reddit message.
+            watermark: The optional watermark settings applied to the cut media.
+            oembed_page: The page of the oEmbed provider at :meth:`oembed_page_url` if the message has one.
+            gif_output_type: The media type GIFs are cut to unless the message requests one (`format=mp4`).
+            trace_id: The ID of the trace of the message or None to start a new trace.
+        """
+        state = TaskConfigState.VALID
+        is_crosspost = cls.__is_crosspost(message=message)
+        is_oembed = cls.__is_oembed(message=message)
+        start_and_end = cls.__parse_start_and_end(message)
+        source = cls.__resolve_media_source(message=message, oembed_page=oembed_page)
+        if start_and_end is None or source is None:
+            state = TaskConfigState.INVALID
+            start_and_end = start_and_end or (0, None)
+        start_ms, end_ms = start_and_end
+        if end_ms is not None:
+            start_ms, end_ms = fix_start_end_swap(start=start_ms, end=end_ms)
+        start_ms = max(start_ms, 0)  # put a realistic lower bound on start
+        duration = source.duration if source is not None else None
+        output_type: Optional[MediaType] = None
+        if source is not None and source.media_type == MediaType.GIF:
+            output_type = cls.__parse_output_type(message) or gif_output_type
+        if duration is not None:
+            # duration could be None here, will be computed in the specific handler
+            end_ms = min(end_ms or math.inf, duration * 1000)  # put a realistic upper bound on end
+        return TaskConfig(
+            message=message,
+            media_type=source.media_type if source is not None else None,
+            start=start_ms,
+            end=end_ms,
+            watermark=watermark,
+            state=state,
+            is_oembed=is_oembed,
+            is_crosspost=is_crosspost,
+            media_url=source.media_url if source is not None else '',
+            duration=duration,
+            extension=source.extension if source is not None else None,
+            output_type=output_type,
+            trace_id=trace_id if trace_id is not None else tracing.new_trace_id(),
+        )
+
+    @classmethod
+    def oembed_page_url(cls, message: Message) -> Optional[str]:
+        """Returns the url of the oEmbed provider page that lists the media sources of the message, if any.
+
+        The page is fetched by the caller (asynchronously) and handed to :meth:`from_message`.
         """
-        oembed: Dict = self.message.submission.media.get('oembed', {})
+        if cls.__is_video(message=message) or cls.__is_gif(message=message) or not cls.__is_oembed(message=message):
+            return None
+        oembed: Dict = message.submission.media.get('oembed', {})
         html_string: str
         try:
             html_string = oembed['html']
         except KeyError:
-            html_string = oembed['url']
+            html_string = oembed.get('url')
         if not isinstance(html_string, str):
             task_logger.error('Failed to obtain the HTML of the oEmbed.')
+            return None
         soup = BeautifulSoup(html_string, features='html.parser')
         try:
             # todo proper error handling! this has only been validated with gfycat
-            src_url = parse_qs(urlparse(soup.iframe.get('src'))[4]).get('src')[0]
-            another_soup = BeautifulSoup(requests.get(src_url).content, features='html.parser')
-            source_tag = another_soup.video.findAll(name='source')[1]
-            ext: str = os.path.splitext(source_tag['src'])[-1][1:]
-            return source_tag['src'], source_tag['type'], ext
+            return parse_qs(urlparse(soup.iframe.get('src'))[4]).get('src')[0]
         except Exception as ex:
             task_logger.error(f'Encountered oEmbed provider {oembed.get("provider_name")}.\n{ex}')
-            raise OembedFailureException()
-
-
-class TaskConfigFactory(TaskConfig):
-    state: TaskConfigState = TaskConfigState.VALID
-
-    @classmethod
-    def from_message(cls, message: Message) -> TaskConfig:
-        _config = {
-            'message': message,
-            'media_type': cls.__get_media_type(message),
-            **cls.__parse_start_and_end(message),
-        }
-        return TaskConfig(**_config)
+            return None
 
     @classmethod
     def __is_crosspost(cls, message: Message) -> bool:
@@ -236,76 +190,116 @@ class TaskConfigFactory(TaskConfig):
     @classmethod
     def __is_gif(cls, message: Message) -> bool:
         if cls.__is_crosspost(message=message):
-            return False  # todo
+            return False  # todo how to handle crossposted gifs?
         if message.submission.url:
             return os.path.splitext(message.submission.url)[-1][1:] == 'gif'
         return False
 
     @classmethod
-    def __is_oembed(cls, message: Message):
+    def __is_oembed(cls, message: Message) -> bool:
         # full oembed spec: https://oembed.com/#section2
         # media is a dynamic attribute on submission
-        if not hasattr(message.submission, 'media'):
+        if not getattr(message.submission, 'media', None):
             return False
         return bool(message.submission.media.get('oembed', False))
 
     @classmethod
-    def __parse_start_and_end(cls, message: Message) -> Dict[str, float]:
-        params = {}
+    def __parse_start_and_end(cls, message: Message) -> Optional[Tuple[float, float]]:
         pattern = re.compile(r'(s|start)=([\d]+) (e|end)=([\d]+)', re.IGNORECASE)
         matches = pattern.search(message.body)
         if matches is None:
             root_logger.warning('Skipping message because no match was found.')
-            cls.state = TaskConfigState.INVALID
-            return {}
+            return None
         root_logger.debug(f'Found pattern matches: {matches.groups()}')
-        params['start'] = int(matches.group(2))
-        params['end'] = int(matches.group(4))
-        return params
+        return int(matches.group(2)), int(matches.group(4))
 
     @classmethod
-    def __get_media_type(cls, message: Message) -> Union[MediaType, None]:
-        if cls.__is_video(message=message):
-            # get video from original post (apparently we can only get it from there so we do the the backtrace)
-            if cls.__is_crosspost(message=message):
-                reddit_video = message.submission.crosspost_parent_list[0].get('secure_media').get('reddit_video')
-            else:
-                reddit_video = message.submission.secure_media.get('reddit_video', {})
-            ext: str = os.path.splitext(reddit_video.get('scrubber_media_url', [' ']))[-1][1:]
-            if ext == '':
-                cls.state = TaskConfigState.INVALID
-                return None
-            return MediaType[ext.upper()]
-        elif cls.__is_gif(message=message):
-            return MediaType.GIF
-        elif cls.__is_oembed(message=message):
-            oembed: Dict = message.submission.media.get('oembed', {})
-            html_string: str
-            try:
-                html_string = oembed['html']
-            except KeyError:
-                html_string = oembed['url']
-            if not isinstance(html_string, str):
-                task_logger.error('Failed to obtain the HTML of the oEmbed.')
-            soup = BeautifulSoup(html_string, features='html.parser')
-            try:
-                # todo proper error handling! this has only been validated with
-                src_url = parse_qs(urlparse(soup.iframe.get('src'))[4]).get('src')[0]
-                another_soup = BeautifulSoup(requests.get(src_url).content, features='html.parser')
-                source_tag = another_soup.video.findAll(name='source')[1]
-                ext: str = os.path.splitext(source_tag['src'])[-1][1:]
-                return MediaType[ext.upper()]
-            except Exception as ex:
-                task_logger.error(f'Encountered oEmbed provider {oembed.get("provider_name")}.\n{ex}')
-        else:
-            cls.state = TaskConfigState.INVALID
-            return None
+    def __parse_output_type(cls, message: Message) -> Optional[MediaType]:
+        matches = re.search(r'(format|fmt)=(gif|mp4|webm)\b', message.body, re.IGNORECASE)
+        return MediaType[matches.group(2).upper()] if matches is not None else None
+
+    @classmethod
+    def __reddit_video(cls, message: Message) -> Dict:
+        # get video from original post (apparently we can only get it from there so we do the the backtrace)
+        if cls.__is_crosspost(message=message):
+            # todo make sure it always works with index 0 (should be the first post)
+            return message.submission.crosspost_parent_list[0].get('secure_media').get('reddit_video')
+        return message.submission.secure_media.get('reddit_video', {})
+
+    @classmethod
+    def __resolve_media_source(cls, message: Message, oembed_page: Optional[bytes]) -> Optional[_MediaSource]:
+        ext: str
+        try:
+            if cls.__is_video(message=message):
+                reddit_video = cls.__reddit_video(message=message)
+                ext = os.path.splitext(reddit_video.get('scrubber_media_url', ' '))[-1][1:]
+                media_url = reddit_video.get('fallback_url', '')
+                if ext == '' or media_url == '':
+                    return None
+                return _MediaSource(
+                    media_type=MediaType[ext.upper()],
+                    media_url=media_url,
+                    extension=ext,
+                    duration=reddit_video.get('duration'),
+                )
+            elif cls.__is_gif(message=message):
+                # AFAIK there is no duration sent when we are dealing with a GIF
+                return _MediaSource(
+                    media_type=MediaType.GIF,
+                    media_url=message.submission.url,
+                    extension='gif',
+                    duration=None,
+                )
+            elif cls.__is_oembed(message=message):
+                media_url, _, ext = cls.__get_oembed(message=message, oembed_page=oembed_page)
+                return _MediaSource(
+                    media_type=MediaType[ext.upper()],
+                    media_url=media_url,
+                    extension=ext,
+                    duration=None,
+                )
+        except KeyError as err:
+            task_logger.error(f'Unsupported media type: {err}')
+        except OembedFailureException:
+            pass  # already logged
+        return None
+
+    @classmethod
+    def __get_oembed(cls, message: Message, oembed_page: Optional[bytes]) -> Tuple[str, str, str]:
+        """Returns a tuple with the source url, the media MIME-type and the media extension.
+        """
+        oembed: Dict = message.submission.media.get('oembed', {})
+        if oembed_page is None:
+            task_logger.error(f'No page of the oEmbed provider {oembed.get("provider_name")} was fetched.')
+            raise OembedFailureException()
+        try:
+            soup = BeautifulSoup(oembed_page, features='html.parser')
+            source_tag = soup.video.findAll(name='source')[1]
+            ext: str = os.path.splitext(source_tag['src'])[-1][1:]
+            return source_tag['src'], source_tag['type'], ext
+        except Exception as ex:
+            task_logger.error(f'Encountered oEmbed provider {oembed.get("provider_name")}.\n{ex}')
+            raise OembedFailureException()
 
 
 class Task(object):
-    def __init__(self, config: TaskConfig):
+    def __init__(self, config: TaskConfig, source_cache: Optional[SourceCache] = None,
+                 partial_fetcher: Optional[PartialMediaFetcher] = None, cut_strategy: Optional[CutStrategy] = None,
+                 max_download_bytes: Optional[int] = None, source_path: Optional[str] = None):
         self.__config: TaskConfig = config
+        self._source_path = source_path  # the source media fetched by another process
+        self._source_cache = source_cache
+        self._partial_fetcher = partial_fetcher
+        self._cut_strategy = cut_strategy
+        self._max_download_bytes = max_download_bytes
         self._task_state = TaskState.VALID
+        # the time the task was put into the input queue and the costs of its stages once it is handled
+        self.enqueued_at: Optional[float] = None
+        self.lease: Optional[str] = None  # the lease of the record the task was received as from another process
+        self.cost: Optional[float] = None  # the estimated seconds of its fetch and cut, which order the input queue
+        self.fetch_seconds: float = 0
+        self.cut_seconds: float = 0
+        self.cut_cpu_seconds: float = 0
         self._select_handler()
 
     def __call__(self, *args, **kwargs):
@@ -316,40 +310,119 @@ class Task(object):
         return self._task_state
 
     def is_state(self, state: Union[TaskState, List[TaskState]]) -> bool:
-        if state is List:
+        if isinstance(state, list):
             return self._task_state in state
         return self._task_state == state
 
     def _select_handler(self):
         mt: MediaType = self.__config.media_type
         if mt == MediaType.GIF:
-            self._task_handler = handler_pkg.gif.GifCutHandler()
+            self._task_handler = handler_pkg.gif.GifCutHandler(strategy=self._cut_strategy)
         elif mt in [MediaType.MP4, MediaType.MOV, MediaType.WEBM]:
-            self._task_handler = handler_pkg.video.VideoCutHandler()
+            self._task_handler = handler_pkg.video.VideoCutHandler(strategy=self._cut_strategy)
         else:
             self._task_state = TaskState.DROP
             # self._task_handler = TestCutHandler()
             root_logger.warning(f'No handler for media type: {mt}')
 
+    @property
+    def trace_id(self) -> Optional[str]:
+        return self.__config.trace_id
+
     def handle(self) -> result_pkg.Result:
-        _stream: Optional[BytesIO] = self._fetch_stream()
+        with tracing.span('task', trace_id=self.trace_id, media_type=self.__config.media_type.name.lower()):
+            _t0, _cpu0 = time.perf_counter(), time.thread_time()
+            _stream: Optional[MediaBuffer] = self._fetch_stream()
+            self.fetch_seconds = time.perf_counter() - _t0
+            if self._task_state == TaskState.INVALID:
+                raise TaskFailureException('Failed to fetch stream from host!')
+            try:
+                if _stream is None:
+                    # neither partially fetched nor cached: cut while downloading
+                    _result = self._cut_while_downloading()
+                else:
+                    try:
+                        _result: result_pkg.Result = self._task_handler.cut(stream=_stream, config=self.__config)
+                    finally:
+                        _stream.close()  # removes the links of cached sources and partially fetched temporary files
+            finally:
+                # the CPU time of this thread, ffmpeg processes are accounted for by the cut workers
+                self.cut_seconds = time.perf_counter() - _t0 - self.fetch_seconds
+                self.cut_cpu_seconds = time.thread_time() - _cpu0
+            self._task_state = TaskState.DONE
+            _result.trace_id = self.trace_id
+            return _result
+
+    def _fetch_stream(self) -> Optional[MediaBuffer]:
+        """Returns the partially fetched or cached source media or None if it has to be downloaded while cutting.
+        """
+        media_url: str = self.__config.media_url
+        if self._source_path is not None:
+            self._task_state = TaskState.VALID
+            return MediaBuffer.from_path(self._source_path, owned=False)  # the fetching process removes it
+        if self._wants_partial_fetch():
+            # only fetch the header and the samples of the requested range of long progressive videos
+            with tracing.span('download', source='partial') as _span:
+                _partial: Optional[MediaBuffer] = self._partial_fetcher.fetch(
+                    media_url, start_ms=self.__config.start, end_ms=self.__config.end,
+                    suffix=f'.{self.__config.extension}',
+                )
+                _span.set('bytes', _partial.size if _partial is not None else 0)
+            if _partial is not None:
+                self._task_state = TaskState.VALID
+                return _partial
+        if self._source_cache is not None:
+            # shared on-disk source cache: repeated cuts of the same post only download the media once
+            with tracing.span('download', source='cache', cached=media_url in self._source_cache) as _span:
+                try:
+                    _cached: Optional[MediaBuffer] = self._source_cache.open_buffer(media_url)
+                except MediaTooLargeException as err:
+                    raise TaskFailureException(str(err))
+                _span.set('bytes', _cached.size if _cached is not None else 0)
+            self._task_state = TaskState.INVALID if _cached is None else TaskState.VALID
+            return _cached
+        self._task_state = TaskState.VALID
+        return None
+
+    def prefetch_source(self) -> Optional[MediaBuffer]:
+        """Fetches the source media through the source cache of this process for a cut in another process.
+
+        Returns:
+            A buffer linked to the cached source, whose path is handed to the cutting process and which must be closed
+            once the cut is done, or None if the cutting process fetches the media itself (partially or while
+            cutting).
+
+        Raises:
+            TaskFailureException: If the host did not serve the source media or it is too large.
+        """
+        if self._source_cache is None or self._wants_partial_fetch():
+            return None
+        _stream: Optional[MediaBuffer] = self._fetch_stream()
         if self._task_state == TaskState.INVALID:
             raise TaskFailureException('Failed to fetch stream from host!')
-        _result: result_pkg.Result = self._task_handler.cut(stream=_stream, config=self.__config)
-        self._task_state = TaskState.DONE
-        return _result
+        return _stream
 
-    def _fetch_stream(self) -> Optional[BytesIO]:
-        _stream: BytesIO
-        media_url: str = self.__config.media_url
-        with requests.get(media_url, stream=True) as r:
-            if r.status_code == 200:
-                self._task_state = TaskState.VALID
-                _stream = BytesIO(r.raw.read())
-            else:
+    def _cut_while_downloading(self) -> result_pkg.Result:
+        with tracing.span('download', source='stream'), shared_session().get(self.__config.media_url, stream=True) as r:
+            if r.status_code != 200:
                 self._task_state = TaskState.INVALID
-                return None
-        return _stream
+                raise TaskFailureException('Failed to fetch stream from host!')
+            # closing the response early (once the handler has read all it needs) aborts the download
+            try:
+                return self._task_handler.cut_chunks(
+                    capped_chunks(r, self._max_download_bytes, chunk_size=DOWNLOAD_CHUNK_BYTES), self.__config
+                )
+            except MediaTooLargeException as err:
+                raise TaskFailureException(str(err))
+
+    def _wants_partial_fetch(self) -> bool:
+        if self._partial_fetcher is None or self.__config.media_type not in [MediaType.MP4, MediaType.MOV]:
+            return False
+        if self._source_cache is not None and self.__config.media_url in self._source_cache:
+            return False  # the full source is already on disk
+        return self._partial_fetcher.is_worthwhile(
+            duration=self.__config.duration, start_ms=self.__config.start, end_ms=self.__config.end
+        )
 
     @property
     def config(self):
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from src.execution.record import CutRecord, UploadRecord
+
+# the topics of the records passed between the stage processes
+CUT_TOPIC = 'cut'
+UPLOAD_TOPIC = 'upload'
+
+Delivery = Tuple[str, Dict[str, Any]]
+
+
+class Transport(object):
+    """Passes JSON records between the stage processes through named topics.
+
+    A received record is leased rather than removed: it is removed once it is acknowledged and handed out again once
+    its lease expires, so that the records of a crashed process are picked up by another one (at-least-once delivery).
+    Implementations must be safe to use from several processes at once.
+
+    Attributes:
+        lease_seconds   The time a received record is leased to its receiver.
+    """
+
+    def __init__(self, lease_seconds: float = 3600):
+        self.lease_seconds = lease_seconds
+
+    def put(self, topic: str, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def get(self, topic: str) -> Optional[Delivery]:
+        """Leases the oldest available record of the topic without waiting.
+
+        Returns:
+            The lease and the record or None if no record is available.
+        """
+        raise NotImplementedError
+
+    def ack(self, topic: str, lease: str) -> None:
+        """Removes the leased record."""
+        raise NotImplementedError
+
+    def size(self, topic: str) -> int:
+        """Returns the number of available (not leased) records of the topic."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SpoolTransport(Transport):
+    """A transport of record files in a spool directory, e.g. on a file system that is shared by several nodes.
+
+    Records are files in `directory/<topic>/ready`, named by their time of arrival. A record is leased by renaming it
+    into `directory/<topic>/leased` under a name that is prefixed by the end of its lease, which only one of the
+    competing processes succeeds in (the lease is taken and dated by the same atomic rename).
+    """
+
+    def __init__(self, directory: str, lease_seconds: float = 3600):
+        super(SpoolTransport, self).__init__(lease_seconds=lease_seconds)
+        self._directory = directory
+
+    def _dir(self, topic: str, state: str) -> str:
+        path = os.path.join(self._directory, topic, state)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put(self, topic: str, record: Dict[str, Any]) -> None:
+        name = f'{time.time_ns():020d}-{uuid.uuid4().hex}.json'
+        tmp_path = os.path.join(self._dir(topic, 'tmp'), name)
+        with open(tmp_path, mode='w', encoding='utf-8') as fp:
+            json.dump(record, fp)
+        os.replace(tmp_path, os.path.join(self._dir(topic, 'ready'), name))  # atomically publish the record
+
+    def get(self, topic: str) -> Optional[Delivery]:
+        self._expire(topic)
+        ready, leased = self._dir(topic, 'ready'), self._dir(topic, 'leased')
+        for name in sorted(os.listdir(ready)):
+            lease = f'{time.time_ns() + int(self.lease_seconds * 1e9):020d}.{name}'
+            try:
+                os.rename(os.path.join(ready, name), os.path.join(leased, lease))
+                with open(os.path.join(leased, lease), mode='r', encoding='utf-8') as fp:
+                    return lease, json.load(fp)
+            except FileNotFoundError:
+                continue  # leased by another process (or its lease has expired already)
+        return None
+
+    def _expire(self, topic: str) -> None:
+        ready, leased = self._dir(topic, 'ready'), self._dir(topic, 'leased')
+        now = time.time_ns()
+        for lease in os.listdir(leased):
+            deadline, _, name = lease.partition('.')
+            if int(deadline) < now:
+                try:
+                    os.rename(os.path.join(leased, lease), os.path.join(ready, name))
+                except FileNotFoundError:
+                    pass  # acknowledged or expired by another process
+
+    def ack(self, topic: str, lease: str) -> None:
+        try:
+            os.remove(os.path.join(self._dir(topic, 'leased'), lease))
+        except FileNotFoundError:
+            pass
+
+    def size(self, topic: str) -> int:
+        return len(os.listdir(self._dir(topic, 'ready')))
+
+
+class SqliteTransport(Transport):
+    """A transport of records in a SQLite database (in WAL mode) that the processes of a single host share."""
+
+    def __init__(self, path: str, lease_seconds: float = 3600):
+        super(SqliteTransport, self).__init__(lease_seconds=lease_seconds)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # transactions are explicit, so that a record is leased by one process only
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, body TEXT NOT NULL, leased_until REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS records_topic ON records (topic, id)')
+
+    def put(self, topic: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute('INSERT INTO records (topic, body) VALUES (?, ?)', (topic, json.dumps(record)))
+
+    def get(self, topic: str) -> Optional[Delivery]:
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT id, body FROM records WHERE topic = ? AND (leased_until IS NULL OR leased_until < ?) '
+                    'ORDER BY id LIMIT 1', (topic, now)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE records SET leased_until = ? WHERE id = ?',
+                                     (now + self.lease_seconds, row[0]))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return (str(row[0]), json.loads(row[1])) if row is not None else None
+
+    def ack(self, topic: str, lease: str) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM records WHERE id = ?', (int(lease),))
+
+    def size(self, topic: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM records WHERE topic = ? AND (leased_until IS NULL OR leased_until < ?)',
+                (topic, time.time())
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def transport_for(url: str, lease_seconds: float = 3600) -> Transport:
+    """Returns the transport of `url`: `sqlite:///path/to/db` or `spool:///path/to/directory` (a relative path
+    with two slashes, e.g. `sqlite://.cache/stages.sqlite3`).
+    """
+    scheme, netloc, path, _, _ = urlsplit(url)
+    path = netloc + path
+    if scheme == 'sqlite':
+        return SqliteTransport(path, lease_seconds=lease_seconds)
+    if scheme == 'spool':
+        return SpoolTransport(path, lease_seconds=lease_seconds)
+    raise ValueError(f'Unknown stage transport: {url}')
+
+
+Record = Union[CutRecord, UploadRecord]
+
+
+class StageQueue(object):
+    """The queue of a stage whose producers and consumers run in other processes, backed by a transport topic.
+
+    It offers the part of :class:`asyncio.Queue` the controller uses: tasks and results that are put are sent as
+    :class:`CutRecord` and :class:`UploadRecord`, respectively; :meth:`get` returns the received records (waiting
+    until one is available), which are acknowledged with :meth:`ack` once the stage is done with them. Like a bounded
+    queue, :meth:`put` waits while `maxsize` records are available.
+
+    Attributes:
+        topic           The topic of the stage, :data:`CUT_TOPIC` or :data:`UPLOAD_TOPIC`.
+        maxsize         The bound of available records; 0 is unbounded.
+        poll_seconds    The interval the transport is polled in while it is empty (or full).
+    """
+
+    def __init__(self, transport: Transport, topic: str, maxsize: int = 0, poll_seconds: float = 0.5):
+        if topic not in (CUT_TOPIC, UPLOAD_TOPIC):
+            raise ValueError(f'Unknown stage topic: {topic}')
+        self.topic = topic
+        self.maxsize = maxsize
+        self.poll_seconds = poll_seconds
+        self._transport = transport
+
+    def qsize(self) -> int:
+        return self._transport.size(self.topic)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    async def put(self, item) -> None:
+        while self.maxsize > 0 and self.qsize() >= self.maxsize:
+            await asyncio.sleep(self.poll_seconds)
+        record: Record = CutRecord.from_task(item) if self.topic == CUT_TOPIC else UploadRecord.from_result(item)
+        self._transport.put(self.topic, record.to_dict())
+
+    async def get(self) -> Record:
+        while True:
+            delivery: Optional[Delivery] = self._transport.get(self.topic)
+            if delivery is not None:
+                lease, data = delivery
+                return (CutRecord if self.topic == CUT_TOPIC else UploadRecord).from_dict(data, lease=lease)
+            await asyncio.sleep(self.poll_seconds)
+
+    def ack(self, item) -> None:
+        """Acknowledges the record the item was received as (a task or result carries its lease)."""
+        lease: Optional[str] = getattr(item, 'lease', None)
+        if lease is not None:
+            self._transport.ack(self.topic, lease)
+
+    def task_done(self) -> None:
+        pass  # received records are acknowledged with ack
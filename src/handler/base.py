@@ -1,12 +1,22 @@
 from __future__ import annotations
 
 import abc
-from io import BytesIO
+from typing import Iterable
 
 import src.execution.task as task_pkg
 import src.model.result as result_pkg
+from src.util.media_buffer import MediaBuffer
 
 
 class BaseCutHandler(metaclass=abc.ABCMeta):
     @abc.abstractmethod
-    def cut(self, stream: BytesIO, config: task_pkg.TaskConfig) -> result_pkg.Result: ...
+    def cut(self, stream: MediaBuffer, config: task_pkg.TaskConfig) -> result_pkg.Result: ...
+
+    def cut_chunks(self, chunks: Iterable[bytes], config: task_pkg.TaskConfig) -> result_pkg.Result:
+        """Cuts media that arrives in `chunks` (e.g. while it is downloaded).
+
+        Handlers that cannot cut while the media arrives collect the chunks (in memory or spilled to disk) and cut the
+        whole stream.
+        """
+        with MediaBuffer.from_chunks(chunks) as stream:
+            return self.cut(stream=stream, config=config)
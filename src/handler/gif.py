@@ -1,71 +1,189 @@
+import contextlib
 import math
+import threading
 from io import BytesIO
-from typing import List
+from typing import Iterator, List, Optional
 
 import PIL
 import PIL.GifImagePlugin
 import PIL.Image
-import PIL.ImageSequence
 
 import src.model.result as result
 from src.execution import task
 from src.handler import base
+from src.handler.strategy import CutStrategy
 from src.model.media_type import MediaType
-from src.util import gif_utilities
+from src.util import gif_utilities, tracing
+from src.util.aux import palette_index
+from src.util.media_buffer import MediaBuffer
+
+# the output media types a GIF can be transcoded to after it is cut
+TRANSCODE_TYPES = (MediaType.MP4, MediaType.WEBM)
+
+_palette_loading_lock = threading.Lock()
+_palette_loading_cuts: int = 0
+_previous_loading_strategy: Optional[PIL.GifImagePlugin.LoadingStrategy] = None
+
+
+@contextlib.contextmanager
+def _palette_loading() -> Iterator[None]:
+    """Loads frames that share the palette of the first frame in their `P` mode instead of converting them to RGB(A).
+
+    Pillow only offers this as a process-wide global (`PIL.GifImagePlugin.LOADING_STRATEGY`), which is deliberately
+    set while a cut loads frames and restored to its previous value once the last concurrent cut is done, so other
+    users of Pillow in the process are not affected outside of cuts.
+    """
+    global _palette_loading_cuts, _previous_loading_strategy
+    with _palette_loading_lock:
+        if _palette_loading_cuts == 0:
+            _previous_loading_strategy = PIL.GifImagePlugin.LOADING_STRATEGY
+            PIL.GifImagePlugin.LOADING_STRATEGY = PIL.GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+        _palette_loading_cuts += 1
+    try:
+        yield
+    finally:
+        with _palette_loading_lock:
+            _palette_loading_cuts -= 1
+            if _palette_loading_cuts == 0:
+                PIL.GifImagePlugin.LOADING_STRATEGY = _previous_loading_strategy
 
 
 class GifCutHandler(base.BaseCutHandler):
+    """Cuts GIFs by splicing or re-encoding the selected frames.
+
+    Without a watermark, the compressed frames are spliced into the cut as they are (see
+    :func:`gif_utilities.splice_gif`) and at most the first frame is decoded to composite the canvas it builds on.
+
+    Otherwise the frames are re-encoded: if all selected frames share one palette and transparent index and the
+    watermark can be drawn with a color of the palette, the frames are kept in `P` mode, so they are written with
+    their palette as is. Otherwise the frames are converted to RGB and PIL re-quantizes every frame when it is saved,
+    which costs a multiple of the CPU time and memory.
+
+    If the task requests an MP4 or WebM output, the cut GIF is transcoded to a silent video, which is usually a
+    fraction of the size of the GIF and is uploaded like a video cut.
+
+    Attributes:
+        splice              A flag indicating if frames are spliced when possible.
+        preserve_palette    A flag indicating if re-encoded frames are kept in `P` mode when possible.
+    """
+
+    def __init__(self, splice: bool = True, preserve_palette: bool = True, strategy: Optional[CutStrategy] = None):
+        self.splice = splice
+        self.preserve_palette = preserve_palette
+        self._strategy = strategy
+
     # @decorator.create_hook(pre=None, post=base.post_cut_hook)
-    def cut(self, stream: BytesIO, config: task.TaskConfig) -> result.Result:
+    def cut(self, stream: MediaBuffer, config: task.TaskConfig) -> result.Result:
         start_ms = config.start
         end_ms = config.end
-        watermark = config.watermark
         duration = config.duration
 
-        stream.seek(0)
-        image: PIL.Image = PIL.Image.open(stream)
+        with tracing.span('probe', bytes=stream.size) as _span:
+            scan = gif_utilities.scan_gif(stream)
+            _span.set('frames', len(scan.frames))
         if duration is None:
-            duration = gif_utilities.get_gif_duration(image=image)
+            duration = scan.duration
             end_ms = min(end_ms or math.inf, duration * 1000)  # put a realistic upper bound on end
-        # duration_ms = duration * 1000
-        target_duration_ms = end_ms - start_ms
-        # assert 0 < target_duration_ms < duration_ms and end_ms <= duration_ms  # sanity check
-        # iterate GIF frames and optionally apply watermark
-        frames: List[PIL.Image.Image] = []
-        cum_duration_ms = 0
-        frame: PIL.Image.Image
-        for frame in PIL.ImageSequence.Iterator(image):
-            # https://pillow.readthedocs.io/en/latest/handbook/image-file-formats.html#gif
-            if cum_duration_ms < start_ms:
-                cum_duration_ms += frame.info['duration']
-                continue
-            if cum_duration_ms < start_ms + end_ms:
-                frames.append(watermark(frame.convert('RGB')))
-                cum_duration_ms += frame.info['duration']
-            elif len(frames) == 0:
-                # special case: diff is too small that we just have to take a single frame
-                # if end_ms - start_ms < frame.info['frame_duration']:
-                frames.append(watermark(frame.convert('RGB')))
-                break
+        # look up the frames covering [start_ms, end_ms) from the block headers instead of accumulating delays
+        first_frame, last_frame = scan.frame_range(start_ms, end_ms)
+        output = MediaBuffer(suffix='.gif')
+        splice = self.splice and config.watermark is None and gif_utilities.can_splice(scan, first_frame=first_frame)
+        with tracing.span('encode', method='splice' if splice else 'reencode', frames=last_frame - first_frame + 1):
+            if splice:
+                self._splice(stream, scan=scan, first_frame=first_frame, last_frame=last_frame, output=output)
             else:
-                break  # early stopping
+                self._reencode(stream, scan=scan, first_frame=first_frame, last_frame=last_frame, config=config,
+                               output=output)
+        output.seek(0)
+        if config.output_type in TRANSCODE_TYPES:
+            return self._transcode(output, config=config)
+        # gif: PIL.GifImagePlugin.GifImageFile = PIL.Image.open(output)
+        return result.Result(
+            media_stream=output,
+            media_type=MediaType.GIF,
+            message=config.message,
+            # gif_duration=gif_duration_seconds,
+        )
+
+    def _transcode(self, output: MediaBuffer, config: task.TaskConfig) -> result.Result:
+        if self._strategy is None:
+            self._strategy = CutStrategy()
+        try:
+            video = self._strategy.transcode_gif(output.path, ext=config.output_type.name.lower())
+        finally:
+            output.close()
+        return result.Result(
+            media_stream=video,
+            media_type=config.output_type,
+            message=config.message,
+        )
+
+    @staticmethod
+    def _splice(stream: MediaBuffer, scan: gif_utilities.GifScan, first_frame: int, last_frame: int,
+                output: MediaBuffer) -> None:
+        key_frame_gif: Optional[BytesIO] = None
+        if gif_utilities.needs_key_frame(scan, first_frame=first_frame):
+            # the only decoded frame: the canvas the first frame of the cut builds on
+            key_frame_gif = BytesIO()
+            with _palette_loading():
+                stream.seek(0)
+                image: PIL.Image = PIL.Image.open(stream)
+                image.seek(first_frame)
+                # a canvas that is still in `P` mode is written with its palette, otherwise it is quantized
+                (image if image.mode == 'P' else image.convert('RGBA')).save(key_frame_gif, format='GIF')
+        with stream.getbuffer() as data:
+            gif_utilities.splice_gif(
+                data, scan=scan, first_frame=first_frame, last_frame=last_frame, output=output,
+                key_frame_gif=key_frame_gif,
+            )
+
+    def _reencode(self, stream: MediaBuffer, scan: gif_utilities.GifScan, first_frame: int, last_frame: int,
+                  config: task.TaskConfig, output: MediaBuffer) -> None:
+        watermark = config.apply_watermark
+        # iterate the selected GIF frames and optionally apply watermark
+        frames: Optional[List[PIL.Image.Image]] = None
+        with _palette_loading():
+            stream.seek(0)
+            image: PIL.Image = PIL.Image.open(stream)
+            if self.preserve_palette and self._has_stable_transparency(scan, last_frame=last_frame):
+                frames = self._palette_frames(image, first_frame=first_frame, last_frame=last_frame, config=config)
+            if frames is None:
+                frames = []
+                for index in range(first_frame, last_frame + 1):
+                    # https://pillow.readthedocs.io/en/latest/handbook/image-file-formats.html#gif
+                    image.seek(index)
+                    frames.append(watermark(image.convert('RGB')))
         assert len(frames) > 0  # sanity check that there is at least one frame
-        _result: result.Result
-        gif_duration_seconds = target_duration_ms / (1000 * len(frames))  # average frame duration
-        output = BytesIO()
         frames[0].save(
             output,
             format='GIF',
             save_all=True,
             append_images=frames[1:],
             optimize=False,
-            duration=gif_duration_seconds,
+            duration=scan.delays[first_frame:last_frame + 1],  # keep the original per-frame delays
             loop=0
         )
-        # gif: PIL.GifImagePlugin.GifImageFile = PIL.Image.open(output)
-        return result.Result(
-            media_stream=output,
-            media_type=MediaType.GIF,
-            message=config.message,
-            # gif_duration=gif_duration_seconds,
-        )
+
+    @staticmethod
+    def _has_stable_transparency(scan: gif_utilities.GifScan, last_frame: int) -> bool:
+        # composited `P` frames keep the transparent index of the first frame: if a frame up to the last one uses
+        # another index, its opaque pixels of the first frame's index would turn transparent
+        transparency = scan.frames[0].transparency
+        return transparency is None or all(frame.transparency == transparency for frame in scan.frames[:last_frame + 1])
+
+    @staticmethod
+    def _palette_frames(image: PIL.Image.Image, first_frame: int, last_frame: int,
+                        config: task.TaskConfig) -> Optional[List[PIL.Image.Image]]:
+        # returns None if a frame has a palette of its own (PIL loads it as RGB(A)) or lacks the watermark color
+        frames: List[PIL.Image.Image] = []
+        for index in range(first_frame, last_frame + 1):
+            image.seek(index)
+            if image.mode != 'P':
+                return None
+            frame = image.copy()
+            if config.watermark is not None:
+                if palette_index(frame, config.watermark.color) is None:
+                    return None
+                config.apply_watermark(frame)
+            frames.append(frame)
+        return frames
@@ -0,0 +1,325 @@
+import bisect
+import os
+import shlex
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from typing import Iterable, List, Optional, Tuple
+
+from src.model.cut_mode import CutMode, CutPolicy
+from src.util import tracing, video_utilities
+from src.util.media_buffer import MediaBuffer
+from src.util.logger import cut_logger
+
+# the input of streamed cuts
+STREAM_SOURCE = 'pipe:0'
+# input seeks land on the keyframe at or before the seek target, so keyframe targets are nudged past float rounding
+KEYFRAME_EPSILON = 0.001
+# encoders of the source codecs a partial GOP can be re-encoded with, so that it can be spliced with copied GOPs
+VIDEO_ENCODERS = {
+    'h264': 'libx264 -preset veryfast -crf 18 -pix_fmt yuv420p',
+    'vp8': 'libvpx -deadline realtime -cpu-used 8 -crf 10 -b:v 2M',
+    'vp9': 'libvpx-vp9 -deadline realtime -cpu-used 8 -row-mt 1 -crf 32 -b:v 0',
+}
+AUDIO_ENCODERS = {
+    'aac': 'aac',
+    'vorbis': 'libvorbis',
+    'opus': 'libopus',
+}
+# encoders of animated GIFs transcoded to video: 4:2:0 chroma subsampling needs even frame dimensions
+GIF_TRANSCODE_ENCODERS = {
+    'mp4': 'libx264 -preset veryfast -crf 23 -pix_fmt yuv420p',
+    'webm': 'libvpx-vp9 -deadline realtime -cpu-used 8 -row-mt 1 -crf 35 -b:v 0 -pix_fmt yuv420p',
+}
+# the codecs each output container can hold, the first one is used if the source codec does not fit
+CONTAINER_VIDEO_CODECS = {'mp4': ['h264'], 'mov': ['h264'], 'webm': ['vp9', 'vp8']}
+CONTAINER_AUDIO_CODECS = {'mp4': ['aac'], 'mov': ['aac'], 'webm': ['opus', 'vorbis']}
+# bitstream filters of copied smart-cut segments; H.264 parameter sets are repeated in-band at every keyframe as the
+# re-encoded head carries different ones in the (single) codec configuration of the output
+SEGMENT_BITSTREAM_FILTERS = {'h264': '-bsf:v h264_mp4toannexb '}
+
+
+@dataclass(frozen=True)
+class CutPlan:
+    """How a single range of a video is cut.
+
+    Attributes:
+        mode            The cut mode.
+        start           The start of the output in seconds. For :attr:`CutMode.COPY` this is the keyframe at or
+                        before the requested start, unless the input is streamed: then it is the requested start
+                        and the output starts at the first keyframe at or after it.
+        end             The end of the output in seconds.
+        keyframe        For :attr:`CutMode.SMART`, the first keyframe after the start at which the re-encoded head
+                        is spliced with the copied tail; None otherwise.
+    """
+    mode: CutMode
+    start: float
+    end: float
+    keyframe: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class CutStrategy(object):
+    """Plans and runs video cuts according to a per-deployment accuracy/speed policy.
+
+    The keyframes of a source are probed once (and kept for `max_probes` sources) and each cut is then planned:
+
+    * :attr:`CutPolicy.SPEED` always stream copies from the keyframe at or before the start.
+    * :attr:`CutPolicy.BALANCED` stream copies if the start is at most `keyframe_tolerance_ms` after a keyframe,
+      otherwise it smart-cuts and falls back to a full re-encode if the source codec cannot be spliced or no
+      keyframe lies within the range.
+    * :attr:`CutPolicy.ACCURACY` always re-encodes the whole range.
+    """
+
+    def __init__(self, policy: CutPolicy = CutPolicy.BALANCED, keyframe_tolerance_ms: float = 250,
+                 max_probes: int = 128):
+        self._policy = policy
+        self._keyframe_tolerance = keyframe_tolerance_ms / 1000
+        self._max_probes = max_probes
+        self._probes: 'OrderedDict[str, video_utilities.VideoProbe]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def policy(self) -> CutPolicy:
+        return self._policy
+
+    def probe(self, path: str, key: Optional[str] = None) -> video_utilities.VideoProbe:
+        """Returns the (cached) probe of the video file at `path`, cached under `key` (e.g. the media url)."""
+        key = path if key is None else key
+        with self._lock:
+            probe = self._probes.get(key)
+            if probe is not None:
+                self._probes.move_to_end(key)
+                return probe
+        with tracing.span('probe', bytes=os.path.getsize(path)) as _span:
+            probe = video_utilities.probe_video(path)
+            _span.set('keyframes', len(probe.keyframes))
+        with self._lock:
+            self._probes[key] = probe
+            while len(self._probes) > self._max_probes:
+                self._probes.popitem(last=False)
+        return probe
+
+    def plan(self, probe: video_utilities.VideoProbe, start_ms: float, end_ms: float,
+             mode: Optional[CutMode] = None) -> CutPlan:
+        """Returns the plan to cut [start_ms, end_ms) in the given `mode` or in the mode chosen by the policy."""
+        start, end = start_ms / 1000, end_ms / 1000
+        keyframes = probe.keyframes
+        previous = keyframes[max(bisect.bisect_right(keyframes, start + KEYFRAME_EPSILON) - 1, 0)]
+        following = self._next_keyframe(keyframes, start)
+        if mode is None:
+            mode = self._choose(probe, start=start, end=end, previous=previous, following=following)
+        if mode == CutMode.COPY:
+            return CutPlan(mode=mode, start=previous, end=end)
+        if mode == CutMode.SMART and following is not None and following < end:
+            return CutPlan(mode=mode, start=start, end=end, keyframe=following)
+        # a smart-cut without a keyframe within the range re-encodes the range anyway
+        return CutPlan(mode=CutMode.REENCODE, start=start, end=end)
+
+    def plan_stream(self, start_ms: float, end_ms: float) -> Optional[CutPlan]:
+        """Returns the plan to cut [start_ms, end_ms) from a streamed input or None if the policy needs a probe.
+
+        A streamed input can neither be probed upfront nor be read twice, so only the single pass modes of the speed
+        and accuracy policies are available.
+        """
+        if self._policy == CutPolicy.SPEED:
+            return CutPlan(mode=CutMode.COPY, start=start_ms / 1000, end=end_ms / 1000)
+        if self._policy == CutPolicy.ACCURACY:
+            return CutPlan(mode=CutMode.REENCODE, start=start_ms / 1000, end=end_ms / 1000)
+        return None
+
+    @staticmethod
+    def _next_keyframe(keyframes: List[float], start: float) -> Optional[float]:
+        index = bisect.bisect_right(keyframes, start + KEYFRAME_EPSILON)
+        return keyframes[index] if index < len(keyframes) else None
+
+    def _choose(self, probe: video_utilities.VideoProbe, start: float, end: float, previous: float,
+                following: Optional[float]) -> CutMode:
+        if self._policy == CutPolicy.SPEED:
+            return CutMode.COPY
+        if self._policy == CutPolicy.ACCURACY:
+            return CutMode.REENCODE
+        if start - previous <= self._keyframe_tolerance:
+            return CutMode.COPY
+        if probe.video_codec in VIDEO_ENCODERS and following is not None and following < end:
+            return CutMode.SMART
+        return CutMode.REENCODE
+
+    def cut(self, path: str, plan: CutPlan, probe: video_utilities.VideoProbe, ext: str) -> MediaBuffer:
+        """Cuts the video file at `path` according to `plan` and returns the `ext` formatted output."""
+        t0 = time.perf_counter()
+        source = shlex.quote(path)
+        with tracing.span('encode', mode=plan.mode.name.lower(), seconds=plan.duration):
+            if plan.mode == CutMode.COPY:
+                out = self._copy(source, plan=plan, ext=ext)
+            elif plan.mode == CutMode.SMART:
+                out = self._smart(source, plan=plan, probe=probe, ext=ext)
+            else:
+                out = self._reencode(source, plan=plan, probe=probe, ext=ext)
+        cut_logger.info(f'Cut {plan.duration:.2f}s of {os.path.basename(path)} in {plan.mode.name} mode within '
+                        f'{(time.perf_counter() - t0) * 1000:.0f}ms.')
+        return out
+
+    def cut_stream(self, chunks: Iterable[bytes], plan: CutPlan, ext: str) -> MediaBuffer:
+        """Cuts the video arriving in `chunks` according to a :meth:`plan_stream` plan while it arrives.
+
+        The chunks are written to the stdin of ffmpeg as they are produced and the iteration stops as soon as ffmpeg
+        has read everything it needs, so only a few chunks are held in memory at any time.
+        """
+        t0 = time.perf_counter()
+        with tracing.span('encode', mode=plan.mode.name.lower(), seconds=plan.duration, streamed=True):
+            if plan.mode == CutMode.COPY:
+                out = self._copy(STREAM_SOURCE, plan=plan, ext=ext, chunks=chunks)
+            elif plan.mode == CutMode.REENCODE:
+                out = self._reencode(STREAM_SOURCE, plan=plan, probe=None, ext=ext, chunks=chunks)
+            else:
+                raise ValueError(f'{plan.mode.name} mode cannot cut a streamed input.')
+        cut_logger.info(f'Cut {plan.duration:.2f}s of a streamed input in {plan.mode.name} mode within '
+                        f'{(time.perf_counter() - t0) * 1000:.0f}ms.')
+        return out
+
+    def transcode_gif(self, path: str, ext: str) -> MediaBuffer:
+        """Transcodes the (cut) animated GIF at `path` to a silent MP4 (H.264) or WebM (VP9) video.
+
+        ffmpeg composites the frames (disposal and transparency) itself and keeps the variable frame delays.
+        """
+        t0 = time.perf_counter()
+        with tracing.span('encode', mode='transcode', output=ext):
+            out = self._run(
+                f'ffmpeg -v error -f gif -i {shlex.quote(path)} -map 0:v:0 -vf scale=trunc(iw/2)*2:trunc(ih/2)*2 '
+                f'-c:v {GIF_TRANSCODE_ENCODERS[ext]} -an {self._output_args(ext)}'
+            )
+        cut_logger.info(f'Transcoded GIF of {os.path.getsize(path)} bytes to {ext} of {out.size} bytes within '
+                        f'{(time.perf_counter() - t0) * 1000:.0f}ms.')
+        return out
+
+    @staticmethod
+    def _output_args(ext: str) -> str:
+        # fragmented output (empty_moov) as the mp4/mov muxer cannot seek back in a pipe to write the moov
+        # movflags with empty_moov: https://stackoverflow.com/questions/25411836/ffmpeg-doesnt-work-with-mp4-and-stdout
+        movflags = '-movflags frag_keyframe+empty_moov ' if ext in ['mp4', 'mov'] else ''
+        return f'{movflags}-f {ext} pipe:1'
+
+    @staticmethod
+    def _audio_encoder(probe: Optional[video_utilities.VideoProbe], ext: str) -> str:
+        audio_codecs = CONTAINER_AUDIO_CODECS.get(ext, ['aac'])
+        audio_codec = probe.audio_codec if probe is not None else None
+        return AUDIO_ENCODERS[audio_codec if audio_codec in audio_codecs else audio_codecs[0]]
+
+    def _encoder_args(self, probe: Optional[video_utilities.VideoProbe], ext: str) -> str:
+        # without a probe (streamed input), the default codecs of the container are used
+        video_codecs = CONTAINER_VIDEO_CODECS.get(ext, ['h264'])
+        video_codec = probe.video_codec if probe is not None else None
+        args = f'-c:v {VIDEO_ENCODERS[video_codec if video_codec in video_codecs else video_codecs[0]]}'
+        if probe is None or probe.audio_codec is not None:
+            args += f' -c:a {self._audio_encoder(probe, ext=ext)}'
+        return args
+
+    @classmethod
+    def _run(cls, cmd: str, chunks: Optional[Iterable[bytes]] = None) -> MediaBuffer:
+        with tracing.span('ffmpeg', command=cmd) as _span:
+            returncode, out, err = cls._run_process(cmd, chunks=chunks)
+            if returncode != 0:
+                out.close()
+                cut_logger.error(err.decode(errors='replace')[-2000:])
+                raise ValueError(f'ffmpeg failed with exit code {returncode}.')
+            _span.set('bytes', out.size)
+        return out
+
+    @staticmethod
+    def _run_process(cmd: str, chunks: Optional[Iterable[bytes]]) -> Tuple[int, MediaBuffer, bytes]:
+        proc = subprocess.Popen(shlex.split(cmd), stdin=subprocess.DEVNULL if chunks is None else subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors: List[BaseException] = []
+        stderr: List[bytes] = []
+
+        def feed():
+            try:
+                for chunk in chunks:
+                    proc.stdin.write(chunk)
+            except BrokenPipeError:
+                pass  # ffmpeg exited, e.g. because it has read everything up to the end of the range
+            except BaseException as err:  # e.g. the download failed
+                errors.append(err)
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        # stdin is fed and stderr drained in threads while stdout is copied (in chunks, spilling large outputs to
+        # disk) here, so none of the pipes can block ffmpeg
+        threads = [threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)]
+        if chunks is not None:
+            threads.append(threading.Thread(target=feed, daemon=True))
+        for thread in threads:
+            thread.start()
+        out = MediaBuffer.from_stream(proc.stdout)
+        returncode = proc.wait()
+        for thread in threads:
+            thread.join()
+        if errors:
+            out.close()
+            raise errors[0]
+        return returncode, out, b''.join(stderr)
+
+    @staticmethod
+    def _input_args(source: str, start: float) -> str:
+        if source == STREAM_SOURCE:
+            # a pipe cannot be seeked, so ffmpeg reads and discards the input up to the start instead
+            return f'-i {source} -ss {start}'
+        # seeking before the input only reads from the keyframe on; partially fetched fragments keep their original
+        # timestamps, hence seek by timestamp instead of relative to the start of the file
+        return f'-seek_timestamp 1 -ss {start} -i {source}'
+
+    def _copy(self, source: str, plan: CutPlan, ext: str, chunks: Optional[Iterable[bytes]] = None) -> MediaBuffer:
+        return self._run(
+            f'ffmpeg -v error {self._input_args(source, start=plan.start + KEYFRAME_EPSILON)} -t {plan.duration} '
+            f'-map 0:v:0 -map 0:a:0? -c copy -avoid_negative_ts make_zero {self._output_args(ext)}',
+            chunks=chunks,
+        )
+
+    def _reencode(self, source: str, plan: CutPlan, probe: Optional[video_utilities.VideoProbe], ext: str,
+                  chunks: Optional[Iterable[bytes]] = None) -> MediaBuffer:
+        # input seeking with re-encoding is frame accurate (ffmpeg decodes from the previous keyframe and discards)
+        return self._run(
+            f'ffmpeg -v error {self._input_args(source, start=plan.start)} -t {plan.duration} '
+            f'-map 0:v:0 -map 0:a:0? {self._encoder_args(probe, ext=ext)} {self._output_args(ext)}',
+            chunks=chunks,
+        )
+
+    def _smart(self, source: str, plan: CutPlan, probe: video_utilities.VideoProbe, ext: str) -> MediaBuffer:
+        bitstream_filters = SEGMENT_BITSTREAM_FILTERS.get(probe.video_codec, '')
+        with TemporaryDirectory() as directory:
+            head, tail = os.path.join(directory, 'head'), os.path.join(directory, 'tail')
+            # the partial GOP up to the keyframe is re-encoded with the source codec ...
+            self._run(
+                f'ffmpeg -v error -seek_timestamp 1 -ss {plan.start} -i {source} -t {plan.keyframe - plan.start} '
+                f'-map 0:v:0 -c:v {VIDEO_ENCODERS[probe.video_codec]} -f matroska {head}'
+            ).close()
+            # ... the whole GOPs from the keyframe on are copied ...
+            self._run(
+                f'ffmpeg -v error -seek_timestamp 1 -ss {plan.keyframe + KEYFRAME_EPSILON} -i {source} '
+                f'-t {plan.end - plan.keyframe} -map 0:v:0 -c copy {bitstream_filters}'
+                f'-avoid_negative_ts make_zero -f matroska {tail}'
+            ).close()
+            playlist = os.path.join(directory, 'segments.txt')
+            with open(playlist, 'w') as fp:
+                fp.write(f"file '{head}'\nfile '{tail}'\n")
+            # ... and the audio is re-encoded over the whole range, as audio codec headers (e.g. vorbis) cannot be
+            # spliced and encoding audio is cheap
+            audio_input, audio_args = '', ''
+            if probe.audio_codec is not None:
+                audio_input = f'-seek_timestamp 1 -ss {plan.start} -t {plan.duration} -i {source} '
+                audio_args = f'-map 1:a:0 -c:a {self._audio_encoder(probe, ext=ext)} '
+            return self._run(
+                f'ffmpeg -v error -f concat -safe 0 -i {playlist} {audio_input}-map 0:v:0 -c:v copy {audio_args}'
+                f'-map_metadata -1 '  # drop the duration tags of the head segment
+                f'{self._output_args(ext)}'
+            )
@@ -1,12 +1,11 @@
 from __future__ import annotations
 
-from io import BytesIO
-
 from src.execution import task
 from src.handler.base import BaseCutHandler
 from src.util.logger import root_logger
+from src.util.media_buffer import MediaBuffer
 
 
 class TestCutHandler(BaseCutHandler):
-    def cut(self, stream: BytesIO, config: task.TaskConfig):
+    def cut(self, stream: MediaBuffer, config: task.TaskConfig):
         root_logger.debug(stream.getvalue().decode('utf-8'))
@@ -1,54 +1,74 @@
+import itertools
 import math
-import shlex
-import subprocess
-from io import BytesIO
-from tempfile import NamedTemporaryFile
+import os
+from typing import Iterable, Optional, Tuple
 
 import src.model.result as result
 from src.execution import task
 from src.handler import base
+from src.handler.strategy import CutStrategy
 from src.util import video_utilities
+from src.util.media_buffer import MediaBuffer
+
+# the maximum number of leading bytes buffered to tell whether a video can be read from a pipe
+MAX_SNIFF_BYTES = 8 * 1024 * 1024
 
 
 class VideoCutHandler(base.BaseCutHandler):
-    def cut(self, stream: BytesIO, config: task.TaskConfig) -> result.Result:
-        start_ms = config.start
-        end_ms = config.end
-        watermark = config.watermark
-        duration = config.duration
-        ext = config.extension
-        if duration is None:
-            duration = video_utilities.get_vid_duration(stream)
-            end_ms = min(end_ms or math.inf, duration * 1000)  # put a realistic upper bound on end
-        duration_ms = duration * 1000
-        target_duration_ms = end_ms - start_ms
-        assert 0 < target_duration_ms < duration_ms and end_ms <= duration_ms  # sanity check
-        # https://stackoverflow.com/questions/18444194/cutting-the-videos-based-on-start-and-end-time-using-ffmpeg#comment51400781_18449609
-        # movflags with empty_moov: https://stackoverflow.com/questions/25411836/ffmpeg-doesnt-work-with-mp4-and-stdout
-        # seed before input is faster but less accurate; after input is slower but more accurate
-        cut_cmd = shlex.split(
-            f'ffmpeg -i pipe:0 -copyinkf -c:v copy -c:a copy -crf 0 -vcodec h264 -movflags empty_moov -ss {start_ms / 1000} -t {target_duration_ms / 1000} -f {ext} pipe:1'
+    def __init__(self, strategy: Optional[CutStrategy] = None):
+        self._strategy = CutStrategy() if strategy is None else strategy
+
+    def cut(self, stream: MediaBuffer, config: task.TaskConfig) -> result.Result:
+        # all cut modes seek in the input (and smart-cuts read it several times), which a pipe does not allow
+        return self._cut_file(stream.path, config=config)
+
+    def cut_chunks(self, chunks: Iterable[bytes], config: task.TaskConfig) -> result.Result:
+        """Cuts the video while it is downloaded if its format and the cut policy allow reading it from a pipe.
+
+        Otherwise (e.g. an MP4/MOV whose `moov` box follows the `mdat` box) the chunks are spooled to a temporary
+        file, so that the video is never held in memory as a whole.
+        """
+        chunks = iter(chunks)
+        head = bytearray()
+        needs_seekable_input = None
+        for chunk in chunks:
+            head += chunk
+            needs_seekable_input = video_utilities.needs_seekable_input(head, ext=config.extension)
+            if needs_seekable_input is not None or len(head) >= MAX_SNIFF_BYTES:
+                break
+        chunks = itertools.chain([bytes(head)], chunks)
+        start_ms, end_ms = self._bounded_range(config, duration=config.duration)
+        plan = self._strategy.plan_stream(start_ms=start_ms, end_ms=end_ms)
+        if needs_seekable_input is False and plan is not None:
+            return self._result(self._strategy.cut_stream(chunks, plan=plan, ext=config.extension), config=config)
+        with MediaBuffer.on_disk(suffix=f'.{config.extension}') as spooled:
+            for chunk in chunks:
+                spooled.write(chunk)
+            return self._cut_file(spooled.path, config=config)
+
+    def _cut_file(self, input_path: str, config: task.TaskConfig) -> result.Result:
+        # keyframes are probed once per source; a partially fetched fragmented file only holds some of them
+        probe = self._strategy.probe(input_path, key=f'{config.media_url}#{os.path.getsize(input_path)}')
+        start_ms, end_ms = self._bounded_range(config, duration=config.duration or probe.duration)
+        plan = self._strategy.plan(probe, start_ms=start_ms, end_ms=end_ms)
+        return self._result(
+            self._strategy.cut(input_path, plan=plan, probe=probe, ext=config.extension), config=config
         )
-        # https://stackoverflow.com/questions/20321116/can-i-pipe-a-io-bytesio-stream-to-subprocess-popen-in-python#comment30326992_20321129
-        proc = subprocess.Popen(cut_cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-        stream.seek(0)
-        out, err = proc.communicate(input=stream.read())
-        proc.wait()
-        response = err.decode()
 
-        # sometimes, subprocess fails with BytesIO and we thus need to store the file temporarily on disk and retry
-        if 'partial file' in response:
-            # retry with temporary file instead of BytesIO
-            with NamedTemporaryFile('wb', suffix=f'.{ext}') as f:
-                stream.seek(0)
-                f.write(stream.read())
-                cut_cmd[2] = f.name  # replace pipe:0 with name of temporary file
-                proc = subprocess.Popen(cut_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                out, _ = proc.communicate()
-                proc.wait()
+    @staticmethod
+    def _bounded_range(config: task.TaskConfig, duration: Optional[float]) -> Tuple[float, float]:
+        start_ms = config.start
+        end_ms = config.end
+        if duration is not None:
+            duration_ms = duration * 1000
+            end_ms = min(end_ms or math.inf, duration_ms)  # put a realistic upper bound on end
+            assert end_ms - start_ms < duration_ms and end_ms <= duration_ms  # sanity check
+        assert 0 < end_ms - start_ms  # sanity check
+        return start_ms, end_ms
 
-        media_stream = BytesIO(out)
-        media_stream.seek(0)
+    @staticmethod
+    def _result(out: MediaBuffer, config: task.TaskConfig) -> result.Result:
+        watermark = config.apply_watermark
         # todo watermark video (https://video.stackexchange.com/a/25575)
         # frames_out: List[Image.Image] = []
         # for frame in ImageSequence.Iterator(gif):
@@ -56,9 +76,8 @@ class VideoCutHandler(base.BaseCutHandler):
         #     frames_out.append(watermark(frame))
         # assert len(frames_out) > 0
         _result: result.Result = result.Result(
-            media_stream=media_stream,
+            media_stream=out,
             media_type=config.media_type,
             message=config.message,
         )
         return _result
-        # return frames_out, target_duration_ms / (1000 * len(frames_out))
@@ -3,7 +3,14 @@ from typing import Callable
 
 from src import timer
 from src.execution.controller import AioController
+from src.execution.scheduling import ShortestJobFirstQueue
+from src.execution.transport import CUT_TOPIC, UPLOAD_TOPIC, StageQueue, transport_for
 from src.model.execution_mode import ExecutionMode
+from src.model.queue_policy import QueuePolicy
+from src.model.stage import Stage
+from src.util import config
+from src.util.metrics import MetricsServer
+from src.util.tracing import TRACER, JsonlExporter, OtlpExporter
 
 
 def start_aio_timer(
@@ -24,11 +31,49 @@ def start_aio_timer(
 
 if __name__ == '__main__':
     _mode: ExecutionMode = ExecutionMode.NORMAL
+    _stage: Stage = Stage(config.STAGE)
+    # the queues must be bound to the loop the consumers await them in
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    if _stage == Stage.ALL and QueuePolicy(config.CUT_QUEUE_POLICY) == QueuePolicy.SJF:
+        _input_queue = ShortestJobFirstQueue(maxsize=config.INPUT_QUEUE_SIZE, aging=config.CUT_QUEUE_AGING)
+        _output_queue = asyncio.Queue(maxsize=config.OUTPUT_QUEUE_SIZE)
+    elif _stage == Stage.ALL:
+        _input_queue = asyncio.Queue(maxsize=config.INPUT_QUEUE_SIZE)
+        _output_queue = asyncio.Queue(maxsize=config.OUTPUT_QUEUE_SIZE)
+    else:
+        # one ingester, any number of cutters and uploaders exchange records over the transport
+        _transport = transport_for(config.STAGE_TRANSPORT, lease_seconds=config.STAGE_LEASE_SECONDS)
+        _input_queue = StageQueue(
+            _transport, CUT_TOPIC, maxsize=config.INPUT_QUEUE_SIZE, poll_seconds=config.STAGE_POLL_SECONDS
+        )
+        _output_queue = StageQueue(
+            _transport, UPLOAD_TOPIC, maxsize=config.OUTPUT_QUEUE_SIZE, poll_seconds=config.STAGE_POLL_SECONDS
+        )
     # controller: dictates the general workflow; individual steps can be called though
-    _controller: AioController = AioController(input_queue=asyncio.Queue(), output_queue=asyncio.Queue(), mode=_mode)
+    _controller: AioController = AioController(input_queue=_input_queue, output_queue=_output_queue, mode=_mode)
 
-    _loop = asyncio.new_event_loop()
-    start_aio_timer(interval=10, callback=_controller.fetch, loop=_loop)
-    start_aio_timer(interval=5, callback=_controller.work, sleep_first=True, loop=_loop)
-    start_aio_timer(interval=10, callback=_controller.upload_and_answer, sleep_first=True, loop=_loop)
-    _loop.run_forever()
+    if config.TRACE_FILE:
+        TRACER.add_exporter(JsonlExporter(config.TRACE_FILE))
+    if config.TRACE_OTLP_ENDPOINT:
+        TRACER.add_exporter(OtlpExporter(config.TRACE_OTLP_ENDPOINT))
+    if config.METRICS_PORT > 0:
+        _loop.run_until_complete(MetricsServer(host=config.METRICS_HOST, port=config.METRICS_PORT).start())
+    # reddit is polled (rate limited), the cut and upload stages consume their queues as soon as items arrive
+    if _stage in (Stage.ALL, Stage.INGEST):
+        start_aio_timer(interval=10, callback=_controller.fetch, loop=_loop)
+    else:
+        # the messages answered (or failed) by a cutter or uploader are marked read by the process itself
+        start_aio_timer(interval=10, callback=_controller.mark_answered_read, sleep_first=True, loop=_loop)
+    _controller.start_consumers(
+        loop=_loop,
+        cut_concurrency=config.CUT_CONCURRENCY if _stage in (Stage.ALL, Stage.CUT) else 0,
+        upload_concurrency=config.UPLOAD_CONCURRENCY if _stage in (Stage.ALL, Stage.UPLOAD) else 0,
+    )
+    try:
+        _loop.run_forever()
+    finally:
+        _loop.run_until_complete(_controller.close())
+        if _stage != Stage.ALL:
+            _transport.close()
+        TRACER.close()  # flushes the spans of the OTLP exporter
@@ -0,0 +1,12 @@
+from enum import Enum
+
+
+class AdmissionOutcome(Enum):
+    # the request fits all budgets as it is
+    ADMIT = 'admit'
+    # the requested range is shortened to fit the duration (or output size) budget
+    CLAMP = 'clamp'
+    # costly work (watermark, transcode) is left out to fit the CPU budget
+    DOWNGRADE = 'downgrade'
+    # the request cannot fit the budgets and is answered without fetching its source
+    REJECT = 'reject'
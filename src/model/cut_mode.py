@@ -0,0 +1,16 @@
+from enum import Enum
+
+
+class CutMode(Enum):
+    # stream copy starting at the keyframe at or before the requested start (fastest, not frame accurate)
+    COPY = 0x1
+    # re-encode the partial GOP up to the first keyframe in range and stream copy the rest (frame accurate)
+    SMART = 0x2
+    # re-encode the whole range (frame accurate, slowest)
+    REENCODE = 0x3
+
+
+class CutPolicy(Enum):
+    SPEED = 'speed'
+    BALANCED = 'balanced'
+    ACCURACY = 'accuracy'
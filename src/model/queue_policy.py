@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class QueuePolicy(Enum):
+    # the order tasks are cut in: as they arrive, or the cheapest first (with aging)
+    FIFO = 'fifo'
+    SJF = 'sjf'
@@ -1,34 +1,47 @@
-import io
 from dataclasses import dataclass
 from typing import Optional
 
 from asyncpraw.models import Message
 
 from src.model.media_type import MediaType
+from src.util.media_buffer import MediaBuffer
 
 
 @dataclass
 class Result(object):
-    media_stream: io.BytesIO
+    media_stream: MediaBuffer
     media_type: MediaType
     message: Message
+    cache_key: Optional[str]
+    trace_id: Optional[str]
     upload_link: Optional[str]
 
     def __init__(
             self,
-            media_stream: io.BytesIO,
+            media_stream: Optional[MediaBuffer],
             *,
             media_type: MediaType,
             message: Message,
             upload_link: Optional[str] = None,
+            cache_key: Optional[str] = None,
+            trace_id: Optional[str] = None,
     ):
         self.media_stream = media_stream
         self.media_type = media_type
         self._upload_link = upload_link
         self.message = message
+        self.cache_key = cache_key
+        self.trace_id = trace_id  # the ID of the trace of the request the result is uploaded for
+        self.enqueued_at: Optional[float] = None  # the time the result was put into the output queue
+        self.lease: Optional[str] = None  # the lease of the record the result was received as from another process
 
     def __repr__(self):
-        return f'Result(media_stream={self.media_stream}, media_type={self.media_type}, message={self.message}, upload_link={self._upload_link})'
+        return f'Result(media_stream={self.media_stream}, media_type={self.media_type}, message={self.message}, ' \
+               f'upload_link={self._upload_link}, cache_key={self.cache_key})'
+
+    @property
+    def is_uploaded(self) -> bool:
+        return self._upload_link is not None
 
     @property
     def upload_link(self) -> str:
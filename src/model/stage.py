@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class Stage(Enum):
+    # the stages a bot process runs: all of them, or one of them in a deployment of separate stage processes
+    ALL = 'all'
+    INGEST = 'ingest'
+    CUT = 'cut'
+    UPLOAD = 'upload'
@@ -0,0 +1,16 @@
+from enum import Enum
+
+
+class TaskStage(Enum):
+    # the stages a request completed, in order; a request resumes after the last completed stage
+    INGESTED = 0x1
+    DOWNLOADED = 0x2
+    CUT = 0x3
+    UPLOADED = 0x4
+    REPLIED = 0x5
+    # terminal state of a request whose cut, upload or reply failed
+    FAILED = 0x99
+
+    @property
+    def is_terminal(self) -> bool:
+        return self in (TaskStage.REPLIED, TaskStage.FAILED)
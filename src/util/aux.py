@@ -1,9 +1,10 @@
-from typing import Tuple
+from typing import Optional, Tuple
 
-import PIL.GifImagePlugin
 from PIL import ImageDraw
 from PIL.Image import Image
 
+from src.util import gif_utilities
+
 
 # fixme refactor into individual files
 
@@ -23,9 +24,27 @@ class Watermark:
         self.color = color
 
 
+def palette_index(image: Image, color: Tuple[int, int, int]) -> Optional[int]:
+    """Returns the palette index of the opaque `color` in a `P` mode image or None if its palette lacks the color.
+    """
+    palette = image.getpalette() or []
+    transparency = image.info.get('transparency')
+    for index in range(len(palette) // 3):
+        if index != transparency and tuple(palette[3 * index:3 * index + 3]) == tuple(color):
+            return index
+    return None
+
+
 def watermark_image(image: Image, watermark: Watermark) -> Image:
     # todo assert check that watermark position is in image bounds
     draw = ImageDraw.Draw(image)
+    if image.mode == 'P':
+        # drawn in palette space, the palette must already hold the color (see palette_index)
+        fill = palette_index(image, watermark.color)
+        if fill is None:
+            raise ValueError(f'Palette lacks the watermark color {watermark.color}.')
+        draw.text(watermark.position, watermark.text, fill)
+        return image
     draw.text(watermark.position, watermark.text, watermark.color)
     return image
 
@@ -43,14 +62,7 @@ def fix_start_end_swap(start: float, end: float) -> Tuple[float, float]:
     return min(start, end), max(start, end)
 
 
-def get_avg_fps(image: PIL.GifImagePlugin.GifImageFile) -> float:
-    """ Returns the average framerate of a PIL Image object """
-    image.seek(0)
-    frames = duration = 0
-    while True:
-        try:
-            frames += 1
-            duration += image.info['duration']
-            image.seek(image.tell() + 1)
-        except EOFError:
-            return frames / duration * 1000
+def get_avg_fps(source: gif_utilities.GifSource) -> float:
+    """ Returns the average framerate of a GIF from its block structure without decoding any frame """
+    scan = gif_utilities.scan_gif(source)
+    return len(scan.frames) / scan.duration_ms * 1000
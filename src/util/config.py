@@ -1,4 +1,4 @@
-from os import getenv
+from os import cpu_count, getenv
 
 from src.util.logger import root_logger
 
@@ -6,6 +6,8 @@ REDDIT_USERNAME = getenv('REDDIT_USERNAME')
 REDDIT_PASSWORD = getenv('REDDIT_PASSWORD')
 REDDIT_CLIENT_ID = getenv('REDDIT_CLIENT_ID')
 REDDIT_CLIENT_SECRET = getenv('REDDIT_CLIENT_SECRET')
+# loaded submissions are reused for further mentions of the same submission within this time
+REDDIT_SUBMISSION_CACHE_SECONDS = float(getenv('REDDIT_SUBMISSION_CACHE_SECONDS', 60))
 
 with open('VERSION', 'r') as f:
     version = f.readline().strip()
@@ -14,3 +16,95 @@ with open('VERSION', 'r') as f:
 
 IMGUR_CLIENT_ID = getenv('IMGUR_CLIENT_ID')
 IMGUR_CLIENT_SECRET = getenv('IMGUR_CLIENT_SECRET')
+
+# cut result cache: reuse imgur links of identical cuts (also across restarts)
+RESULT_CACHE_DIR = getenv('RESULT_CACHE_DIR', '.cache/results')
+RESULT_CACHE_MAX_BYTES = int(getenv('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+RESULT_CACHE_MAX_ENTRIES = int(getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+RESULT_CACHE_STORE_MEDIA = getenv('RESULT_CACHE_STORE_MEDIA', 'false').lower() in ('1', 'true', 'yes')
+
+# request journal: the stage every request reached (ingested, downloaded, cut, uploaded, replied) survives restarts,
+# so that requests resume from their last stage; messages are only marked read once they are answered (or failed)
+TASK_JOURNAL_ENABLED = getenv('TASK_JOURNAL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TASK_JOURNAL_DIR = getenv('TASK_JOURNAL_DIR', '.cache/journal')
+TASK_JOURNAL_RETENTION_SECONDS = float(getenv('TASK_JOURNAL_RETENTION_SECONDS', 7 * 24 * 3600))
+
+# source media cache: share downloads between cuts of the same post; when disabled, videos are cut while they are
+# downloaded if the format and the cut policy allow it
+SOURCE_CACHE_ENABLED = getenv('SOURCE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SOURCE_CACHE_DIR = getenv('SOURCE_CACHE_DIR', '.cache/sources')
+SOURCE_CACHE_MAX_BYTES = int(getenv('SOURCE_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+SOURCE_CACHE_REVALIDATE_SECONDS = float(getenv('SOURCE_CACHE_REVALIDATE_SECONDS', 60))
+
+# partial fetch: only download the samples of the requested range of long MP4/MOV sources via range requests
+PARTIAL_FETCH_ENABLED = getenv('PARTIAL_FETCH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PARTIAL_FETCH_MIN_DURATION_SECONDS = float(getenv('PARTIAL_FETCH_MIN_DURATION_SECONDS', 30))
+PARTIAL_FETCH_MAX_RATIO = float(getenv('PARTIAL_FETCH_MAX_RATIO', 0.5))
+
+# cut strategy: speed (keyframe stream copy), balanced (stream copy or smart-cut) or accuracy (full re-encode)
+CUT_POLICY = getenv('CUT_POLICY', 'balanced').lower()
+CUT_KEYFRAME_TOLERANCE_MS = float(getenv('CUT_KEYFRAME_TOLERANCE_MS', 250))
+
+# output format of cut GIFs unless a mention requests one (`format=mp4`): gif, or mp4/webm to transcode the cut
+GIF_OUTPUT_FORMAT = getenv('GIF_OUTPUT_FORMAT', 'gif').lower()
+
+# cut worker pool: number of cut processes (0 cuts in a thread of the controller process) and their output directory
+CUT_WORKERS = int(getenv('CUT_WORKERS', cpu_count() or 1))
+CUT_OUTPUT_DIR = getenv('CUT_OUTPUT_DIR', '.cache/outputs')
+
+# stage consumers: concurrency of the cut and upload stages and the bounds of the queues in front of them
+CUT_CONCURRENCY = int(getenv('CUT_CONCURRENCY', max(CUT_WORKERS, 1)))
+UPLOAD_CONCURRENCY = int(getenv('UPLOAD_CONCURRENCY', 4))
+INPUT_QUEUE_SIZE = int(getenv('INPUT_QUEUE_SIZE', 64))
+OUTPUT_QUEUE_SIZE = int(getenv('OUTPUT_QUEUE_SIZE', 64))
+INVALID_TASK_RETRY_SECONDS = float(getenv('INVALID_TASK_RETRY_SECONDS', 5))
+# order of the cut queue: fifo, or sjf to cut the tasks with the lowest estimated cost (from the range, media type,
+# duration and the `Content-Length` of the source) first, while every second of waiting makes up for CUT_QUEUE_AGING
+# seconds of cost
+CUT_QUEUE_POLICY = getenv('CUT_QUEUE_POLICY', 'sjf').lower()
+CUT_QUEUE_AGING = float(getenv('CUT_QUEUE_AGING', 0.1))
+
+# stage processes: `all` runs every stage in this process; `ingest`, `cut` or `upload` runs one stage that exchanges
+# records with the processes of the other stages over STAGE_TRANSPORT (`sqlite://path` on one host or `spool://path`
+# on a file system the nodes share); records of a crashed process are received by another one after their lease
+STAGE = getenv('STAGE', 'all').lower()
+STAGE_TRANSPORT = getenv('STAGE_TRANSPORT', 'sqlite://.cache/stages.sqlite3')
+STAGE_LEASE_SECONDS = float(getenv('STAGE_LEASE_SECONDS', 3600))
+STAGE_POLL_SECONDS = float(getenv('STAGE_POLL_SECONDS', 0.5))
+
+# media downloads: shared keep-alive connection pools, concurrency, size limit and spooling of large bodies to disk
+DOWNLOAD_CONCURRENCY = int(getenv('DOWNLOAD_CONCURRENCY', 8))
+DOWNLOAD_CONNECTIONS_PER_HOST = int(getenv('DOWNLOAD_CONNECTIONS_PER_HOST', 4))
+DOWNLOAD_KEEPALIVE_SECONDS = float(getenv('DOWNLOAD_KEEPALIVE_SECONDS', 60))
+DOWNLOAD_TIMEOUT_SECONDS = float(getenv('DOWNLOAD_TIMEOUT_SECONDS', 300))
+DOWNLOAD_MAX_BYTES = int(getenv('DOWNLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+DOWNLOAD_SPOOL_BYTES = int(getenv('DOWNLOAD_SPOOL_BYTES', 8 * 1024 * 1024))
+DOWNLOAD_SPOOL_DIR = getenv('DOWNLOAD_SPOOL_DIR')
+
+# admission control: before the source of a request is fetched, its range is clamped to the duration and upload size
+# budgets, costly work is left out to fit the CPU budget and requests that still exceed a budget are rejected with a
+# reply that tells why (a budget of 0 is not enforced)
+ADMISSION_ENABLED = getenv('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ADMISSION_MAX_SOURCE_BYTES = int(getenv('ADMISSION_MAX_SOURCE_BYTES', DOWNLOAD_MAX_BYTES))
+ADMISSION_MAX_CUT_SECONDS = float(getenv('ADMISSION_MAX_CUT_SECONDS', 300))
+ADMISSION_MAX_OUTPUT_BYTES = int(getenv('ADMISSION_MAX_OUTPUT_BYTES', 200 * 1024 * 1024))
+ADMISSION_MAX_CPU_SECONDS = float(getenv('ADMISSION_MAX_CPU_SECONDS', 120))
+
+# media (sources and cuts) passed between the stages is held in memory up to this size and spilled to disk beyond
+MEDIA_BUFFER_MEMORY_BYTES = int(getenv('MEDIA_BUFFER_MEMORY_BYTES', 8 * 1024 * 1024))
+MEDIA_BUFFER_SPOOL_DIR = getenv('MEDIA_BUFFER_SPOOL_DIR')
+
+# imgur uploads: concurrent (pooled) connections, request timeout and retries with exponential backoff
+IMGUR_UPLOAD_CONCURRENCY = int(getenv('IMGUR_UPLOAD_CONCURRENCY', UPLOAD_CONCURRENCY))
+IMGUR_TIMEOUT_SECONDS = float(getenv('IMGUR_TIMEOUT_SECONDS', 300))
+IMGUR_MAX_RETRIES = int(getenv('IMGUR_MAX_RETRIES', 3))
+IMGUR_RETRY_BACKOFF_SECONDS = float(getenv('IMGUR_RETRY_BACKOFF_SECONDS', 1))
+
+# per-stage metrics served in the Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics (0 disables it)
+METRICS_HOST = getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(getenv('METRICS_PORT', 9464))
+
+# trace spans of every request (download, probe, encode, ffmpeg, upload, reply): appended as JSON lines to TRACE_FILE
+# and/or posted in the OTLP/HTTP JSON encoding to TRACE_OTLP_ENDPOINT (empty disables the exporter)
+TRACE_FILE = getenv('TRACE_FILE', '')
+TRACE_OTLP_ENDPOINT = getenv('TRACE_OTLP_ENDPOINT', '')
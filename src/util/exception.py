@@ -8,3 +8,11 @@ class TaskConfigFailureException(BaseException):
 
 class OembedFailureException(BaseException):
     pass
+
+
+class UploadFailureException(BaseException):
+    pass
+
+
+class MediaTooLargeException(BaseException):
+    pass
@@ -1,16 +1,303 @@
-from PIL.Image import Image
-
-
-# credits: https://www.codespeedy.com/find-the-duration-of-gif-image-in-python/
-def get_gif_duration(image: Image) -> float:
-    image.seek(0)  # move to the start of the gif, frame 0
-    total_duration_milliseconds = 0
-    # loop through the frames until EndOfFileError
-    while True:
-        try:
-            frame_duration_milliseconds = image.info['duration']
-            total_duration_milliseconds += frame_duration_milliseconds
-            # now move to the next frame of the gif
-            image.seek(image.tell() + 1)  # image.tell() = current frame
-        except EOFError:
-            return total_duration_milliseconds / 1000
+import bisect
+import mmap
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+EXTENSION_INTRODUCER = 0x21
+IMAGE_SEPARATOR = 0x2C
+TRAILER = 0x3B
+GRAPHIC_CONTROL_LABEL = 0xF9
+APPLICATION_LABEL = 0xFF
+
+GifSource = Union[bytes, bytearray, memoryview, mmap.mmap, BinaryIO]
+
+
+@dataclass(frozen=True)
+class GifFrame:
+    """Header information of a single GIF frame obtained without decoding its pixels.
+
+    Attributes:
+        index           The zero-based frame index.
+        offset          Byte offset of the first block belonging to this frame (its extensions, if any).
+        image_offset    Byte offset of the frame's image descriptor.
+        end             Byte offset right after the frame's last image data sub-block.
+        timestamp       The cumulative start time of the frame in milliseconds.
+        delay           The frame delay in milliseconds.
+        disposal        The disposal method of the graphic control extension (0 if absent).
+        transparency    The transparent color index or None.
+        box             The frame rectangle as (left, top, width, height).
+        has_local_palette   A flag indicating if the frame carries a local color table.
+    """
+    index: int
+    offset: int
+    image_offset: int
+    end: int
+    timestamp: int
+    delay: int
+    disposal: int
+    transparency: Optional[int]
+    box: Tuple[int, int, int, int]
+    has_local_palette: bool
+
+
+@dataclass(frozen=True)
+class GifScan:
+    """The block structure of a GIF.
+
+    Attributes:
+        width           The logical screen width.
+        height          The logical screen height.
+        header_end      Byte offset right after the logical screen descriptor and the global color table.
+        has_global_palette  A flag indicating if the GIF carries a global color table.
+        background      The background color index.
+        loop            The NETSCAPE2.0 loop count or None if the GIF does not loop.
+        frames          The frames in the order of appearance.
+    """
+    width: int
+    height: int
+    header_end: int
+    has_global_palette: bool
+    background: int
+    loop: Optional[int]
+    frames: List[GifFrame]
+
+    @property
+    def delays(self) -> List[int]:
+        return [frame.delay for frame in self.frames]
+
+    @property
+    def timestamps(self) -> List[int]:
+        return [frame.timestamp for frame in self.frames]
+
+    @property
+    def duration_ms(self) -> int:
+        if not self.frames:
+            return 0
+        return self.frames[-1].timestamp + self.frames[-1].delay
+
+    @property
+    def duration(self) -> float:
+        """The total duration in seconds."""
+        return self.duration_ms / 1000
+
+    def frame_index_at(self, ms: float) -> int:
+        """Returns the index of the frame that is displayed at the time `ms` in milliseconds.
+        """
+        if not self.frames:
+            raise ValueError('GIF has no frames.')
+        return max(bisect.bisect_right(self.timestamps, ms) - 1, 0)
+
+    def frame_range(self, start_ms: float, end_ms: float) -> Tuple[int, int]:
+        """Returns the inclusive (first, last) frame indices covering the interval [start_ms, end_ms).
+
+        At least a single frame is always covered.
+        """
+        first = self.frame_index_at(start_ms)
+        last = max(self.frame_index_at(max(end_ms - 1, 0)), first)
+        return first, last
+
+
+def _as_buffer(source: GifSource) -> memoryview:
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return memoryview(source)
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer()  # zero copy view into a BytesIO
+    source.seek(0)
+    return memoryview(source.read())
+
+
+def _skip_sub_blocks(data: memoryview, pos: int) -> int:
+    """Returns the offset after the block terminator of the data sub-blocks starting at `pos`."""
+    size = data[pos]
+    while size:
+        pos += size + 1
+        size = data[pos]
+    return pos + 1
+
+
+def scan_gif(source: GifSource) -> GifScan:
+    """Walks the block structure of a GIF without LZW decoding any image data.
+
+    Args:
+        source: The raw GIF bytes or a binary stream containing them.
+
+    Returns:
+        The :class:`GifScan` with per-frame delays, timestamps, disposal methods and byte offsets.
+
+    Raises:
+        ValueError: If the data is not a (complete) GIF.
+    """
+    data = _as_buffer(source)
+    frames: List[GifFrame] = []
+    if bytes(data[:6]) not in GIF_SIGNATURES:
+        raise ValueError('Not a GIF file.')
+    try:
+        width = data[6] | data[7] << 8
+        height = data[8] | data[9] << 8
+        packed = data[10]
+        background = data[11]
+        pos = 13
+        has_global_palette = bool(packed & 0x80)
+        if has_global_palette:
+            pos += 3 << ((packed & 0x07) + 1)
+        header_end = pos
+
+        loop: Optional[int] = None
+        timestamp = 0
+        frame_offset = pos
+        delay = disposal = 0
+        transparency: Optional[int] = None
+        while True:
+            introducer = data[pos]
+            if introducer == EXTENSION_INTRODUCER:
+                label = data[pos + 1]
+                if label == GRAPHIC_CONTROL_LABEL and data[pos + 2] >= 4:
+                    flags = data[pos + 3]
+                    disposal = (flags >> 2) & 0x07
+                    delay = (data[pos + 4] | data[pos + 5] << 8) * 10
+                    transparency = data[pos + 6] if flags & 0x01 else None
+                elif label == APPLICATION_LABEL and bytes(data[pos + 3:pos + 14]) == b'NETSCAPE2.0':
+                    sub = pos + 3 + data[pos + 2]
+                    if data[sub] >= 3 and data[sub + 1] == 1:
+                        loop = data[sub + 2] | data[sub + 3] << 8
+                pos = _skip_sub_blocks(data, pos + 2)
+            elif introducer == IMAGE_SEPARATOR:
+                image_offset = pos
+                left = data[pos + 1] | data[pos + 2] << 8
+                top = data[pos + 3] | data[pos + 4] << 8
+                frame_width = data[pos + 5] | data[pos + 6] << 8
+                frame_height = data[pos + 7] | data[pos + 8] << 8
+                flags = data[pos + 9]
+                pos += 10
+                if flags & 0x80:
+                    pos += 3 << ((flags & 0x07) + 1)
+                pos = _skip_sub_blocks(data, pos + 1)  # skip the LZW minimum code size
+                frames.append(GifFrame(
+                    index=len(frames),
+                    offset=frame_offset,
+                    image_offset=image_offset,
+                    end=pos,
+                    timestamp=timestamp,
+                    delay=delay,
+                    disposal=disposal,
+                    transparency=transparency,
+                    box=(left, top, frame_width, frame_height),
+                    has_local_palette=bool(flags & 0x80),
+                ))
+                timestamp += delay
+                frame_offset = pos
+                delay = disposal = 0
+                transparency = None
+            elif introducer == TRAILER:
+                break
+            else:
+                raise ValueError(f'Unexpected GIF block 0x{introducer:02x} at offset {pos}.')
+    except IndexError:
+        if not frames:
+            raise ValueError('Truncated GIF file.')
+        # tolerate truncated trailing data like most decoders do
+    return GifScan(
+        width=width,
+        height=height,
+        header_end=header_end,
+        has_global_palette=has_global_palette,
+        background=background,
+        loop=loop,
+        frames=frames,
+    )
+
+
+def get_gif_duration(source: GifSource) -> float:
+    """Returns the GIF duration in seconds.
+    """
+    return scan_gif(source).duration
+
+
+def needs_key_frame(scan: GifScan, first_frame: int) -> bool:
+    """Checks whether a cut starting at `first_frame` needs the composited canvas as its first frame.
+
+    A frame can be copied as is to the start of a cut if it is the first frame of the GIF or if it covers the whole
+    canvas without transparent pixels, i.e. it does not build on the frames before it.
+    """
+    frame = scan.frames[first_frame]
+    return first_frame > 0 and (frame.box != (0, 0, scan.width, scan.height) or frame.transparency is not None)
+
+
+def can_splice(scan: GifScan, first_frame: int) -> bool:
+    """Checks whether the frames from `first_frame` on can be spliced with at most a single re-encoded key frame.
+
+    The key frame replaces the composited canvas, so the disposal of the original frame must keep (or, covering the
+    whole canvas, clear) the canvas: restoring the previous canvas or clearing a part of it cannot be expressed.
+    """
+    if not needs_key_frame(scan, first_frame):
+        return True
+    frame = scan.frames[first_frame]
+    return frame.disposal in (0, 1) or (frame.disposal == 2 and frame.box == (0, 0, scan.width, scan.height))
+
+
+def _graphic_control_extension(disposal: int, delay_ms: int, transparency: Optional[int]) -> bytes:
+    flags = (disposal & 0x07) << 2 | (1 if transparency is not None else 0)
+    delay = round(delay_ms / 10)
+    return bytes([EXTENSION_INTRODUCER, GRAPHIC_CONTROL_LABEL, 4, flags, delay & 0xFF, delay >> 8 & 0xFF,
+                  transparency or 0, 0])
+
+
+def _loop_extension(loop: int) -> bytes:
+    return bytes([EXTENSION_INTRODUCER, APPLICATION_LABEL, 11]) + b'NETSCAPE2.0' + bytes([3, 1, loop & 0xFF,
+                                                                                         loop >> 8 & 0xFF, 0])
+
+
+def _key_frame_image(key_frame_gif: GifSource) -> Tuple[bytes, Optional[int]]:
+    # the image block of a single frame GIF with its global palette turned into a local one
+    data = _as_buffer(key_frame_gif)
+    scan = scan_gif(data)
+    frame = scan.frames[0]
+    descriptor = bytearray(data[frame.image_offset:frame.image_offset + 10])
+    if frame.has_local_palette or not scan.has_global_palette:
+        return bytes(data[frame.image_offset:frame.end]), frame.transparency
+    descriptor[9] = (descriptor[9] & ~0x07 & 0xFF) | 0x80 | (data[10] & 0x07)
+    palette = data[13:scan.header_end]
+    return bytes(descriptor) + bytes(palette) + bytes(data[frame.image_offset + 10:frame.end]), frame.transparency
+
+
+def splice_gif(source: GifSource, scan: GifScan, first_frame: int, last_frame: int, output: BinaryIO,
+               key_frame_gif: Optional[GifSource] = None, loop: int = 0) -> None:
+    """Writes the frames `first_frame` to `last_frame` (inclusive) of a GIF as a new GIF without decoding them.
+
+    The header, the global palette and the LZW compressed image data and graphic control extensions (including the
+    original delays) of the frames are copied verbatim. Only if the first frame builds on previous frames (see
+    :func:`needs_key_frame`), it is replaced by `key_frame_gif`: a single frame GIF of the composited canvas at the
+    first frame, which is shown with the delay of the first frame.
+
+    Args:
+        source: The raw GIF bytes or a binary stream containing them.
+        scan: The :class:`GifScan` of the source.
+        first_frame: The index of the first frame of the cut.
+        last_frame: The index of the last frame of the cut.
+        output: The binary stream the cut GIF is written to.
+        key_frame_gif: The encoded composited canvas at the first frame, if the first frame needs it.
+        loop: The loop count of the cut GIF (0 loops forever).
+
+    Raises:
+        ValueError: If the cut needs a key frame but none is given or if it cannot be spliced (see
+            :func:`can_splice`).
+    """
+    if not can_splice(scan, first_frame):
+        raise ValueError(f'Frame {first_frame} disposes to a canvas that a key frame cannot express.')
+    data = _as_buffer(source)
+    frames = scan.frames
+    output.write(data[:scan.header_end])
+    if first_frame > 0 or scan.loop is None:
+        output.write(_loop_extension(loop))  # the loop extension of the source precedes its first frame
+    if needs_key_frame(scan, first_frame):
+        if key_frame_gif is None:
+            raise ValueError(f'Frame {first_frame} builds on previous frames and needs a key frame.')
+        image, transparency = _key_frame_image(key_frame_gif)
+        frame = frames[first_frame]
+        output.write(_graphic_control_extension(frame.disposal or 1, frame.delay, transparency))
+        output.write(image)
+        first_frame += 1
+    if first_frame <= last_frame:
+        output.write(data[frames[first_frame].offset:frames[last_frame].end])
+    output.write(bytes([TRAILER]))
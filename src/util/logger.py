@@ -1,8 +1,12 @@
+import contextvars
 import logging
 import sys
 
 from typing import Union
 
+# the trace ID of the request being handled in the current context (see src.util.tracing), '-' outside of a request
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar('trace_id', default='-')
+
 
 # credits: https://stackoverflow.com/a/56944256/2402281
 class ColorFormatter(logging.Formatter):
@@ -12,8 +16,8 @@ class ColorFormatter(logging.Formatter):
     red = '\x1b[31;20m'
     bold_red = '\x1b[31;1m'
     reset = '\x1b[0m'
-    format = '{color}[%(asctime)-15s] [%(name)-12.12s] [%(levelname)-8s] --- %(message)s {reset} (%(filename)s:%(' \
-             'lineno)d)'
+    format = '{color}[%(asctime)-15s] [%(name)-12.12s] [%(levelname)-8s] [%(trace_id)-8.8s] --- %(message)s {reset} ' \
+             '(%(filename)s:%(lineno)d)'
 
     common_config = {
         'reset': reset,
@@ -33,6 +37,14 @@ class ColorFormatter(logging.Formatter):
         return formatter.format(record)
 
 
+class TraceIdFilter(logging.Filter):
+    """Adds the trace ID of the current context to the records, so that the lines of a request can be told apart."""
+
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+
 root_logger: logging.Logger
 cut_logger: logging.Logger
 upload_logger: logging.Logger
@@ -45,6 +57,7 @@ def setup_logger(level: Union[int, str] = logging.DEBUG):
     handler = logging.StreamHandler(sys.stdout)
     handler.setLevel(logging.DEBUG)
     handler.setFormatter(ColorFormatter())
+    handler.addFilter(TraceIdFilter())
 
     root_logger = logging.getLogger(name='gifCutterBot')
     cut_logger = logging.getLogger(name='CutWorker')
@@ -0,0 +1,228 @@
+import mmap
+import os
+import shutil
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+from typing import IO, Iterable, List, Optional, Union
+
+from src.util import config
+
+COPY_CHUNK_BYTES = 64 * 1024
+
+
+class MediaBuffer(object):
+    """A binary media buffer that stays in memory up to `max_memory_bytes` and spills to a temporary file beyond.
+
+    It is a (seekable, readable and writable) binary file object, so it can be handed to PIL, ffmpeg and HTTP clients
+    alike, and it offers copy free access to the media:
+
+    * :attr:`path` returns the path of the backing file (spilling in-memory media first), e.g. as an ffmpeg input.
+    * :meth:`getbuffer` returns a memoryview of the in-memory media or of a read-only memory map of the file.
+
+    :meth:`close` deterministically releases the memory and removes the temporary file (files adopted with
+    `owned=False` are kept).
+
+    Attributes:
+        max_memory_bytes    The size in bytes up to which the media is held in memory.
+        spool_dir           The directory of the temporary file, defaults to the configured spool directory.
+        suffix              The suffix (e.g. the file extension) of the temporary file.
+    """
+
+    def __init__(self, max_memory_bytes: Optional[int] = None, spool_dir: Optional[str] = None, suffix: str = ''):
+        self.max_memory_bytes = config.MEDIA_BUFFER_MEMORY_BYTES if max_memory_bytes is None else max_memory_bytes
+        self.spool_dir = config.MEDIA_BUFFER_SPOOL_DIR if spool_dir is None else spool_dir
+        self.suffix = suffix
+        self._file: Union[BytesIO, IO[bytes]] = BytesIO()
+        self._path: Optional[str] = None
+        self._owned = True
+        self._maps: List[mmap.mmap] = []
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, bytearray, memoryview], **kwargs) -> 'MediaBuffer':
+        buffer = cls(**kwargs)
+        buffer.write(data)
+        buffer.seek(0)
+        return buffer
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[bytes], **kwargs) -> 'MediaBuffer':
+        buffer = cls(**kwargs)
+        try:
+            for chunk in chunks:
+                buffer.write(chunk)
+        except BaseException:
+            buffer.close()
+            raise
+        buffer.seek(0)
+        return buffer
+
+    @classmethod
+    def from_stream(cls, stream: IO[bytes], **kwargs) -> 'MediaBuffer':
+        """Copies the rest of `stream` (e.g. the stdout of a process) in chunks into a new buffer."""
+        buffer = cls(**kwargs)
+        try:
+            shutil.copyfileobj(stream, buffer, COPY_CHUNK_BYTES)
+        except BaseException:
+            buffer.close()
+            raise
+        buffer.seek(0)
+        return buffer
+
+    @classmethod
+    def on_disk(cls, suffix: str = '', spool_dir: Optional[str] = None) -> 'MediaBuffer':
+        """Returns an empty buffer backed by a temporary file from the start, e.g. for sparse writes."""
+        buffer = cls(max_memory_bytes=0, spool_dir=spool_dir, suffix=suffix)
+        buffer._spill()
+        return buffer
+
+    @classmethod
+    def from_path(cls, path: str, owned: bool = True) -> 'MediaBuffer':
+        """Adopts the file at `path` without reading it; the file is removed on :meth:`close` if it is `owned`."""
+        buffer = cls(max_memory_bytes=0)
+        buffer._file = open(path, mode='r+b')
+        buffer._path = path
+        buffer._owned = owned
+        return buffer
+
+    def __enter__(self) -> 'MediaBuffer':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        location = 'memory' if self.in_memory else self._path
+        return f'MediaBuffer(size={self.size if not self.closed else None}, location={location})'
+
+    @property
+    def in_memory(self) -> bool:
+        return self._path is None
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    @property
+    def size(self) -> int:
+        if self.in_memory:
+            return self._file.getbuffer().nbytes
+        self._file.flush()
+        return os.fstat(self._file.fileno()).st_size
+
+    @property
+    def name(self) -> Optional[str]:
+        """The path of the backing file or None while the media is in memory (like the name of a file object)."""
+        return self._path
+
+    @property
+    def path(self) -> str:
+        """The path of the file holding the media; in-memory media is spilled to a temporary file first."""
+        if self.in_memory:
+            self._spill()
+        self._file.flush()
+        return self._path
+
+    def getbuffer(self) -> memoryview:
+        """Returns a zero-copy view of the media, backed by the memory or a read-only memory map of the file.
+
+        The view must be released (e.g. with a `with` statement) before the buffer is written to again.
+        """
+        if self.in_memory:
+            return self._file.getbuffer()
+        self._file.flush()
+        if self.size == 0:
+            return memoryview(b'')
+        mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped)
+
+    def getvalue(self) -> bytes:
+        """Returns a copy of the media; prefer :meth:`getbuffer` or :attr:`path`."""
+        with self.getbuffer() as view:
+            return bytes(view)
+
+    def persist(self, path: str) -> None:
+        """Moves (or writes in-memory) media to `path` and closes the buffer; the file at `path` is not owned."""
+        if self.in_memory or not self._owned:
+            with open(path, mode='wb') as fp, self.getbuffer() as view:
+                fp.write(view)
+        else:
+            self._file.flush()
+            shutil.move(self._path, path)  # copies the file if the spool directory is on another file system
+            self._path = path
+            self._owned = False
+        self.close()
+
+    def release_file(self) -> str:
+        """Spills in-memory media, closes the buffer without removing the file and returns its path, e.g. to hand
+        the media over to another process that adopts it with :meth:`from_path`.
+        """
+        path = self.path
+        self._owned = False
+        self.close()
+        return path
+
+    def _spill(self) -> None:
+        with NamedTemporaryFile(mode='w+b', dir=self.spool_dir, suffix=self.suffix, delete=False) as fp:
+            pass
+        spilled = open(fp.name, mode='r+b')
+        with self._file.getbuffer() as view:
+            spilled.write(view)
+        spilled.seek(self._file.tell())
+        self._file.close()
+        self._file = spilled
+        self._path = fp.name
+
+    # file object protocol
+
+    def write(self, data: Union[bytes, bytearray, memoryview]) -> int:
+        written = self._file.write(data)
+        if self.in_memory and self._file.tell() > self.max_memory_bytes:
+            self._spill()
+        return written
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self._file.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        size = self._file.truncate(size)
+        if self.in_memory and size > self.max_memory_bytes:
+            self._spill()
+        return size
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # a view is still exported, the map is released with it
+        self._maps.clear()
+        self._file.close()
+        if self._path is not None and self._owned:
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
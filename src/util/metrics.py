@@ -0,0 +1,273 @@
+import bisect
+import functools
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from aiohttp import web
+
+from src.util.logger import root_logger
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# latencies from a few milliseconds (cache hits) up to minutes (long cuts and uploads)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# sizes from 64KiB to 1GiB in powers of 4
+BYTES_BUCKETS = tuple(64 * 1024 * 4 ** exponent for exponent in range(8))
+
+
+F = TypeVar('F', bound=Callable[..., None])
+
+
+def guarded(function: F) -> F:
+    """Decorates a function that records metrics, so that a failure to record them never fails the caller."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs) -> None:
+        try:
+            function(*args, **kwargs)
+        except Exception as err:
+            root_logger.warning(f'Failed to record metrics in {function.__name__} ({type(err).__name__}): {err}')
+
+    return wrapper
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(object):
+    """The base of the metrics: a family of children with one child per combination of label values.
+
+    Children are created on first use and then looked up in a dict, so that recording a value in the hot path costs a
+    dict lookup and an addition under a lock.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values) -> '_Metric':
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects the labels {self.labelnames}, got {key}.')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> '_Metric':
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def collect(self) -> List[Tuple[str, Dict[str, str], float]]:
+        if not self.labelnames:
+            return list(self._samples())
+        samples = []
+        for values, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            samples += [(name, {**labels, **extra}, value) for name, extra, value in child._samples()]
+        return samples
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. of bytes or failures."""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None):
+        self._value = 0.0
+        super(Counter, self).__init__(name, documentation, labelnames=labelnames, registry=registry)
+
+    def _new_child(self) -> 'Counter':
+        return Counter(self.name, self.documentation, registry=_UNREGISTERED)
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def _samples(self):
+        yield f'{self.name}_total', {}, self._value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. a queue depth; it can be read from a function when it is scraped."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        super(Gauge, self).__init__(name, documentation, labelnames=labelnames, registry=registry)
+
+    def _new_child(self) -> 'Gauge':
+        return Gauge(self.name, self.documentation, registry=_UNREGISTERED)
+
+    @property
+    def value(self) -> float:
+        return self._function() if self._function is not None else self._value
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Reads the value from `function` when the gauge is scraped instead of recording it in the hot path."""
+        self._function = function
+
+    def _samples(self):
+        yield self.name, {}, self.value
+
+
+class Histogram(_Metric):
+    """Counts observations (e.g. latencies or sizes) in buckets and keeps their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = SECONDS_BUCKETS, registry: Optional['Registry'] = None):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # the last bucket is +Inf
+        self._sum = 0.0
+        super(Histogram, self).__init__(name, documentation, labelnames=labelnames, registry=registry)
+
+    def _new_child(self) -> 'Histogram':
+        return Histogram(self.name, self.documentation, buckets=self.buckets, registry=_UNREGISTERED)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def _samples(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield f'{self.name}_bucket', {'le': _format_value(bound)}, cumulative
+        yield f'{self.name}_sum', {}, total
+        yield f'{self.name}_count', {}, cumulative
+
+
+class Registry(object):
+    """The metrics of a process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered.')
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            # the samples of a counter are suffixed with `_total`, so is the family
+            family = f'{metric.name}_total' if metric.kind == 'counter' else metric.name
+            lines.append(f'# HELP {family} {metric.documentation}')
+            lines.append(f'# TYPE {family} {metric.kind}')
+            for name, labels, value in metric.collect():
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f'{name}{{{label_text}}} {_format_value(value)}' if label_text else
+                             f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Unregistered(Registry):
+    # the children of a metric are rendered by their parent
+    def register(self, metric: _Metric) -> None:
+        pass
+
+
+REGISTRY = Registry()
+_UNREGISTERED = _Unregistered()
+
+
+class MetricsServer(object):
+    """A small HTTP server on the event loop that serves the metrics at `/metrics` for Prometheus to scrape.
+
+    Attributes:
+        host        The interface to listen on, the loopback interface by default.
+        port        The port to listen on; 0 picks a free port.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9464, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self._registry = registry
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=self.host, port=self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        root_logger.info(f'Serving metrics at http://{self.host}:{self.port}/metrics')
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# the metrics of the stages of the bot
+INBOX_FETCH_SECONDS = Histogram(
+    'gifcutter_inbox_fetch_seconds', 'Latency of fetching the unread inbox and loading the submissions.'
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    'gifcutter_queue_wait_seconds', 'Time items wait in a stage queue before they are consumed.', ['queue']
+)
+QUEUE_DEPTH = Gauge('gifcutter_queue_depth', 'Number of items in a stage queue.', ['queue'])
+DOWNLOADED_BYTES = Counter('gifcutter_downloaded_bytes', 'Bytes of source media and pages downloaded.')
+FETCH_SECONDS = Histogram(
+    'gifcutter_fetch_seconds', 'Latency of fetching the source media of a cut (cached or partially fetched).',
+    ['media_type'],
+)
+CUT_SECONDS = Histogram('gifcutter_cut_seconds', 'Wall time of a cut.', ['media_type'])
+CUT_CPU_SECONDS = Histogram(
+    'gifcutter_cut_cpu_seconds', 'CPU time of a cut including the ffmpeg processes of cut workers.', ['media_type']
+)
+OUTPUT_BYTES = Histogram(
+    'gifcutter_output_bytes', 'Size of the cut media.', ['media_type'], buckets=BYTES_BUCKETS
+)
+UPLOAD_SECONDS = Histogram('gifcutter_upload_seconds', 'Latency of an imgur upload including retries.', ['media_type'])
+ADMISSIONS = Counter(
+    'gifcutter_admissions', 'Admission decisions about requests before their source is fetched.', ['outcome']
+)
+FAILURES = Counter('gifcutter_failures', 'Failures by pipeline stage.', ['stage'])
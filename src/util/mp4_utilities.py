@@ -0,0 +1,336 @@
+import bisect
+import struct
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+# containers whose children are boxes (and not a payload) on the way to the sample tables
+CONTAINER_BOXES = {'moov', 'trak', 'mdia', 'minf', 'stbl', 'moof', 'traf', 'mvex', 'edts'}
+# tfhd flag: the track fragment carries an absolute base data offset and cannot be relocated
+TFHD_BASE_DATA_OFFSET_PRESENT = 0x000001
+
+ByteRange = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class Mp4Box:
+    """The header of an ISO base media file format box (MP4/MOV atom).
+
+    Attributes:
+        type            The four character box type.
+        offset          The absolute byte offset of the box.
+        size            The size of the box including its header in bytes.
+        header_size     The size of the box header in bytes (8, or 16 for 64 bit sizes).
+    """
+    type: str
+    offset: int
+    size: int
+    header_size: int
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+@dataclass(frozen=True)
+class TrackSamples:
+    """The sample table of a track of a progressive (non-fragmented) MP4/MOV.
+
+    Attributes:
+        track_id        The track id.
+        handler         The handler type of the track, e.g. `vide` or `soun`.
+        timescale       The number of time units per second of the track.
+        times           The decode timestamp of each sample in time units.
+        sizes           The size of each sample in bytes.
+        offsets         The absolute byte offset of each sample.
+        sync_samples    The zero-based indices of the sync samples (keyframes) or None if every sample is one.
+    """
+    track_id: int
+    handler: str
+    timescale: int
+    times: List[int]
+    sizes: List[int]
+    offsets: List[int]
+    sync_samples: Optional[List[int]]
+
+    def index_at(self, seconds: float) -> int:
+        """Returns the index of the last sample that is decoded at or before `seconds`."""
+        return max(bisect.bisect_right(self.times, seconds * self.timescale) - 1, 0)
+
+    def sync_index_at(self, seconds: float) -> int:
+        """Returns the index of the last sync sample at or before `seconds`."""
+        index = self.index_at(seconds)
+        if self.sync_samples is None:
+            return index
+        position = bisect.bisect_right(self.sync_samples, index) - 1
+        return self.sync_samples[max(position, 0)]
+
+    def time_of(self, index: int) -> float:
+        return self.times[index] / self.timescale
+
+
+@dataclass(frozen=True)
+class Segment:
+    """A subsegment referenced by a `sidx` box of a fragmented MP4.
+
+    Attributes:
+        offset          The absolute byte offset of the subsegment (its first `moof`).
+        size            The size of the subsegment in bytes.
+        start           The earliest presentation time of the subsegment in seconds.
+        duration        The duration of the subsegment in seconds.
+        starts_with_sap A flag indicating if the subsegment starts with a stream access point (keyframe).
+    """
+    offset: int
+    size: int
+    start: float
+    duration: float
+    starts_with_sap: bool
+
+
+def parse_box_header(
+        data: bytes, offset: int = 0, base_offset: int = 0, end: Optional[int] = None
+) -> Optional[Mp4Box]:
+    """Parses the box header at `offset` of `data`; `base_offset` is the absolute offset of `data` in the file.
+
+    Returns None if `data` (up to `end`) is too short to contain the header.
+    """
+    end = len(data) if end is None else end
+    if end - offset < 8:
+        return None
+    size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:
+        if end - offset < 16:
+            return None
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset  # box extends to the end of the data
+    return Mp4Box(
+        type=box_type.decode('latin-1'), offset=base_offset + offset, size=size, header_size=header_size
+    )
+
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None, base_offset: int = 0) -> Iterator[Mp4Box]:
+    """Iterates over the sibling boxes in `data[start:end]`."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        box = parse_box_header(data, offset, base_offset=base_offset, end=end)
+        if box is None or box.size < box.header_size:
+            return
+        yield box
+        offset += box.size
+
+
+def moov_precedes_mdat(head: bytes) -> Optional[bool]:
+    """Returns True if the movie header precedes the media data in the file starting with `head`.
+
+    Such (fast start or fragmented) files can be demuxed from a pipe. Returns None if `head` is too short to tell.
+    """
+    for box in iter_boxes(head):
+        if box.type in ['moov', 'moof']:
+            return True
+        if box.type == 'mdat':
+            return False
+    return None
+
+
+def find_boxes(data: bytes, path: List[str], start: int = 0, end: Optional[int] = None,
+               base_offset: int = 0) -> Iterator[Mp4Box]:
+    """Yields all boxes matching the box type `path` (e.g. ['trak', 'mdia', 'mdhd']) below `data[start:end]`."""
+    for box in iter_boxes(data, start, end, base_offset=base_offset):
+        if box.type != path[0]:
+            continue
+        if len(path) == 1:
+            yield box
+        elif box.type in CONTAINER_BOXES:
+            relative = box.offset - base_offset
+            yield from find_boxes(
+                data, path[1:], relative + box.header_size, relative + box.size, base_offset=base_offset
+            )
+
+
+def _payload(data: bytes, box: Mp4Box, base_offset: int) -> memoryview:
+    relative = box.offset - base_offset
+    return memoryview(data)[relative + box.header_size:relative + box.size]
+
+
+def _child_payload(data: bytes, trak: Mp4Box, path: List[str], base_offset: int) -> Optional[memoryview]:
+    relative = trak.offset - base_offset
+    box = next(
+        find_boxes(data, path, relative + trak.header_size, relative + trak.size, base_offset=base_offset), None
+    )
+    return None if box is None else _payload(data, box, base_offset)
+
+
+def _parse_track(data: bytes, trak: Mp4Box, base_offset: int) -> Optional[TrackSamples]:
+    stbl = ['mdia', 'minf', 'stbl']
+    tkhd = _child_payload(data, trak, ['tkhd'], base_offset)
+    mdhd = _child_payload(data, trak, ['mdia', 'mdhd'], base_offset)
+    hdlr = _child_payload(data, trak, ['mdia', 'hdlr'], base_offset)
+    stts = _child_payload(data, trak, stbl + ['stts'], base_offset)
+    stsz = _child_payload(data, trak, stbl + ['stsz'], base_offset)
+    stsc = _child_payload(data, trak, stbl + ['stsc'], base_offset)
+    stco = _child_payload(data, trak, stbl + ['stco'], base_offset)
+    co64 = _child_payload(data, trak, stbl + ['co64'], base_offset)
+    stss = _child_payload(data, trak, stbl + ['stss'], base_offset)
+    if None in (tkhd, mdhd, hdlr, stts, stsz, stsc) or (stco is None and co64 is None):
+        return None  # e.g. compact sample sizes (stz2) are not supported
+
+    track_id = struct.unpack_from('>I', tkhd, 20 if tkhd[0] == 1 else 12)[0]
+    timescale = struct.unpack_from('>I', mdhd, 20 if mdhd[0] == 1 else 12)[0]
+    handler = bytes(hdlr[8:12]).decode('latin-1')
+
+    times: List[int] = []
+    time = 0
+    for index in range(struct.unpack_from('>I', stts, 4)[0]):
+        count, delta = struct.unpack_from('>II', stts, 8 + 8 * index)
+        for _ in range(count):
+            times.append(time)
+            time += delta
+
+    sample_size, sample_count = struct.unpack_from('>II', stsz, 4)
+    sizes = [sample_size] * sample_count if sample_size else list(struct.unpack_from(f'>{sample_count}I', stsz, 12))
+
+    if co64 is not None:
+        chunk_offsets = struct.unpack_from(f'>{struct.unpack_from(">I", co64, 4)[0]}Q', co64, 8)
+    else:
+        chunk_offsets = struct.unpack_from(f'>{struct.unpack_from(">I", stco, 4)[0]}I', stco, 8)
+
+    runs = [struct.unpack_from('>III', stsc, 8 + 12 * index) for index in range(struct.unpack_from('>I', stsc, 4)[0])]
+    offsets: List[int] = []
+    for run, (first_chunk, samples_per_chunk, _) in enumerate(runs):
+        last_chunk = runs[run + 1][0] - 1 if run + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(samples_per_chunk):
+                if len(offsets) == len(sizes):
+                    break
+                offsets.append(offset)
+                offset += sizes[len(offsets) - 1]
+
+    sync_samples: Optional[List[int]] = None
+    if stss is not None:
+        count = struct.unpack_from('>I', stss, 4)[0]
+        sync_samples = [number - 1 for number in struct.unpack_from(f'>{count}I', stss, 8)]
+
+    count = min(len(times), len(sizes), len(offsets))
+    return TrackSamples(
+        track_id=track_id,
+        handler=handler,
+        timescale=timescale,
+        times=times[:count],
+        sizes=sizes[:count],
+        offsets=offsets[:count],
+        sync_samples=sync_samples,
+    )
+
+
+def is_fragmented(moov: bytes, base_offset: int) -> bool:
+    """Returns True if the `moov` box announces movie fragments (`mvex`)."""
+    box = parse_box_header(moov, 0, base_offset=base_offset)
+    return any(True for _ in find_boxes(moov, ['mvex'], box.header_size, box.size, base_offset=base_offset))
+
+
+def parse_tracks(moov: bytes, base_offset: int) -> List[TrackSamples]:
+    """Parses the sample tables of all tracks of the `moov` box which starts at `base_offset` in the file."""
+    box = parse_box_header(moov, 0, base_offset=base_offset)
+    tracks = []
+    for trak in find_boxes(moov, ['trak'], box.header_size, box.size, base_offset=base_offset):
+        track = _parse_track(moov, trak, base_offset)
+        if track is not None and track.times:
+            tracks.append(track)
+    return tracks
+
+
+def merge_ranges(ranges: List[ByteRange], max_gap: int = 0) -> List[ByteRange]:
+    """Merges overlapping byte ranges and ranges that are at most `max_gap` bytes apart."""
+    merged: List[ByteRange] = []
+    for start, end in sorted(ranges):
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def sample_byte_ranges(
+        tracks: List[TrackSamples], start: float, end: float, margin: float = 1.0, lead_samples: int = 8,
+        max_gap: int = 64 * 1024
+) -> List[ByteRange]:
+    """Maps the time interval [start, end] in seconds to the byte ranges of the samples needed to cut it.
+
+    The interval is extended back to the keyframe preceding `start` in the video track and by `margin` seconds on
+    both sides for the other tracks (e.g. audio pre-roll). The first `lead_samples` samples of every track are always
+    included so that probing the stream finds valid data.
+    """
+    video = next((track for track in tracks if track.handler == 'vide'), None)
+    seek = start if video is None else video.time_of(video.sync_index_at(start))
+    ranges: List[ByteRange] = []
+    for track in tracks:
+        first = track.index_at(max(min(seek, start - margin), 0) if track is not video else seek)
+        last = track.index_at(end + margin)
+        for index in list(range(min(lead_samples, len(track.times)))) + list(range(first, last + 1)):
+            ranges.append((track.offsets[index], track.offsets[index] + track.sizes[index]))
+    return merge_ranges(ranges, max_gap=max_gap)
+
+
+def parse_sidx(sidx: bytes, base_offset: int) -> Optional[List[Segment]]:
+    """Parses a `sidx` box starting at `base_offset` in the file into its subsegments.
+
+    Returns None for hierarchical indexes that reference other `sidx` boxes.
+    """
+    box = parse_box_header(sidx, 0, base_offset=base_offset)
+    payload = _payload(sidx, box, base_offset)
+    version = payload[0]
+    timescale = struct.unpack_from('>I', payload, 8)[0]
+    if version == 0:
+        earliest, first_offset = struct.unpack_from('>II', payload, 12)
+        position = 20
+    else:
+        earliest, first_offset = struct.unpack_from('>QQ', payload, 12)
+        position = 28
+    count = struct.unpack_from('>H', payload, position + 2)[0]
+    position += 4
+    segments: List[Segment] = []
+    offset = box.end + first_offset
+    time = earliest
+    for index in range(count):
+        reference, duration, sap = struct.unpack_from('>III', payload, position + 12 * index)
+        if reference >> 31:
+            return None
+        size = reference & 0x7FFFFFFF
+        segments.append(Segment(
+            offset=offset,
+            size=size,
+            start=time / timescale,
+            duration=duration / timescale,
+            starts_with_sap=bool(sap >> 31),
+        ))
+        offset += size
+        time += duration
+    return segments
+
+
+def select_segments(segments: List[Segment], start: float, end: float) -> List[Segment]:
+    """Selects the subsegments covering [start, end], starting at a subsegment that begins with a keyframe."""
+    first = max(bisect.bisect_right([segment.start for segment in segments], start) - 1, 0)
+    while first > 0 and not segments[first].starts_with_sap:
+        first -= 1
+    last = first
+    while last + 1 < len(segments) and segments[last + 1].start < end:
+        last += 1
+    return segments[first:last + 1]
+
+
+def has_absolute_base_offsets(fragment: bytes, base_offset: int) -> bool:
+    """Returns True if any track fragment in `fragment` (a `moof` and its data) uses absolute base data offsets."""
+    for tfhd in find_boxes(fragment, ['moof', 'traf', 'tfhd'], base_offset=base_offset):
+        flags = struct.unpack_from('>I', _payload(fragment, tfhd, base_offset), 0)[0] & 0xFFFFFF
+        if flags & TFHD_BASE_DATA_OFFSET_PRESENT:
+            return True
+    return False
@@ -0,0 +1,276 @@
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import requests
+
+from src.util.logger import root_logger, trace_id_var
+
+# the OTLP span kind `internal` and status codes
+OTLP_SPAN_KIND_INTERNAL = 1
+OTLP_STATUS_OK = 1
+OTLP_STATUS_ERROR = 2
+
+
+def new_trace_id() -> str:
+    """Returns a random trace ID in the W3C/OTLP format (32 hex digits)."""
+    return uuid.uuid4().hex
+
+
+def _new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+@dataclass
+class Span:
+    """A timed operation within the trace of a request, e.g. the download, probe, cut or upload of its media.
+
+    Spans are plain picklable records, so that the spans of a cut in a worker process are handed back with its output.
+
+    Attributes:
+        name            The name of the operation, e.g. `download`, `probe`, `encode`, `ffmpeg` or `upload`.
+        trace_id        The ID of the trace, i.e. of the inbox message the operation is performed for.
+        span_id         The ID of this span.
+        parent_id       The ID of the span this span is nested in or None if it is a root span.
+        start           The start of the operation as a unix timestamp in seconds.
+        end             The end of the operation as a unix timestamp in seconds or None while it is running.
+        status          `ok` or `error` if the operation raised.
+        attributes      Further details of the operation, e.g. the number of bytes or the cut mode.
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    end: Optional[float] = None
+    status: str = 'ok'
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class JsonlExporter(object):
+    """Appends finished spans as JSON lines to a local file.
+
+    Attributes:
+        path        The path of the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._fp = open(path, 'a', encoding='utf-8')
+
+    def export(self, spans: Sequence[Span]) -> None:
+        lines = ''.join(json.dumps({**asdict(span), 'duration': span.duration}, default=str) + '\n' for span in spans)
+        with self._lock:
+            self._fp.write(lines)
+            self._fp.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._fp.close()
+
+
+class OtlpExporter(object):
+    """Posts finished spans in batches to a collector in the OTLP/HTTP JSON encoding.
+
+    Any OpenTelemetry collector (or a stand-in accepting the same requests) at `endpoint` receives the spans. They are
+    posted from a background thread, so that exporting never blocks the event loop or a cut; spans are dropped (and
+    counted) if the collector cannot keep up.
+
+    Attributes:
+        endpoint        The url the batches are posted to, e.g. `http://localhost:4318/v1/traces`.
+        dropped         The number of spans that were dropped.
+    """
+
+    _STOP = object()
+
+    def __init__(self, endpoint: str, service_name: str = 'gifcutterbot', batch_size: int = 128,
+                 interval_seconds: float = 5, max_queue: int = 4096, timeout: float = 10):
+        self.endpoint = endpoint
+        self.dropped = 0
+        self._service_name = service_name
+        self._batch_size = batch_size
+        self._interval = interval_seconds
+        self._timeout = timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='OtlpExporter', daemon=True)
+        self._thread.start()
+
+    def export(self, spans: Sequence[Span]) -> None:
+        for span in spans:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self.dropped += 1
+
+    def close(self) -> None:
+        """Posts the queued spans and stops the background thread."""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def encode(self, spans: Sequence[Span]) -> Dict[str, Any]:
+        """Returns the `ExportTraceServiceRequest` of `spans` in the OTLP JSON encoding."""
+        return {'resourceSpans': [{
+            'resource': {'attributes': self._attributes({'service.name': self._service_name})},
+            'scopeSpans': [{'scope': {'name': self._service_name}, 'spans': [self._encode_span(s) for s in spans]}],
+        }]}
+
+    def _encode_span(self, span: Span) -> Dict[str, Any]:
+        encoded = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': OTLP_SPAN_KIND_INTERNAL,
+            'startTimeUnixNano': str(int(span.start * 1e9)),
+            'endTimeUnixNano': str(int((span.end or span.start) * 1e9)),
+            'attributes': self._attributes(span.attributes),
+            'status': {'code': OTLP_STATUS_OK if span.status == 'ok' else OTLP_STATUS_ERROR},
+        }
+        if span.parent_id is not None:
+            encoded['parentSpanId'] = span.parent_id
+        return encoded
+
+    @staticmethod
+    def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        encoded = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                encoded.append({'key': key, 'value': {'boolValue': value}})
+            elif isinstance(value, int):
+                encoded.append({'key': key, 'value': {'intValue': str(value)}})  # int64 values are JSON strings
+            elif isinstance(value, float):
+                encoded.append({'key': key, 'value': {'doubleValue': value}})
+            elif value is not None:
+                encoded.append({'key': key, 'value': {'stringValue': str(value)}})
+        return encoded
+
+    def _run(self) -> None:
+        batch: List[Span] = []
+        deadline = time.monotonic() + self._interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if isinstance(item, Span):
+                batch.append(item)
+            if item is self._STOP or len(batch) >= self._batch_size or time.monotonic() >= deadline:
+                self._post(batch)
+                batch = []
+                deadline = time.monotonic() + self._interval
+            if item is self._STOP:
+                return
+
+    def _post(self, batch: List[Span]) -> None:
+        if len(batch) == 0:
+            return
+        try:
+            response = requests.post(self.endpoint, json=self.encode(batch), timeout=self._timeout)
+            response.raise_for_status()
+        except requests.RequestException as err:
+            self.dropped += len(batch)
+            root_logger.warning(f'Failed to export {len(batch)} spans to {self.endpoint}: {err}')
+
+
+class Tracer(object):
+    """Records the spans of the traces of the requests and hands the finished spans to its exporters.
+
+    The current span is kept in a context variable, so nested spans find their parent in the same thread or asyncio
+    task without passing it around; across threads the context is copied, across processes the trace and parent span
+    IDs are handed over explicitly. Without exporters spans are only timed, which costs a few microseconds.
+    """
+
+    def __init__(self):
+        self._exporters: List[Any] = []
+        self._current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('span', default=None)
+        self._collected: contextvars.ContextVar[Optional[List[Span]]] = contextvars.ContextVar(
+            'collected_spans', default=None
+        )
+
+    def add_exporter(self, exporter) -> None:
+        self._exporters.append(exporter)
+
+    def close(self) -> None:
+        for exporter in self._exporters:
+            exporter.close()
+        self._exporters = []
+
+    @property
+    def current_span(self) -> Optional[Span]:
+        return self._current.get()
+
+    @contextlib.contextmanager
+    def span(self, name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+             **attributes) -> Iterator[Span]:
+        """Times the operation `name` in the trace `trace_id` or in the trace of the current span.
+
+        Args:
+            name: The name of the operation.
+            trace_id: The ID of the trace; the trace of the current span (or a new one) if None.
+            parent_id: The ID of the parent span, e.g. of a span in another process; the current span if None.
+            attributes: Further details of the operation.
+        """
+        parent = self._current.get()
+        if trace_id is None:
+            trace_id = parent.trace_id if parent is not None else new_trace_id()
+        if parent_id is None and parent is not None and parent.trace_id == trace_id:
+            parent_id = parent.span_id
+        span = Span(name=name, trace_id=trace_id, span_id=_new_span_id(), parent_id=parent_id, start=time.time(),
+                    attributes=attributes)
+        span_token, trace_token = self._current.set(span), trace_id_var.set(trace_id)
+        try:
+            yield span
+        except BaseException as err:
+            span.status = 'error'
+            span.set('error', f'{type(err).__name__}: {err}')
+            raise
+        finally:
+            span.end = time.time()
+            self._current.reset(span_token)
+            trace_id_var.reset(trace_token)
+            self._finish(span)
+
+    @contextlib.contextmanager
+    def collecting(self) -> Iterator[List[Span]]:
+        """Collects the spans finished within the context instead of exporting them, e.g. to hand them back from a
+        worker process.
+        """
+        spans: List[Span] = []
+        token = self._collected.set(spans)
+        try:
+            yield spans
+        finally:
+            self._collected.reset(token)
+
+    def export(self, spans: Sequence[Span]) -> None:
+        for exporter in self._exporters:
+            try:
+                exporter.export(spans)
+            except Exception as err:
+                root_logger.warning(f'Failed to export spans ({type(err).__name__}): {err}')
+
+    def _finish(self, span: Span) -> None:
+        collected = self._collected.get()
+        if collected is not None:
+            collected.append(span)
+        elif self._exporters:
+            self.export([span])
+
+
+TRACER = Tracer()
+span = TRACER.span
@@ -1,16 +1,93 @@
+import re
 import shlex
 import subprocess
-from io import BytesIO
+from dataclasses import dataclass
+from typing import List, Optional
 
+from src.util import mp4_utilities
+from src.util.media_buffer import MediaBuffer
 
-def get_vid_duration(stream: BytesIO) -> float:
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+STREAM_PATTERN = re.compile(r'Stream #0:\d+.*?: (Video|Audio): (\w+)')
+TIME_BASE_PATTERN = re.compile(r'^#tb 0: (\d+)/(\d+)', re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class VideoProbe:
+    """The facts about a video source needed to plan a cut.
+
+    Attributes:
+        duration        The duration of the video in seconds.
+        keyframes       The sorted presentation timestamps of the keyframes of the first video stream in seconds.
+        video_codec     The codec name of the first video stream, e.g. `h264` or `vp8`.
+        audio_codec     The codec name of the first audio stream or None if the video has no audio.
+    """
+    duration: float
+    keyframes: List[float]
+    video_codec: str
+    audio_codec: Optional[str]
+
+
+def needs_seekable_input(head: bytes, ext: str) -> Optional[bool]:
+    """Returns True if ffmpeg needs a seekable (file) input to demux the video starting with `head`.
+
+    WebM is always streamable, MP4/MOV only if the `moov` box precedes the `mdat` box. Returns None if `head` is too
+    short to tell.
+    """
+    if ext == 'webm':
+        return False
+    if ext in ['mp4', 'mov']:
+        streamable = mp4_utilities.moov_precedes_mdat(head)
+        return None if streamable is None else not streamable
+    return True
+
+
+def get_vid_duration(stream: MediaBuffer) -> float:
     """Returns the video duration in seconds.
     """
-    len_cmd = shlex.split(f'ffprobe -i pipe:0 -show_entries format=duration -v quiet -of csv="p=0"')
-    proc = subprocess.Popen(len_cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-    stream.seek(0)
-    out, err = proc.communicate(input=stream.read())
-    proc.wait()
+    # ffprobe reads the (spilled) file instead of a copy of the media piped to its stdin
+    len_cmd = shlex.split(
+        f'ffprobe -i {shlex.quote(stream.path)} -show_entries format=duration -v quiet -of csv="p=0"'
+    )
+    proc = subprocess.Popen(len_cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
     if err:
         raise ValueError('Unable to get video duration.')
     return float(out)
+
+
+def probe_video(path: str) -> VideoProbe:
+    """Returns the duration, keyframe timestamps and codecs of the video file at `path`.
+
+    The keyframes are listed from the packets of the container (all other packets are dropped with the `noise`
+    bitstream filter), so nothing is decoded and only ffmpeg (and not ffprobe) is required.
+    """
+    probe_cmd = shlex.split(
+        f'ffmpeg -hide_banner -nostats -i {shlex.quote(path)} -map 0:v:0 -c copy -bsf:v "noise=drop=not(key)" '
+        f'-f framecrc -'
+    )
+    proc = subprocess.run(probe_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    log = proc.stderr.decode(errors='replace')
+    packets = proc.stdout.decode(errors='replace')
+    duration_match = DURATION_PATTERN.search(log)
+    time_base_match = TIME_BASE_PATTERN.search(packets)
+    if proc.returncode != 0 or duration_match is None or time_base_match is None:
+        raise ValueError('Unable to probe video.')
+    hours, minutes, seconds = duration_match.groups()
+    codecs = {}
+    for kind, codec in STREAM_PATTERN.findall(log):
+        codecs.setdefault(kind, codec)
+    if 'Video' not in codecs:
+        raise ValueError('Video has no video stream.')
+    # framecrc lines: stream index, dts, pts, duration, size, checksum
+    num, den = int(time_base_match.group(1)), int(time_base_match.group(2))
+    keyframes = sorted({
+        int(line.split(',')[2]) * num / den for line in packets.splitlines()
+        if line and not line.startswith('#')
+    })
+    return VideoProbe(
+        duration=int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        keyframes=keyframes or [0.0],
+        video_codec=codecs['Video'],
+        audio_codec=codecs.get('Audio'),
+    )
@@ -0,0 +1,383 @@
+"""Benchmarks of the cut handlers and the media probes over the test data and synthetic large inputs.
+
+Every case runs in a fresh interpreter, so that its peak RSS is not inflated by earlier cases, and records the wall
+time, the CPU time (including the ffmpeg processes it spawns), the peak RSS and the size of its output. The
+measurements are compared with the baselines in `benchmark_baseline.json` and a case regresses if a metric exceeds
+its baseline by more than the tolerance. Only ffmpeg is required, nothing is fetched from the network.
+
+Run it from the repository root::
+
+    python -m tests.benchmark                 # compare the test data cases with the baselines
+    python -m tests.benchmark --large         # also benchmark the synthetic large inputs
+    python -m tests.benchmark --update        # record the measurements as the new baselines
+
+Baselines depend on the machine, so record them on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'tests', 'benchmark_baseline.json')
+TEST_DATA_DIR = os.path.join(ROOT, 'test_data')
+SYNTHETIC_DIR = os.path.join(ROOT, '.cache', 'benchmark')
+# the relative amount a metric may exceed its baseline by
+DEFAULT_TOLERANCE = 0.25
+# absolute slack per metric, so that the noise of very short or small cases is not flagged
+MIN_DELTAS = {
+    'wall_seconds': 0.05,
+    'cpu_seconds': 0.05,
+    'peak_rss_bytes': 8 * 1024 * 1024,
+    'output_bytes': 1024,
+}
+# pairs of cases where the first is expected to cost less than the second in the given metrics
+COMPARISONS = [
+    # re-encoding in palette space instead of converting the frames to RGB and quantizing them again
+    ('gif_cut/palette.gif/500-2500/palette', 'gif_cut/palette.gif/500-2500/rgb', ('cpu_seconds', 'peak_rss_bytes')),
+    # splicing the compressed frames instead of decoding and re-encoding them
+    ('gif_cut/palette.gif/500-2500', 'gif_cut/palette.gif/500-2500/palette', ('cpu_seconds', 'peak_rss_bytes')),
+    # scanning the GIF blocks for the frame delays instead of decoding every frame with Pillow's seek loop
+    ('gif_duration/cat.gif', 'gif_duration/cat.gif/seek', ('cpu_seconds',)),
+    ('gif_duration/large.gif', 'gif_duration/large.gif/seek', ('cpu_seconds',)),
+] + [
+    # stream copying the range (speed policy) instead of re-encoding it (accuracy policy)
+    (f'video_cut/{source}/15400-19500/speed', f'video_cut/{source}/15400-19500/accuracy',
+     ('wall_seconds', 'cpu_seconds'))
+    for source in ['test.mov', 'test.webm', 'test.mp4']
+]
+# synthetic inputs are rendered by ffmpeg (from lavfi test sources or the test data) on first use
+SYNTHETIC_INPUTS = {
+    # one palette and transparent index for all frames, as encoded by ffmpeg's palettegen/paletteuse
+    'palette.gif': f'-t 4 -i {shlex.quote(os.path.join(TEST_DATA_DIR, "test.mp4"))} '
+                   '-vf fps=12,scale=360:-1,split[a][b];[a]palettegen[p];[b][p]paletteuse',
+    'large.gif': '-f lavfi -i testsrc2=size=640x360:rate=15:duration=30',
+    'large.mp4': '-f lavfi -i testsrc2=size=1280x720:rate=30:duration=120 -f lavfi -i sine=duration=120 '
+                 '-c:v libx264 -preset veryfast -g 60 -pix_fmt yuv420p -c:a aac -shortest -movflags +faststart',
+}
+
+
+@dataclass(frozen=True)
+class BenchmarkCase:
+    """A benchmarked call of a handler or probe.
+
+    Attributes:
+        name        The unique name of the case, the key of its baseline.
+        kind        The benchmarked call: `gif_cut`, `video_cut`, `gif_duration` or `vid_duration`.
+        source      The file name of the input in the test data or of a synthetic input.
+        start       The start of the cut in milliseconds.
+        end         The end of the cut in milliseconds.
+        options     Further options of the call, e.g. the output type of a GIF cut or the `path` of the GIF handler
+                    (`palette` or `rgb` re-encode the frames instead of splicing them) or of the GIF probe (`seek`
+                    decodes the frames instead of scanning the blocks) or the cut `policy` of a video cut.
+        large       A flag indicating if the case benchmarks a synthetic large input.
+    """
+    name: str
+    kind: str
+    source: str
+    start: float = 0
+    end: Optional[float] = None
+    options: Tuple[Tuple[str, str], ...] = ()
+    large: bool = False
+
+    @property
+    def requirements(self) -> List[str]:
+        return ['ffprobe'] if self.kind == 'vid_duration' else ['ffmpeg']
+
+
+@dataclass(frozen=True)
+class Measurement:
+    """The costs of a benchmark case.
+
+    Attributes:
+        wall_seconds        The median wall time of a run.
+        cpu_seconds         The median CPU time of a run including the processes it spawned.
+        peak_rss_bytes      The peak resident set size of the benchmark process and the processes it spawned.
+        output_bytes        The size of the output of a run (0 for the probes).
+    """
+    wall_seconds: float
+    cpu_seconds: float
+    peak_rss_bytes: int
+    output_bytes: int
+
+
+def _cases() -> List[BenchmarkCase]:
+    cases = [
+        BenchmarkCase(f'gif_cut/cat.gif/{start}-{end}', 'gif_cut', 'cat.gif', start, end)
+        for start, end in [(0, 250), (350, 450), (1250, 934823)]
+    ]
+    cases += [
+        BenchmarkCase('gif_cut/cat.gif/0-3000/watermark', 'gif_cut', 'cat.gif', 0, 3000, (('watermark', 'cut'),)),
+        BenchmarkCase('gif_cut/cat.gif/0-3000/mp4', 'gif_cut', 'cat.gif', 0, 3000, (('output_type', 'MP4'),)),
+        BenchmarkCase('gif_duration/cat.gif', 'gif_duration', 'cat.gif'),
+        BenchmarkCase('gif_duration/cat.gif/seek', 'gif_duration', 'cat.gif', options=(('path', 'seek'),)),
+    ]
+    cases += [
+        BenchmarkCase('gif_cut/palette.gif/500-2500', 'gif_cut', 'palette.gif', 500, 2500),
+    ] + [
+        BenchmarkCase(f'gif_cut/palette.gif/500-2500/{path}', 'gif_cut', 'palette.gif', 500, 2500, (('path', path),))
+        for path in ['palette', 'rgb']
+    ]
+    for source in ['test.mov', 'test.webm', 'test.mp4']:
+        cases += [
+            BenchmarkCase(f'video_cut/{source}/{start}-{end}', 'video_cut', source, start, end)
+            for start, end in [(0, 250), (350, 450), (1250, 3000)]
+        ]
+        cases += [
+            BenchmarkCase(f'video_cut/{source}/15400-19500/{policy}', 'video_cut', source, 15400, 19500,
+                          (('policy', policy),))
+            for policy in ['speed', 'accuracy']
+        ]
+        cases.append(BenchmarkCase(f'vid_duration/{source}', 'vid_duration', source))
+    cases += [
+        BenchmarkCase('gif_cut/large.gif/2000-12000', 'gif_cut', 'large.gif', 2000, 12000, large=True),
+        BenchmarkCase('gif_cut/large.gif/2000-12000/watermark', 'gif_cut', 'large.gif', 2000, 12000,
+                      (('watermark', 'cut'),), large=True),
+        BenchmarkCase('gif_duration/large.gif', 'gif_duration', 'large.gif', large=True),
+        BenchmarkCase('gif_duration/large.gif/seek', 'gif_duration', 'large.gif', options=(('path', 'seek'),),
+                      large=True),
+        BenchmarkCase('video_cut/large.mp4/61000-91000', 'video_cut', 'large.mp4', 61000, 91000, large=True),
+        BenchmarkCase('vid_duration/large.mp4', 'vid_duration', 'large.mp4', large=True),
+    ]
+    return cases
+
+
+CASES: Dict[str, BenchmarkCase] = {case.name: case for case in _cases()}
+
+
+def input_path(source: str) -> str:
+    """Returns the path of the input `source`; synthetic inputs are rendered with ffmpeg if they do not exist yet."""
+    if source not in SYNTHETIC_INPUTS:
+        return os.path.join(TEST_DATA_DIR, source)
+    path = os.path.join(SYNTHETIC_DIR, source)
+    if not os.path.exists(path):
+        os.makedirs(SYNTHETIC_DIR, exist_ok=True)
+        rendering = os.path.join(SYNTHETIC_DIR, f'.{source}')  # keeps the extension that selects the muxer
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-y', *shlex.split(SYNTHETIC_INPUTS[source]), rendering],
+            stdin=subprocess.DEVNULL, check=True,
+        )
+        os.replace(rendering, path)
+    return path
+
+
+def missing_requirements(case: BenchmarkCase) -> List[str]:
+    return [program for program in case.requirements if shutil.which(program) is None]
+
+
+def _runner(case: BenchmarkCase) -> Callable[[], int]:
+    # the handlers are imported in the benchmark process only
+    from src.execution.task import TaskConfig
+    from src.handler.gif import GifCutHandler
+    from src.handler.strategy import CutStrategy
+    from src.handler.video import VideoCutHandler
+    from src.model.cut_mode import CutPolicy
+    from src.model.media_type import MediaType
+    from src.model.task_state import TaskConfigState
+    from src.util import gif_utilities, video_utilities
+    from src.util.aux import Watermark
+    from src.util.media_buffer import MediaBuffer
+
+    path = input_path(case.source)
+    options = dict(case.options)
+    ext = os.path.splitext(case.source)[-1][1:]
+
+    def config() -> TaskConfig:
+        watermark = Watermark(options['watermark'], (0, 0), (255, 255, 255)) if 'watermark' in options else None
+        output_type = MediaType[options['output_type']] if 'output_type' in options else None
+        return TaskConfig(
+            message=None, media_type=MediaType[ext.upper()], start=case.start, end=case.end, watermark=watermark,
+            state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False, media_url=f'file://{path}',
+            duration=None, extension=ext, output_type=output_type, trace_id=None,
+        )
+
+    def cut(handler) -> int:
+        with MediaBuffer.from_path(path, owned=False) as stream:
+            with handler.cut(stream, config()).media_stream as out:
+                return out.size
+
+    def seek_loop_duration(stream) -> float:
+        # the frame decoding probe that was replaced by the block scanner
+        from PIL import Image
+        image = Image.open(stream)
+        duration_ms = 0
+        while True:
+            try:
+                duration_ms += image.info['duration']
+                image.seek(image.tell() + 1)
+            except EOFError:
+                return duration_ms / 1000
+
+    def duration(get_duration) -> int:
+        with MediaBuffer.from_path(path, owned=False) as stream:
+            assert get_duration(stream) > 0
+        return 0
+
+    gif_path = options.get('path', 'splice')
+    gif_probe = seek_loop_duration if options.get('path') == 'seek' else gif_utilities.get_gif_duration
+    return {
+        'gif_cut': lambda: cut(GifCutHandler(splice=gif_path == 'splice', preserve_palette=gif_path != 'rgb')),
+        # a new handler per run, so that the keyframe probe of the source is not reused from the strategy
+        'video_cut': lambda: cut(VideoCutHandler(CutStrategy(policy=CutPolicy(options.get('policy', 'balanced'))))),
+        'gif_duration': lambda: duration(gif_probe),
+        'vid_duration': lambda: duration(video_utilities.get_vid_duration),
+    }[case.kind]
+
+
+def _cpu_seconds() -> float:
+    # user and system time of this process and of the (terminated) processes it spawned
+    return sum(usage.ru_utime + usage.ru_stime for usage in map(
+        resource.getrusage, [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]
+    ))
+
+
+def _peak_rss_bytes() -> int:
+    # the maximum RSS of getrusage survives the exec of a forked process, hence the high water mark of /proc is read
+    try:
+        with open('/proc/self/status') as fp:
+            own_peak = int(re.search(r'VmHWM:\s+(\d+)', fp.read()).group(1)) * 1024
+    except OSError:
+        own_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return max(own_peak, children_peak)
+
+
+def run_case(case: BenchmarkCase, repeat: int) -> Measurement:
+    """Runs `case` `repeat` times in this process and returns the median costs of a run."""
+    run = _runner(case)
+    wall, cpu, output_bytes = [], [], 0
+    for _ in range(repeat):
+        cpu0 = _cpu_seconds()
+        t0 = time.perf_counter()
+        output_bytes = run()
+        wall.append(time.perf_counter() - t0)
+        cpu.append(_cpu_seconds() - cpu0)
+    return Measurement(
+        wall_seconds=statistics.median(wall),
+        cpu_seconds=statistics.median(cpu),
+        peak_rss_bytes=_peak_rss_bytes(),
+        output_bytes=output_bytes,
+    )
+
+
+def measure(case: BenchmarkCase, repeat: int = 3) -> Measurement:
+    """Measures `case` in a fresh interpreter."""
+    input_path(case.source)  # render synthetic inputs up front, they are not part of the measurement
+    proc = subprocess.run(
+        [sys.executable, '-m', 'tests.benchmark', '--run', case.name, '--repeat', str(repeat)],
+        cwd=ROOT, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f'Benchmark {case.name} failed: {proc.stderr.decode(errors="replace")}')
+    return Measurement(**json.loads(proc.stdout.decode().splitlines()[-1]))
+
+
+def regressions(measurement: Measurement, baseline: Dict[str, float], tolerance: float = DEFAULT_TOLERANCE
+                ) -> List[str]:
+    """Returns a description of every metric of `measurement` that exceeds its baseline by more than `tolerance`."""
+    found = []
+    for metric, value in asdict(measurement).items():
+        if metric not in baseline:
+            continue
+        limit = max(baseline[metric] * (1 + tolerance), baseline[metric] + MIN_DELTAS[metric])
+        if value > limit:
+            found.append(f'{metric} {value:.4g} > {limit:.4g} (baseline {baseline[metric]:.4g})')
+    return found
+
+
+def comparison_failures(measurements: Dict[str, Measurement]) -> List[str]:
+    """Returns a description of every comparison of :data:`COMPARISONS` that does not hold in `measurements`."""
+    found = []
+    for cheaper, costlier, metrics in COMPARISONS:
+        if cheaper not in measurements or costlier not in measurements:
+            continue
+        for metric in metrics:
+            value, other = getattr(measurements[cheaper], metric), getattr(measurements[costlier], metric)
+            if value >= other:
+                found.append(f'{cheaper} {metric} {value:.4g} >= {other:.4g} of {costlier}')
+    return found
+
+
+def load_baselines(path: str = BASELINE_PATH) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)['cases']
+
+
+def save_baselines(measurements: Dict[str, Measurement], path: str = BASELINE_PATH) -> None:
+    baselines = load_baselines(path)
+    baselines.update({
+        name: {metric: round(value, 4) for metric, value in asdict(measurement).items()}
+        for name, measurement in measurements.items()
+    })
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE).stdout.decode().split('\n')[0]
+    document = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'ffmpeg': ffmpeg,
+        },
+        'cases': dict(sorted(baselines.items())),
+    }
+    with open(path, 'w') as fp:
+        json.dump(document, fp, indent=2)
+        fp.write('\n')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the cut handlers and compares them with the baselines.')
+    parser.add_argument('cases', nargs='*', help='names (or name prefixes) of the cases to run, all by default')
+    parser.add_argument('--large', action='store_true', help='also run the cases of synthetic large inputs')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the median is reported (3)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'relative regression tolerance ({DEFAULT_TOLERANCE})')
+    parser.add_argument('--update', action='store_true', help='record the measurements as the new baselines')
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # runs a single case in this process
+    args = parser.parse_args(argv)
+
+    if args.run is not None:
+        print(json.dumps(asdict(run_case(CASES[args.run], repeat=args.repeat))))
+        return 0
+
+    baselines = load_baselines()
+    measurements: Dict[str, Measurement] = {}
+    failed = False
+    for case in CASES.values():
+        if args.cases and not any(case.name.startswith(prefix) for prefix in args.cases):
+            continue
+        if case.large and not args.large and not args.cases:
+            continue
+        missing = missing_requirements(case)
+        if missing:
+            print(f'{case.name:<44} skipped, {", ".join(missing)} not installed')
+            continue
+        measurement = measurements[case.name] = measure(case, repeat=args.repeat)
+        found = regressions(measurement, baselines[case.name], args.tolerance) if case.name in baselines else []
+        status = 'REGRESSED ' + '; '.join(found) if found else ('ok' if case.name in baselines else 'no baseline')
+        print(f'{case.name:<44} {measurement.wall_seconds * 1000:8.1f}ms wall {measurement.cpu_seconds * 1000:8.1f}ms '
+              f'CPU {measurement.peak_rss_bytes / 2 ** 20:7.1f}MiB RSS {measurement.output_bytes:>10} bytes  {status}')
+        failed |= bool(found)
+    for comparison in comparison_failures(measurements):
+        print(f'NOT CHEAPER {comparison}')
+        failed = True
+    if args.update:
+        save_baselines(measurements)
+        print(f'Recorded {len(measurements)} baselines in {os.path.relpath(BASELINE_PATH, ROOT)}.')
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
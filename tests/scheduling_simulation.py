@@ -0,0 +1,139 @@
+"""Simulates the reply latency of the cut queue policies on a synthetic mix of requests.
+
+Requests arrive at random (Poisson) times and are cut by a fixed number of consumers. Their costs are estimated
+by :func:`estimate_cut_seconds` from what a task config knows before its source is fetched, while the actual cut
+takes a random multiple of the estimate (the estimate is off by up to 2x either way), so the policies are compared
+with the errors the real estimates have. The queues are the ones the controller uses, driven by a simulated clock.
+
+Run it from the repository root::
+
+    python -m tests.scheduling_simulation
+"""
+import argparse
+import asyncio
+import heapq
+import random
+import statistics
+import sys
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from src.execution.scheduling import ShortestJobFirstQueue, estimate_cut_seconds
+from src.model.media_type import MediaType
+
+MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Job:
+    """A simulated request.
+
+    Attributes:
+        arrival     The time the task is queued.
+        cost        The estimated seconds of its fetch and cut.
+        seconds     The seconds its fetch and cut actually take.
+        kind        The kind of request of the mix.
+    """
+    arrival: float
+    cost: float
+    seconds: float
+    kind: str
+
+
+@dataclass(frozen=True)
+class Latencies:
+    median: float
+    p95: float
+    maximum: float
+
+
+def _config(media_type: MediaType, start: float, end: float, duration: Optional[float]):
+    return SimpleNamespace(media_type=media_type, start=start, end=end, duration=duration, watermark=None,
+                           output_type=None)
+
+
+def synthetic_mix(count: int = 2000, workers: int = 2, utilization: float = 0.8, seed: int = 1) -> List[Job]:
+    """Returns `count` requests: mostly short GIF cuts, some short video cuts and a few cuts of long 1080p videos."""
+    rng = random.Random(seed)
+    jobs = []
+    for _ in range(count):
+        draw = rng.random()
+        if draw < 0.7:
+            kind, size = 'gif', rng.uniform(1, 6) * MB
+            config = _config(MediaType.GIF, 0, rng.uniform(2, 8) * 1000, None)
+        elif draw < 0.95:
+            kind, duration = 'video', rng.uniform(30, 120)
+            size = duration * rng.uniform(0.3, 1) * MB
+            start = rng.uniform(0, duration - 20) * 1000
+            config = _config(MediaType.MP4, start, start + rng.uniform(5, 20) * 1000, duration)
+        else:
+            kind, duration = 'long video', 600
+            size = duration * rng.uniform(0.5, 1) * MB  # 10 minutes of 1080p
+            start = rng.uniform(0, 300) * 1000
+            config = _config(MediaType.MP4, start, start + rng.uniform(60, 300) * 1000, duration)
+        cost = estimate_cut_seconds(config, source_bytes=int(size))
+        jobs.append(Job(arrival=0, cost=cost, seconds=cost * 2 ** rng.uniform(-1, 1), kind=kind))
+    # arrivals at the rate that keeps the consumers busy `utilization` of the time
+    rate = utilization * workers / statistics.mean(job.seconds for job in jobs)
+    arrival = 0.0
+    for index, job in enumerate(jobs):
+        arrival += rng.expovariate(rate)
+        jobs[index] = Job(arrival=arrival, cost=job.cost, seconds=job.seconds, kind=job.kind)
+    return jobs
+
+
+def simulate(queue: asyncio.Queue, jobs: List[Job], workers: int = 2) -> List[float]:
+    """Returns the latencies (from queueing to the end of the cut) of the jobs cut by `workers` consumers of
+    `queue` in the order the queue hands them out.
+    """
+    latencies: List[float] = []
+    free_at = [0.0] * workers  # the times the consumers finish their current cut
+    pending = iter(jobs)
+    upcoming: Optional[Job] = next(pending, None)
+    while upcoming is not None or not queue.empty():
+        now = heapq.heappop(free_at)
+        if queue.empty() and upcoming is not None:
+            now = max(now, upcoming.arrival)  # the consumer waits for the next request
+        while upcoming is not None and upcoming.arrival <= now:
+            queue.put_nowait(SimpleNamespace(cost=upcoming.cost, enqueued_at=upcoming.arrival, job=upcoming))
+            upcoming = next(pending, None)
+        job: Job = queue.get_nowait().job
+        heapq.heappush(free_at, now + job.seconds)
+        latencies.append(now + job.seconds - job.arrival)
+    return latencies
+
+
+def latencies_of(latencies: List[float]) -> Latencies:
+    ordered = sorted(latencies)
+    return Latencies(median=statistics.median(ordered), p95=ordered[int(0.95 * (len(ordered) - 1))],
+                     maximum=ordered[-1])
+
+
+POLICIES: Dict[str, Callable[[], asyncio.Queue]] = {
+    'fifo': asyncio.Queue,
+    'sjf (aging 0)': lambda: ShortestJobFirstQueue(aging=0),
+    'sjf (aging 0.1)': lambda: ShortestJobFirstQueue(aging=0.1),
+    'sjf (aging 1)': lambda: ShortestJobFirstQueue(aging=1),
+}
+
+
+def compare(count: int = 2000, workers: int = 2, utilization: float = 0.8, seed: int = 1) -> Dict[str, Latencies]:
+    jobs = synthetic_mix(count=count, workers=workers, utilization=utilization, seed=seed)
+    return {name: latencies_of(simulate(factory(), jobs, workers=workers)) for name, factory in POLICIES.items()}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compares the reply latency of the cut queue policies.')
+    parser.add_argument('--count', type=int, default=2000, help='number of requests (2000)')
+    parser.add_argument('--workers', type=int, default=2, help='number of cut consumers (2)')
+    parser.add_argument('--utilization', type=float, default=0.8, help='share of time the consumers are busy (0.8)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic mix (1)')
+    args = parser.parse_args(argv)
+    for name, latencies in compare(args.count, args.workers, args.utilization, args.seed).items():
+        print(f'{name:<16} median {latencies.median:8.2f}s  p95 {latencies.p95:8.2f}s  max {latencies.maximum:8.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import asyncio
+import dataclasses
+import types
+
+from src.cache.result import ResultCache
+from src.client.media import PartialMediaFetcher
+from src.execution import task as t
+from src.execution.admission import AdmissionControl
+from src.execution.controller import AioController
+from src.model.admission import AdmissionOutcome
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+from src.util import config
+from src.util.aux import Watermark
+
+MB = 1024 * 1024
+WATERMARK = Watermark(text='cut', position=(0, 0), color=(255, 255, 255))
+
+
+def _config(media_type=MediaType.MP4, start=0, end=10000, duration=600, watermark=None, output_type=None,
+            message=None):
+    return t.TaskConfig(
+        message=message, media_type=media_type, start=start, end=end, watermark=watermark,
+        state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False, media_url='https://v.redd.it/a/DASH_720.mp4',
+        duration=duration, extension=media_type.name.lower(), output_type=output_type, trace_id=None,
+    )
+
+
+def test_requests_within_the_budgets_are_admitted_as_they_are():
+    control = AdmissionControl(max_source_bytes=100 * MB, max_cut_seconds=60, max_output_bytes=50 * MB,
+                               max_cpu_seconds=60)
+    config_ = _config(watermark=WATERMARK)
+    admission = control.admit(config_, source_bytes=60 * MB)
+    assert admission.outcome == AdmissionOutcome.ADMIT and admission.config is config_ and admission.reason == ''
+    # a GIF without an end is bounded by its handler, which knows its duration
+    gif = _config(MediaType.GIF, end=None, duration=None)
+    assert AdmissionControl(max_cut_seconds=1).admit(gif).config is gif
+
+
+def test_long_ranges_are_clamped_to_the_duration_and_output_budgets():
+    admission = AdmissionControl(max_cut_seconds=60).admit(_config(start=5000, end=None))
+    assert admission.outcome == AdmissionOutcome.CLAMP and admission.config.end == 65000
+    assert admission.reason == 'the requested 595s are cut to the first 60s, the most I cut'
+
+    # 600MB of ten minutes: a stream copy of 60s would be about 60MB
+    admission = AdmissionControl(max_cut_seconds=60, max_output_bytes=20 * MB).admit(
+        _config(start=5000, end=None), source_bytes=600 * MB
+    )
+    assert admission.outcome == AdmissionOutcome.CLAMP and admission.config.end == 25000
+    assert admission.reasons[-1] == 'the cut is shortened to 20s to stay within the 20MB upload limit'
+
+
+def test_costly_work_is_left_out_before_a_request_is_rejected():
+    control = AdmissionControl(max_cpu_seconds=3)
+    gif = _config(MediaType.GIF, end=6000, duration=None, watermark=WATERMARK, output_type=MediaType.MP4)
+    admission = control.admit(gif)
+    assert admission.outcome == AdmissionOutcome.DOWNGRADE
+    assert admission.config.watermark is None and admission.config.output_type == MediaType.MP4
+    assert admission.reason == 'the watermark is left out to keep the cut within my time limit'
+
+    admission = control.admit(dataclasses.replace(gif, end=20000))
+    assert admission.outcome == AdmissionOutcome.DOWNGRADE
+    assert admission.config.watermark is None and admission.config.output_type == MediaType.GIF
+
+    admission = control.admit(dataclasses.replace(gif, end=300000))
+    assert admission.outcome == AdmissionOutcome.REJECT
+    assert admission.reasons[-1] == 'the cut would take about 6s, more than the 3s I spend on a cut'
+
+
+def test_oversized_sources_are_rejected_unless_only_the_range_is_fetched():
+    control = AdmissionControl(max_source_bytes=100 * MB)
+    admission = control.admit(_config(MediaType.GIF, duration=None), source_bytes=150 * MB)
+    assert admission.outcome == AdmissionOutcome.REJECT
+    assert admission.reason == 'the source is 150MB, more than the 100MB I download'
+    assert control.admit(_config(), source_bytes=None).outcome == AdmissionOutcome.ADMIT  # no Content-Length
+    # the 10s of a ten minute video are fetched partially: about 2.5MB of 150MB
+    partial_fetcher = PartialMediaFetcher(session=object(), min_duration=30, max_ratio=0.5)
+    assert control.admit(_config(), source_bytes=150 * MB, partial_fetcher=partial_fetcher).outcome == \
+           AdmissionOutcome.ADMIT
+    assert control.admit(_config(end=None), source_bytes=150 * MB, partial_fetcher=partial_fetcher).outcome == \
+           AdmissionOutcome.REJECT
+
+
+class FakeDownloader(object):
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.heads = []
+
+    async def content_length(self, url):
+        self.heads.append(url)
+        return self.sizes.get(url)
+
+    async def download(self, *args, **kwargs):
+        raise AssertionError('no media bytes are fetched before a request is admitted')
+
+
+def test_requests_are_admitted_before_their_source_is_fetched(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CUT_WORKERS', 0)
+    monkeypatch.setattr(t.TaskConfigFactory, 'oembed_page_url', classmethod(lambda cls, message: None))
+    monkeypatch.setattr(t.TaskConfigFactory, 'from_message', staticmethod(
+        lambda message, oembed_page=None, gif_output_type=None, trace_id=None: dataclasses.replace(
+            _config(end=message.end, message=message), media_url=message.url
+        )
+    ))
+    replies = []
+
+    async def reply(body):
+        replies.append(body)
+
+    async def scenario():
+        controller = AioController(
+            input_queue=asyncio.Queue(), output_queue=asyncio.Queue(),
+            result_cache=ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10),
+        )
+        controller.admission = AdmissionControl(max_source_bytes=500 * MB, max_cut_seconds=60)
+        controller.downloader = FakeDownloader({'https://v.redd.it/huge.mp4': 2048 * MB})
+        for fullname, url, end in [('t1_huge', 'https://v.redd.it/huge.mp4', 10000),
+                                   ('t1_long', 'https://v.redd.it/long.mp4', 300000)]:
+            message = types.SimpleNamespace(fullname=fullname, url=url, end=end, reply=reply)
+            await controller._reddit_message_to_input_queue(message)
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.downloader.heads == ['https://v.redd.it/huge.mp4', 'https://v.redd.it/long.mp4']
+    # the huge source is answered with the reason and marked read with the next fetch
+    assert len(replies) == 1 and replies[0].startswith(
+        'Sorry, I cannot cut this one: the source is 2048MB, more than the 500MB I download.'
+    )
+    assert [message.fullname for message in controller._answered] == ['t1_huge']
+    # the long range is clamped
+    task = controller.input_queue.get_nowait()
+    assert task.config.message.fullname == 't1_long' and task.config.end == 60000 and controller.input_queue.empty()
@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import pytest
+
+import benchmark
+from benchmark import CASES, Measurement
+
+requires_benchmark = pytest.mark.skipif(
+    os.getenv('BENCHMARK', '').lower() not in ('1', 'true', 'yes'), reason='benchmarks run with BENCHMARK=1'
+)
+
+
+def test_regressions_exceed_tolerance_and_slack():
+    baseline = {'wall_seconds': 1.0, 'cpu_seconds': 0.01, 'peak_rss_bytes': 100 * 2 ** 20, 'output_bytes': 10 ** 6}
+    same = Measurement(wall_seconds=1.2, cpu_seconds=0.05, peak_rss_bytes=100 * 2 ** 20, output_bytes=10 ** 6)
+    assert benchmark.regressions(same, baseline, tolerance=0.25) == []  # the CPU time is within the slack
+    slower = Measurement(wall_seconds=1.3, cpu_seconds=0.01, peak_rss_bytes=130 * 2 ** 20, output_bytes=10 ** 6)
+    found = benchmark.regressions(slower, baseline, tolerance=0.25)
+    assert [regression.split()[0] for regression in found] == ['wall_seconds', 'peak_rss_bytes']
+
+
+def test_cases_have_baselines():
+    baselines = benchmark.load_baselines()
+    ffprobe_cases = {name for name, case in CASES.items() if 'ffprobe' in case.requirements}
+    # the probes with ffprobe are left out if it was not installed where the baselines were recorded
+    assert set(CASES) - ffprobe_cases <= set(baselines) <= set(CASES)
+
+
+@requires_benchmark
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+@pytest.mark.parametrize('name', [name for name, case in CASES.items() if not case.large])
+def test_benchmark(name):
+    case = CASES[name]
+    if benchmark.missing_requirements(case):
+        pytest.skip(f'{", ".join(benchmark.missing_requirements(case))} not installed')
+    baseline = benchmark.load_baselines().get(name)
+    if baseline is None:
+        pytest.skip('no baseline, record it with `python -m tests.benchmark --update`')
+    measurement = benchmark.measure(case)
+    # the measurements of all cases are reported by `python -m tests.benchmark`
+    assert benchmark.regressions(measurement, baseline, tolerance=benchmark.DEFAULT_TOLERANCE) == []
+
+
+def test_comparison_failures_name_the_metric():
+    cheap = Measurement(wall_seconds=0.1, cpu_seconds=0.1, peak_rss_bytes=10, output_bytes=1)
+    costly = Measurement(wall_seconds=0.1, cpu_seconds=0.2, peak_rss_bytes=10, output_bytes=1)
+    cheaper, costlier, _ = benchmark.COMPARISONS[0]
+    found = benchmark.comparison_failures({cheaper: cheap, costlier: costly})
+    assert [failure.split()[1] for failure in found] == ['peak_rss_bytes']
+    assert benchmark.comparison_failures({cheaper: cheap}) == []  # only measured pairs are compared
+
+
+@requires_benchmark
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+@pytest.mark.parametrize('cheaper, costlier, metrics', benchmark.COMPARISONS)
+def test_comparison(cheaper, costlier, metrics):
+    measurements = {name: benchmark.measure(CASES[name]) for name in (cheaper, costlier)}
+    assert benchmark.comparison_failures(measurements) == []
@@ -0,0 +1,246 @@
+import asyncio
+import io
+import time
+import types
+
+import pytest
+
+from src.cache.result import ResultCache, result_cache_key_for
+from src.execution import task as t
+from src.execution.controller import AioController
+from src.model.media_type import MediaType
+from src.model.result import Result
+from src.model.task_state import TaskConfigState, TaskState
+from src.util import config, tracing
+
+
+class FakeTask(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.enqueued_at = None
+        self.trace_id = None
+
+    def is_state(self, state) -> bool:
+        return TaskState.VALID in state if isinstance(state, list) else state == TaskState.VALID
+
+
+@pytest.fixture()
+def controller_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CUT_WORKERS', 0)  # cut in threads of the test process
+
+    def create(input_size: int = 0, output_size: int = 0, cut_seconds: float = 0, upload_seconds: float = 0):
+        controller = AioController(
+            input_queue=asyncio.Queue(maxsize=input_size), output_queue=asyncio.Queue(maxsize=output_size),
+            result_cache=ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10),
+        )
+        controller.imgur = controller.reddit = object()
+        controller.uploaded = []
+        controller.in_flight = controller.max_in_flight = 0
+
+        def exert_task(task):
+            time.sleep(cut_seconds)
+            return Result(io.BytesIO(b'GIF89a'), media_type=MediaType.GIF, message=task.name)
+
+        async def upload_to_imgur(result):
+            await asyncio.sleep(upload_seconds)
+            return f'https://i.imgur.com/{result.message}.gif'
+
+        async def answer_in_reddit(message, upload_link):
+            controller.in_flight += 1
+            controller.max_in_flight = max(controller.max_in_flight, controller.in_flight)
+            await asyncio.sleep(upload_seconds)
+            controller.in_flight -= 1
+            controller.uploaded.append((message, upload_link, time.perf_counter()))
+
+        controller._exert_task = exert_task
+        controller._upload_to_imgur = upload_to_imgur
+        controller._answer_in_reddit = answer_in_reddit
+        return controller
+
+    return create
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_items_move_between_stages_immediately(controller_factory):
+    async def scenario():
+        controller = controller_factory()
+        consumers = controller.start_consumers(asyncio.get_running_loop(), cut_concurrency=2, upload_concurrency=2)
+        t0 = time.perf_counter()
+        await controller.input_queue.put(FakeTask('a'))
+        await controller.input_queue.join()
+        await controller.output_queue.join()
+        for consumer in consumers:
+            consumer.cancel()
+        return t0, controller.uploaded
+
+    t0, uploaded = _run(scenario())
+    assert [(message, link) for message, link, _ in uploaded] == [('a', 'https://i.imgur.com/a.gif')]
+    assert uploaded[0][2] - t0 < 1  # instead of waiting for the next timer tick of the cut and upload stage
+
+
+def test_consumers_limit_stage_concurrency(controller_factory):
+    async def scenario():
+        controller = controller_factory(upload_seconds=0.05)
+        consumers = controller.start_consumers(asyncio.get_running_loop(), cut_concurrency=4, upload_concurrency=3)
+        for i in range(12):
+            await controller.input_queue.put(FakeTask(str(i)))
+        await controller.input_queue.join()
+        await controller.output_queue.join()
+        for consumer in consumers:
+            consumer.cancel()
+        return controller
+
+    controller = _run(scenario())
+    assert len(controller.uploaded) == 12
+    assert controller.max_in_flight == 3
+
+
+def test_bounded_queues_apply_back_pressure(controller_factory):
+    async def scenario():
+        controller = controller_factory(input_size=1, output_size=1, upload_seconds=0.2)
+        consumers = controller.start_consumers(asyncio.get_running_loop(), cut_concurrency=1, upload_concurrency=1)
+        # 1 upload in flight, 1 result in the output queue, 1 cut waiting to put its result and 1 task in the input
+        # queue: the producer of the 5th task has to wait for the upload stage
+        for i in range(4):
+            await controller.input_queue.put(FakeTask(str(i)))
+            await asyncio.sleep(0.02)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(controller.input_queue.put(FakeTask('4')), timeout=0.1)
+        await controller.input_queue.join()
+        await controller.output_queue.join()
+        for consumer in consumers:
+            consumer.cancel()
+        return controller
+
+    controller = _run(scenario())
+    assert [message for message, _, _ in controller.uploaded] == ['0', '1', '2', '3']
+
+
+def test_identical_requests_share_one_cut(controller_factory, monkeypatch):
+    def from_message(message, oembed_page=None, gif_output_type=None, trace_id=None):
+        return t.TaskConfig(
+            message=message, media_type=MediaType.MP4, start=message.start, end=message.start + 2000, watermark=None,
+            state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False, media_url='https://v.redd.it/abc.mp4',
+            duration=None, extension='mp4', output_type=None, trace_id=None,
+        )
+
+    monkeypatch.setattr(t.TaskConfigFactory, 'oembed_page_url', classmethod(lambda cls, message: None))
+    monkeypatch.setattr(t.TaskConfigFactory, 'from_message', staticmethod(from_message))
+    cuts = []
+
+    async def scenario():
+        controller = controller_factory(upload_seconds=0.01)
+
+        def exert_task(task):
+            cuts.append(task.config.start)
+            time.sleep(0.2)
+            return Result(io.BytesIO(b'GIF89a'), media_type=MediaType.GIF, message=task.config.message,
+                          cache_key=result_cache_key_for(task.config))
+
+        controller._exert_task = exert_task
+        consumers = controller.start_consumers(asyncio.get_running_loop(), cut_concurrency=2, upload_concurrency=2)
+        # a burst of 5 mentions of the same range and 1 of another range
+        for i, start in enumerate([1000, 1000, 5000, 1000, 1000, 1000]):
+            message = types.SimpleNamespace(name=str(i), start=start)
+            assert await controller._reddit_message_to_input_queue(message)
+        assert controller.input_queue.qsize() <= 2
+        await controller.input_queue.join()
+        await controller.output_queue.join()
+        for consumer in consumers:
+            consumer.cancel()
+        return controller
+
+    controller = _run(scenario())
+    assert sorted(cuts) == [1000, 5000]
+    assert sorted(message.name for message, _, _ in controller.uploaded) == ['0', '1', '2', '3', '4', '5']
+    links = {message.name: link for message, link, _ in controller.uploaded}
+    assert len({links[name] for name in '01345'}) == 1 and links['2'] != links['0']
+    assert controller._in_flight == {}
+
+
+def test_close_cancels_pending_requeues(controller_factory, monkeypatch):
+    monkeypatch.setattr(config, 'INVALID_TASK_RETRY_SECONDS', 60)
+
+    class InvalidTask(FakeTask):
+        def is_state(self, state) -> bool:
+            return TaskState.INVALID in state if isinstance(state, list) else state == TaskState.INVALID
+
+    async def scenario():
+        controller = controller_factory()
+        controller.imgur = None
+        consumers = controller.start_consumers(asyncio.get_running_loop(), cut_concurrency=1, upload_concurrency=1)
+        await controller.input_queue.put(InvalidTask('a'))
+        await controller.input_queue.join()
+        requeues = set(controller._requeues)
+        await controller.close()
+        for consumer in consumers:
+            consumer.cancel()
+        return controller, requeues
+
+    controller, requeues = _run(scenario())
+    assert len(requeues) == 1 and all(requeue.cancelled() for requeue in requeues)
+    assert not controller._requeues and controller.input_queue.empty()
+
+
+def test_messages_attached_to_a_failed_cut_are_requeued(controller_factory):
+    async def scenario():
+        controller = controller_factory()
+        requeued = []
+
+        async def reddit_message_to_input_queue(message):
+            requeued.append(message)
+            return True
+
+        controller._reddit_message_to_input_queue = reddit_message_to_input_queue
+        controller._in_flight['key'] = ['b', 'c']
+        controller._release_in_flight(Result(None, media_type=MediaType.GIF, message='a', cache_key='key'))
+        await asyncio.gather(*controller._requeues)
+        return controller, requeued
+
+    controller, requeued = _run(scenario())
+    assert requeued == ['b', 'c'] and 'key' not in controller._in_flight
+
+
+def test_stages_continue_the_trace_of_the_message(controller_factory, monkeypatch):
+    def from_message(message, oembed_page=None, gif_output_type=None, trace_id=None):
+        return t.TaskConfig(
+            message=message, media_type=MediaType.MP4, start=0, end=2000, watermark=None,
+            state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False, media_url='https://v.redd.it/abc.mp4',
+            duration=None, extension='mp4', output_type=None, trace_id=trace_id,
+        )
+
+    monkeypatch.setattr(t.TaskConfigFactory, 'oembed_page_url', classmethod(lambda cls, message: None))
+    monkeypatch.setattr(t.TaskConfigFactory, 'from_message', staticmethod(from_message))
+    traced = []
+
+    async def scenario():
+        controller = controller_factory()
+
+        def exert_task(task):
+            traced.append(task.trace_id)
+            return Result(io.BytesIO(b'GIF89a'), media_type=MediaType.GIF, message=task.config.message,
+                          trace_id=task.trace_id)
+
+        controller._exert_task = exert_task
+        consumers = controller.start_consumers(asyncio.get_running_loop(), cut_concurrency=1, upload_concurrency=1)
+        assert await controller._reddit_message_to_input_queue(types.SimpleNamespace(id='m1'))
+        await controller.input_queue.join()
+        await controller.output_queue.join()
+        for consumer in consumers:
+            consumer.cancel()
+
+    with tracing.TRACER.collecting() as spans:
+        _run(scenario())
+    by_name = {span.name: span for span in spans}
+    assert {'ingest', 'cut', 'deliver'} <= set(by_name)
+    assert by_name['ingest'].attributes == {'message': 'm1', 'handed_over': True}
+    assert {span.trace_id for span in spans} == {by_name['ingest'].trace_id} == set(traced)
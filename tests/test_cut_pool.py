@@ -0,0 +1,117 @@
+import functools
+import http.server
+import os
+import pickle
+import threading
+from dataclasses import replace
+
+import pytest
+from PIL import Image
+
+from src.execution.job import CutJob
+from src.execution.pool import CutWorkerPool
+from src.model.media_type import MediaType
+from src.util.aux import Watermark
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def media_host():
+    handler = functools.partial(QuietHandler, directory='test_data')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def pool_factory(tmp_path, monkeypatch):
+    # the spawned workers read their configuration from the environment
+    monkeypatch.setenv('SOURCE_CACHE_ENABLED', 'false')
+    pools = []
+
+    def create(max_workers: int) -> CutWorkerPool:
+        pools.append(CutWorkerPool(max_workers=max_workers, output_dir=str(tmp_path / 'outputs')))
+        return pools[-1]
+
+    yield create
+    for pool in pools:
+        pool.close()
+
+
+def _gif_job(media_host: str, start: float = 0, end: float = 1000) -> CutJob:
+    return CutJob(
+        media_url=f'{media_host}/cat.gif', media_type=MediaType.GIF, extension='gif', start=start, end=end,
+        duration=None, watermark=Watermark(text='cut', position=(0, 0), color=(255, 255, 255)), output_type=None,
+    )
+
+
+def test_job_is_compact_and_picklable(media_host):
+    job = _gif_job(media_host)
+    payload = pickle.dumps(job)
+    assert len(payload) < 1024
+    assert pickle.loads(payload).to_config().media_url == job.media_url
+
+
+def test_outputs_are_handed_back_by_path(media_host, pool_factory):
+    pool = pool_factory(max_workers=2)
+    output = pool.submit(_gif_job(media_host)).result(timeout=60)
+    assert output.media_type == MediaType.GIF
+    assert os.path.getsize(output.path) == output.size > 0
+    with Image.open(output.path) as image:
+        assert image.format == 'GIF' and image.n_frames > 1
+    os.remove(output.path)
+
+
+def test_jobs_are_spread_over_the_workers(media_host, pool_factory):
+    jobs = [_gif_job(media_host, start=index * 100, end=index * 100 + 2000) for index in range(8)]
+    pool = pool_factory(max_workers=4)
+    pids = set()
+    for future in [pool.submit(job) for job in jobs]:
+        output = future.result(timeout=120)
+        os.remove(output.path)
+        pids.update(span.attributes['pid'] for span in output.spans if span.name == 'cut_worker')
+    # the jobs are cut by several worker processes at once, not one after another by the controller process
+    assert 1 < len(pids) <= 4 and os.getpid() not in pids
+
+
+def test_workers_cut_sources_fetched_by_the_controller(media_host, pool_factory, tmp_path):
+    from src.cache.source import SourceCache
+    from src.execution.task import Task
+
+    cache = SourceCache(directory=str(tmp_path / 'sources'), max_bytes=10 ** 8)
+    tasks = [Task(config=_gif_job(media_host, start=i * 100).to_config(), source_cache=cache) for i in range(2)]
+    sources = [task.prefetch_source() for task in tasks]
+    try:
+        assert len(cache._entries) == 1  # downloaded once for both tasks
+        pool = pool_factory(max_workers=1)
+        # the worker has no source cache and the url is not served: it only reads the handed over file
+        job = replace(_gif_job('http://127.0.0.1:9'), source_path=sources[0].path)
+        output = pool.submit(job).result(timeout=60)
+        assert output.downloaded_bytes == 0 and output.size > 0
+        os.remove(output.path)
+    finally:
+        for source in sources:
+            source.close()
+        cache.close()
+    assert sorted(os.listdir(tmp_path / 'sources')) == sorted(['index.sqlite3', *[
+        os.path.basename(entry.path) for entry in cache._entries.values()
+    ]])  # the links of the handed over sources are removed
+
+
+def test_worker_spans_are_handed_back_in_the_trace(media_host, pool_factory):
+    pool = pool_factory(max_workers=1)
+    job = replace(_gif_job(media_host), trace_id='a' * 32, parent_span_id='b' * 16)
+    output = pool.submit(job).result(timeout=60)
+    os.remove(output.path)
+    spans = {span.name: span for span in output.spans}
+    assert {'cut_worker', 'task', 'download', 'probe', 'encode'} <= set(spans)
+    assert {span.trace_id for span in output.spans} == {job.trace_id}
+    assert spans['cut_worker'].parent_id == job.parent_span_id
+    assert spans['task'].parent_id == spans['cut_worker'].span_id
@@ -0,0 +1,148 @@
+import os
+import re
+import shutil
+import subprocess
+import tracemalloc
+
+import pytest
+
+from src.execution.task import TaskConfig
+from src.handler.strategy import CutStrategy
+from src.handler.video import VideoCutHandler
+from src.model.cut_mode import CutMode, CutPolicy
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+from src.util import video_utilities
+from src.util.media_buffer import MediaBuffer
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+
+PROBE = video_utilities.VideoProbe(duration=30, keyframes=[0, 3, 6, 9], video_codec='h264', audio_codec='aac')
+
+
+def _decoded_frames(path: str) -> int:
+    proc = subprocess.run(['ffmpeg', '-i', path, '-map', '0:v', '-f', 'null', '-'],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return int(re.findall(r'frame=\s*(\d+)', proc.stderr.decode())[-1])
+
+
+@pytest.mark.parametrize('policy, start_ms, mode', [
+    (CutPolicy.SPEED, 4500, CutMode.COPY),
+    (CutPolicy.ACCURACY, 3000, CutMode.REENCODE),
+    (CutPolicy.BALANCED, 3100, CutMode.COPY),  # within the keyframe tolerance
+    (CutPolicy.BALANCED, 4500, CutMode.SMART),
+    (CutPolicy.BALANCED, 6500, CutMode.REENCODE),  # no keyframe within the range
+])
+def test_policy_chooses_mode(policy, start_ms, mode):
+    plan = CutStrategy(policy=policy, keyframe_tolerance_ms=250).plan(PROBE, start_ms=start_ms, end_ms=8000)
+    assert plan.mode == mode
+
+
+def test_plans_snap_to_keyframes():
+    strategy = CutStrategy()
+    copy = strategy.plan(PROBE, start_ms=4500, end_ms=8000, mode=CutMode.COPY)
+    assert (copy.start, copy.end) == (3, 8)
+    smart = strategy.plan(PROBE, start_ms=4500, end_ms=8000, mode=CutMode.SMART)
+    assert (smart.start, smart.keyframe, smart.end) == (4.5, 6, 8)
+    # a smart-cut without a keyframe in range is a re-encode
+    assert strategy.plan(PROBE, start_ms=6500, end_ms=8000, mode=CutMode.SMART).mode == CutMode.REENCODE
+
+
+def test_unsupported_codec_is_reencoded():
+    probe = video_utilities.VideoProbe(duration=30, keyframes=[0, 3, 6], video_codec='hevc', audio_codec=None)
+    assert CutStrategy().plan(probe, start_ms=1500, end_ms=5000).mode == CutMode.REENCODE
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('ext', ['mp4', 'mov', 'webm'])
+def test_probe(ext):
+    probe = video_utilities.probe_video(f'test_data/test.{ext}')
+    assert probe.duration > 30
+    assert probe.keyframes[0] == 0 and probe.keyframes == sorted(probe.keyframes)
+    assert probe.video_codec in ['h264', 'vp8'] and probe.audio_codec in ['aac', 'vorbis']
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('ext', ['mp4', 'mov', 'webm'])
+def test_modes_cut_the_requested_frames(ext, tmp_path):
+    strategy = CutStrategy()
+    path = f'test_data/test.{ext}'
+    probe = strategy.probe(path)
+    reference = None
+    for mode in [CutMode.REENCODE, CutMode.SMART, CutMode.COPY]:
+        plan = strategy.plan(probe, start_ms=15400, end_ms=19500, mode=mode)
+        out = strategy.cut(path, plan=plan, probe=probe, ext=ext)
+        output = tmp_path / f'{mode.name}.{ext}'
+        with out:
+            out.persist(str(output))
+        frames = _decoded_frames(str(output))
+        if mode == CutMode.REENCODE:
+            reference = frames
+        elif mode == CutMode.SMART:
+            assert abs(frames - reference) <= 3  # frame accurate up to B-frames past the end of the copied tail
+        else:
+            assert frames >= reference  # starts at the keyframe before the start
+
+
+@requires_ffmpeg
+def test_handler_cuts_in_memory_stream():
+    with open('test_data/test.webm', 'rb') as fp:
+        stream = MediaBuffer.from_bytes(fp.read())
+    config = TaskConfig(
+        message=None, media_type=MediaType.WEBM, start=2000, end=4000, watermark=None, state=TaskConfigState.VALID,
+        is_oembed=False, is_crosspost=False, media_url='https://example.com/test.webm', duration=None,
+        extension='webm', output_type=None, trace_id=None,
+    )
+    result = VideoCutHandler(strategy=CutStrategy(policy=CutPolicy.ACCURACY)).cut(stream, config)
+    assert result.media_type == MediaType.WEBM
+    assert result.media_stream.getbuffer().nbytes > 0
+
+
+@pytest.mark.parametrize('ext, needs_seekable_input', [('mp4', False), ('mov', True), ('webm', False)])
+def test_needs_seekable_input(ext, needs_seekable_input):
+    with open(f'test_data/test.{ext}', 'rb') as fp:
+        head = fp.read(64 * 1024)
+    if ext != 'webm':
+        assert video_utilities.needs_seekable_input(head[:8], ext=ext) is None
+    assert video_utilities.needs_seekable_input(head, ext=ext) == needs_seekable_input
+
+
+def _chunks(path: str, consumed: list):
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(64 * 1024), b''):
+            consumed.append(len(chunk))
+            yield chunk
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('ext', ['mp4', 'mov', 'webm'])
+@pytest.mark.parametrize('policy', [CutPolicy.SPEED, CutPolicy.ACCURACY])
+def test_cut_while_streaming(ext, policy, tmp_path):
+    path = f'test_data/test.{ext}'
+    config = TaskConfig(
+        message=None, media_type=MediaType[ext.upper()], start=2000, end=4000, watermark=None,
+        state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False, media_url=f'https://example.com/{path}',
+        duration=None, extension=ext, output_type=None, trace_id=None,
+    )
+    consumed = []
+    tracemalloc.start()
+    result = VideoCutHandler(strategy=CutStrategy(policy=policy)).cut_chunks(_chunks(path, consumed), config)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    output = tmp_path / f'cut.{ext}'
+    output.write_bytes(result.media_stream.getvalue())
+    assert _decoded_frames(str(output)) > 0
+    size = os.path.getsize(path)
+    if ext == 'mov':
+        assert sum(consumed) == size  # moov after mdat: spooled to a file
+    else:
+        assert sum(consumed) < size  # ffmpeg stopped reading after the end of the range
+    assert peak < size / 2
+
+
+@requires_ffmpeg
+def test_transcoded_gif_path_is_quoted(tmp_path):
+    path = tmp_path / "cut 'of' cat.gif"
+    shutil.copyfile('test_data/cat.gif', path)
+    with CutStrategy().transcode_gif(str(path), ext='mp4') as video:
+        assert b'ftyp' in video.read(64)
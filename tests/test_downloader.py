@@ -0,0 +1,158 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+
+from src.cache.result import ResultCache
+from src.client.download import MediaDownloader, capped_chunks, shared_session
+from src.execution.controller import AioController
+from src.execution.task import TaskConfigFactory
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+from src.util.exception import MediaTooLargeException
+
+BODY = bytes(range(256)) * 4096  # 1 MiB
+
+
+class FakeHost(object):
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.peers = set()
+        self.in_flight = self.max_in_flight = 0
+
+    async def media(self, request: web.Request) -> web.StreamResponse:
+        self.peers.add(request.transport.get_extra_info('peername'))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            response = web.StreamResponse()
+            if request.query.get('length') != 'unknown':
+                response.content_length = len(BODY)
+            await response.prepare(request)
+            for offset in range(0, len(BODY), 64 * 1024):
+                await response.write(BODY[offset:offset + 64 * 1024])
+            await response.write_eof()
+            return response
+        finally:
+            self.in_flight -= 1
+
+
+def _run(scenario, host: FakeHost, **kwargs):
+    async def main():
+        app = web.Application()
+        app.router.add_get('/media', host.media)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/media'
+        downloader = MediaDownloader(**kwargs)
+        try:
+            return await scenario(downloader, url)
+        finally:
+            await downloader.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_connections_are_reused_and_limited_per_host():
+    host = FakeHost(delay=0.05)
+
+    async def scenario(downloader, url):
+        for _ in range(3):
+            (await downloader.download(url)).close()
+        files = await asyncio.gather(*[downloader.download(url) for _ in range(6)])
+        return [fp.read() for fp in files]
+
+    bodies = _run(scenario, host, connections_per_host=2)
+    assert bodies == [BODY] * 6
+    assert len(host.peers) == 2  # sequential downloads reuse one connection, concurrent ones open a second
+    assert host.max_in_flight == 2
+
+
+@pytest.mark.parametrize('query', ['', '?length=unknown'])
+def test_oversized_download_is_aborted(query):
+    host = FakeHost()
+
+    async def scenario(downloader, url):
+        await downloader.download(url + query)
+
+    with pytest.raises(MediaTooLargeException) as err:
+        _run(scenario, host, max_bytes=256 * 1024)
+    if not query:
+        assert f'Media of {len(BODY)} bytes' in str(err.value)  # aborted on the announced size before reading the body
+
+
+def test_large_downloads_are_spooled_to_disk(tmp_path):
+    host = FakeHost()
+
+    async def scenario(downloader, url):
+        small = await downloader.download(url)
+        downloader.spool_bytes = len(BODY) // 2
+        large = await downloader.download(url)
+        return small._rolled, large._rolled, large.read()
+
+    small_rolled, large_rolled, content = _run(scenario, host, spool_bytes=2 * len(BODY), spool_dir=str(tmp_path))
+    assert (small_rolled, large_rolled) == (False, True)
+    assert content == BODY
+
+
+def test_blocking_downloads_are_capped():
+    host = FakeHost()
+
+    async def scenario(downloader, url):
+        def read():
+            with shared_session().get(url + '?length=unknown', stream=True) as response:
+                return b''.join(capped_chunks(response, max_bytes=256 * 1024))
+
+        await asyncio.get_running_loop().run_in_executor(None, read)
+
+    with pytest.raises(MediaTooLargeException):
+        _run(scenario, host)
+
+
+def test_oembed_page_is_fetched_by_the_caller():
+    html = '<iframe src="https://gfycat.com/ifr?src=https%3A%2F%2Fgfycat.com%2Fabc"></iframe>'
+    submission = SimpleNamespace(is_video=False, url='https://gfycat.com/abc', media={'oembed': {'html': html}})
+    message = SimpleNamespace(submission=submission, body='start=1000 end=2000')
+    assert TaskConfigFactory.oembed_page_url(message) == 'https://gfycat.com/abc'
+    # without the page the media source cannot be resolved
+    assert TaskConfigFactory.from_message(message).is_state(TaskConfigState.INVALID)
+    page = b'<video><source src="https://a.gfycat.com/abc.webm" type="video/webm">' \
+           b'<source src="https://a.gfycat.com/abc.mp4" type="video/mp4"></video>'
+    config = TaskConfigFactory.from_message(message, oembed_page=page)
+    assert config.is_state(TaskConfigState.VALID)
+    assert (config.media_url, config.media_type) == ('https://a.gfycat.com/abc.mp4', MediaType.MP4)
+
+
+def _unreachable_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}/page'  # nothing listens on the port once the socket is closed
+
+
+def test_unreachable_oembed_page_makes_the_request_invalid(tmp_path):
+    html = '<iframe src="https://gfycat.com/ifr?src=' + _unreachable_url().replace(':', '%3A').replace('/', '%2F') + \
+           '"></iframe>'
+    submission = SimpleNamespace(is_video=False, url='https://gfycat.com/abc', media={'oembed': {'html': html}})
+    message = SimpleNamespace(submission=submission, body='start=1000 end=2000', fullname='t1_a')
+
+    async def scenario():
+        controller = AioController(
+            input_queue=asyncio.Queue(), output_queue=asyncio.Queue(),
+            result_cache=ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10),
+        )
+        controller.downloader = MediaDownloader()
+        try:
+            return controller, await controller._reddit_message_to_input_queue(message)
+        finally:
+            await controller.downloader.close()
+
+    controller, handed_over = asyncio.run(scenario())
+    # the page is treated as missing: the message is marked read with the next fetch instead of failing every time
+    assert not handed_over and controller._answered == [message] and controller.input_queue.empty()
@@ -0,0 +1,74 @@
+import io
+
+import pytest
+from PIL import Image
+
+from src.util import gif_utilities
+
+GIF_PATH = 'test_data/cat.gif'
+
+
+@pytest.fixture(scope='module')
+def gif_bytes():
+    with open(GIF_PATH, 'rb') as f:
+        yield f.read()
+
+
+def _seek_loop_duration(image: Image.Image) -> float:
+    # the frame decoding probe that was replaced by the block scanner
+    image.seek(0)
+    total_duration_milliseconds = 0
+    while True:
+        try:
+            total_duration_milliseconds += image.info['duration']
+            image.seek(image.tell() + 1)
+        except EOFError:
+            return total_duration_milliseconds / 1000
+
+
+def test_scan_matches_pillow(gif_bytes):
+    scan = gif_utilities.scan_gif(gif_bytes)
+    image = Image.open(GIF_PATH)
+    assert len(scan.frames) == image.n_frames
+    assert (scan.width, scan.height) == image.size
+    for frame in scan.frames:
+        image.seek(frame.index)
+        assert frame.delay == image.info['duration']
+        assert frame.disposal == image.disposal_method
+    assert scan.duration == _seek_loop_duration(image)
+
+
+def test_scan_offsets_are_contiguous(gif_bytes):
+    scan = gif_utilities.scan_gif(gif_bytes)
+    assert scan.frames[0].offset == scan.header_end
+    for previous, current in zip(scan.frames, scan.frames[1:]):
+        assert previous.end == current.offset
+        assert current.timestamp == previous.timestamp + previous.delay
+    assert gif_bytes[scan.frames[-1].end] == gif_utilities.TRAILER
+
+
+@pytest.mark.parametrize('start, end', [(0, 250), (350, 450), (1250, 934823)])
+def test_frame_range(gif_bytes, start, end):
+    scan = gif_utilities.scan_gif(gif_bytes)
+    first, last = scan.frame_range(start, end)
+    assert first <= last
+    assert scan.frames[first].timestamp <= start < scan.frames[first].timestamp + scan.frames[first].delay
+    assert scan.frames[last].timestamp < min(end, scan.duration_ms)
+
+
+def test_scan_rejects_non_gif():
+    with pytest.raises(ValueError):
+        gif_utilities.scan_gif(b'\x00' * 32)
+
+
+def test_splice_copies_compressed_frames(gif_bytes):
+    scan = gif_utilities.scan_gif(gif_bytes)
+    output = io.BytesIO()
+    gif_utilities.splice_gif(gif_bytes, scan=scan, first_frame=0, last_frame=9, output=output)
+    spliced = output.getvalue()
+    assert gif_bytes[scan.header_end:scan.frames[9].end] in spliced  # verbatim, including the loop extension
+    assert spliced.endswith(bytes([gif_utilities.TRAILER]))
+    assert gif_utilities.scan_gif(spliced).delays == scan.delays[:10]
+    assert gif_utilities.needs_key_frame(scan, first_frame=10)
+    with pytest.raises(ValueError):
+        gif_utilities.splice_gif(gif_bytes, scan=scan, first_frame=10, last_frame=12, output=io.BytesIO())
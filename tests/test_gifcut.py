@@ -1,35 +1,173 @@
+import shutil
+import subprocess
+
+import PIL.GifImagePlugin
 import pytest as pytest
-from PIL import Image
+from PIL import Image, ImageChops
 
 # from src.gif_utilities import cut_gif as cut_gif_func
-from src.handler.gif import GifCutHandler
+from src.execution.task import TaskConfig
+from src.handler.gif import GifCutHandler, _palette_loading
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+from src.util.aux import Watermark
+from src.util import gif_utilities
+from src.util.gif_utilities import get_gif_duration, scan_gif
+from src.util.media_buffer import MediaBuffer
 
 gif_handler = GifCutHandler()
 
 
 @pytest.fixture(params=[(0, 250), (350, 450), (1250, 934823)])
 def yield_params(request):
-    params = {
-        'img': Image.open('test_data/cat.gif'),
-        'start': request.param[0],
-        'end': request.param[1]
-    }
+    with open('test_data/cat.gif', 'rb') as fp:
+        params = {
+            'stream': MediaBuffer.from_bytes(fp.read()),
+            'start': request.param[0],
+            'end': request.param[1]
+        }
     yield params
+    params['stream'].close()
 
 
 def test_cutgif_length(yield_params):
-    assert True  # todo gif cut tests
-    # gif_handler.cut()
-    # cut_gif, target_duration = cut_gif_func(**yield_params)
-    # with NamedTemporaryFile(mode='w+b', suffix='.gif') as gif:
-    #     cut_gif[0].save(
-    #         gif,
-    #         save_all=True,
-    #         append_images=cut_gif[1:],
-    #         optimize=False,
-    #         duration=target_duration,
-    #         loop=0
-    #     )
-    #     # test that there is no more deviation than 5ms per frame
-    #     cut_gif_duration = target_duration * len(cut_gif)
-    #     assert 0 <= abs(cut_gif_duration - get_gif_duration(image=Image.open(gif))) <= (5 * len(cut_gif))
+    scan = scan_gif(yield_params['stream'])
+    start, end = yield_params['start'], min(yield_params['end'], scan.duration_ms)
+    config = _config(start=start, end=yield_params['end'])
+    with gif_handler.cut(yield_params['stream'], config).media_stream as cut:
+        cut_duration_ms = get_gif_duration(cut) * 1000
+    # the cut holds all frames displayed within [start, end), so it overshoots the range by less than two frames
+    assert end - start <= cut_duration_ms < end - start + 2 * max(scan.delays)
+
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+
+
+@pytest.fixture(scope='module')
+def palette_gif(tmp_path_factory):
+    """A GIF with one palette and transparent index for all frames, as encoded by ffmpeg's palettegen/paletteuse."""
+    path = str(tmp_path_factory.mktemp('gif') / 'palette.gif')
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-t', '4', '-i', 'test_data/test.mp4', '-vf',
+         'fps=12,scale=360:-1,split[a][b];[a]palettegen[p];[b][p]paletteuse', path],
+        check=True,
+    )
+    return path
+
+
+def _config(watermark=None, start: int = 500, end: int = 2500, output_type=None) -> TaskConfig:
+    return TaskConfig(
+        message=None, media_type=MediaType.GIF, start=start, end=end, watermark=watermark, state=TaskConfigState.VALID,
+        is_oembed=False, is_crosspost=False, media_url='https://i.imgur.com/cut.gif', duration=None, extension='gif',
+        output_type=output_type, trace_id=None,
+    )
+
+
+def _cut(path: str, watermark=None, start: int = 500, end: int = 2500, **options) -> MediaBuffer:
+    with open(path, 'rb') as fp:
+        stream = MediaBuffer.from_bytes(fp.read())
+    return GifCutHandler(**options).cut(stream, _config(watermark, start=start, end=end)).media_stream
+
+
+def _frames(fp, first: int = 0):
+    # the composited frames as they are displayed on a black background, loaded like the frames of a cut
+    with _palette_loading():
+        image = Image.open(fp)
+        for index in range(first, image.n_frames):
+            image.seek(index)
+            yield Image.alpha_composite(Image.new('RGBA', image.size, 'black'), image.convert('RGBA')).convert('RGB')
+
+
+@requires_ffmpeg
+def test_palette_path_keeps_frames_lossless(palette_gif):
+    # its costs compared with the RGB path are benchmarked in tests/benchmark.py
+    with open(palette_gif, 'rb') as fp:
+        first, _ = scan_gif(fp).frame_range(500, 2500)
+    with _cut(palette_gif, splice=False) as cut:
+        frames = list(_frames(cut))
+        assert len(frames) > 1
+        for frame, source_frame in zip(frames, _frames(palette_gif, first=first)):
+            assert ImageChops.difference(frame, source_frame).getbbox() is None  # not re-quantized
+
+
+@requires_ffmpeg
+def test_palette_loading_strategy_is_restored_after_the_cut(palette_gif):
+    # the loading strategy is a Pillow global of the process, which only the frame loading of a cut changes
+    default = PIL.GifImagePlugin.LoadingStrategy.RGB_AFTER_FIRST
+    assert PIL.GifImagePlugin.LOADING_STRATEGY == default  # not changed by importing the handler
+    with _cut(palette_gif, splice=False, preserve_palette=True) as cut:
+        assert Image.open(cut).getpalette() == Image.open(palette_gif).getpalette()  # loaded in `P` mode
+    assert PIL.GifImagePlugin.LOADING_STRATEGY == default
+
+
+def test_unstable_transparency_is_requantized():
+    # the frames of cat.gif use different transparent indices: composited in `P` mode, pixels of the first frame's
+    # transparent index could not be told apart from transparent ones
+    with open('test_data/cat.gif', 'rb') as fp:
+        assert not GifCutHandler._has_stable_transparency(scan_gif(fp), last_frame=10)
+    with _cut('test_data/cat.gif', splice=False) as cut:
+        assert len(list(_frames(cut))) > 1
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('in_palette', [True, False])
+def test_watermark(palette_gif, in_palette):
+    palette = Image.open(palette_gif).getpalette()
+    colors = set(zip(palette[0::3], palette[1::3], palette[2::3]))
+    color = max(colors, key=sum) if in_palette else next(c for c in [(1, 2, 3), (3, 2, 1)] if c not in colors)
+    with _cut(palette_gif, splice=False) as plain, \
+            _cut(palette_gif, watermark=Watermark('cut', (0, 0), color)) as watermarked:
+        # drawn in palette space the palette is kept, otherwise the frames are re-quantized including the new color
+        assert (Image.open(watermarked).getpalette() == Image.open(plain).getpalette()) == in_palette
+        if in_palette:
+            for plain_frame, watermarked_frame in zip(_frames(plain), _frames(watermarked)):
+                box = ImageChops.difference(plain_frame, watermarked_frame).getbbox()
+                assert box is not None and box[2] < 30 and box[3] < 20  # only the text differs
+
+
+@pytest.mark.parametrize('start, end', [(0, 1000), (500, 2500), (1250, 934823)])
+def test_splice_matches_source_frames(start, end):
+    with open('test_data/cat.gif', 'rb') as fp:
+        scan = scan_gif(fp)
+    first, last = scan.frame_range(start, min(end, scan.duration_ms))
+    with _cut('test_data/cat.gif', start=start, end=end) as spliced:
+        spliced_scan = scan_gif(spliced)
+        assert spliced_scan.delays == scan.delays[first:last + 1]  # the original delays of all frames
+        frames = list(_frames(spliced))
+        for index, (frame, source_frame) in enumerate(zip(frames, _frames('test_data/cat.gif', first=first))):
+            box = ImageChops.difference(frame, source_frame).getbbox()
+            assert box is None, f'frame {index} differs in {box}'
+    assert len(frames) == last - first + 1
+
+
+@requires_ffmpeg
+def test_splice_copies_compressed_frames(palette_gif):
+    # its costs compared with re-encoding are benchmarked in tests/benchmark.py
+    with open(palette_gif, 'rb') as fp:
+        source = fp.read()
+    scan = scan_gif(source)
+    first, last = scan.frame_range(500, 2500)
+    with _cut(palette_gif) as spliced:
+        output = bytes(spliced.getbuffer())
+    spliced_scan = scan_gif(output)
+    assert output[:scan.header_end] == source[:scan.header_end]  # the header and the global palette
+    assert len(spliced_scan.frames) == last - first + 1
+    # only a key frame (if the first frame builds on earlier ones) is encoded, all other frames are copied verbatim
+    key_frames = 1 if gif_utilities.needs_key_frame(scan, first) else 0
+    for frame, source_frame in zip(spliced_scan.frames[key_frames:], scan.frames[first + key_frames:]):
+        assert output[frame.offset:frame.end] == source[source_frame.offset:source_frame.end]
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('output_type', [MediaType.MP4, MediaType.WEBM])
+def test_transcoded_cut_is_smaller(output_type):
+    with open('test_data/cat.gif', 'rb') as fp:
+        stream = MediaBuffer.from_bytes(fp.read())
+    with _cut('test_data/cat.gif', start=0, end=3000) as gif:
+        gif_size = gif.size
+    result = GifCutHandler().cut(stream, _config(start=0, end=3000, output_type=output_type))
+    with result.media_stream as video:
+        assert result.media_type == output_type
+        assert 0 < video.size < gif_size
+        header = video.read(64)
+    assert (b'ftyp' in header) if output_type == MediaType.MP4 else header.startswith(b'\x1a\x45\xdf\xa3')
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import io
+import time
+import tracemalloc
+
+import pytest
+from aiohttp import web
+
+from src.client.imgur import ImgurClient
+from src.util.exception import UploadFailureException
+
+
+class FakeImgur(object):
+    """An imgur upload endpoint that answers with the given statuses (200 once they are used up)."""
+
+    def __init__(self, statuses=(), delay: float = 0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = self.max_in_flight = 0
+
+    async def upload(self, request: web.Request) -> web.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # the media is hashed while it is received so that the server does not add to the client's memory peak
+            media = hashlib.sha256()
+            async for part in await request.multipart():
+                if part.name in ['image', 'video']:
+                    while chunk := await part.read_chunk():
+                        media.update(chunk)
+            self.requests.append(media.hexdigest())
+            await asyncio.sleep(self.delay)
+            status = self.statuses.pop(0) if self.statuses else 200
+            data = {'link': f'https://i.imgur.com/{len(self.requests)}.mp4'} if status == 200 else {'error': 'nope'}
+            return web.json_response({'data': data, 'success': status == 200, 'status': status}, status=status)
+        finally:
+            self.in_flight -= 1
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _run(scenario, imgur: FakeImgur, **kwargs):
+    async def main():
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/3/upload', imgur.upload)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = ImgurClient('id', api_url=f'http://127.0.0.1:{port}/3', backoff_seconds=0.01, **kwargs)
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_upload_streams_video_from_buffer():
+    imgur = FakeImgur()
+    video = io.BytesIO(b'\x00' * (8 * 1024 * 1024))
+
+    async def scenario(client):
+        return await client.upload({'type': 'file', 'disable_audio': '0', 'video': video})
+
+    assert _run(scenario, imgur)['link'] == 'https://i.imgur.com/1.mp4'
+    assert imgur.requests == [_digest(video.getvalue())]
+
+
+def test_uploads_run_in_parallel_up_to_the_limit():
+    imgur = FakeImgur(delay=0.2)
+
+    async def scenario(client):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.ensure_future(ticker())
+        t0 = time.perf_counter()
+        await asyncio.gather(*[client.upload({'type': 'file', 'video': io.BytesIO(b'mp4')}) for _ in range(4)])
+        elapsed = time.perf_counter() - t0
+        ticking.cancel()
+        return elapsed, ticks
+
+    elapsed, ticks = _run(scenario, imgur, max_concurrency=2)
+    assert imgur.max_in_flight == 2
+    assert elapsed >= 0.4  # at least 2 rounds: no more than 2 uploads at once
+    assert ticks > 20  # the event loop is not blocked by the uploads
+
+
+def test_transient_failures_are_retried():
+    imgur = FakeImgur(statuses=[503, 429])
+
+    async def scenario(client):
+        return await client.upload({'type': 'file', 'video': io.BytesIO(b'mp4')})
+
+    assert _run(scenario, imgur)['link'] == 'https://i.imgur.com/3.mp4'
+    assert imgur.requests == [_digest(b'mp4')] * 3  # the body is sent in full on every attempt
+
+
+@pytest.mark.parametrize('statuses, attempts', [([400], 1), ([503] * 4, 3)])
+def test_failed_upload_raises(statuses, attempts):
+    imgur = FakeImgur(statuses=statuses)
+
+    async def scenario(client):
+        await client.upload({'type': 'file', 'video': io.BytesIO(b'mp4')})
+
+    with pytest.raises(UploadFailureException):
+        _run(scenario, imgur, max_retries=2)
+    assert len(imgur.requests) == attempts
+
+
+def test_gif_is_uploaded_as_binary_without_copies():
+    imgur = FakeImgur()
+    gif = io.BytesIO(b'GIF89a' + b'\x00' * (9 * 1024 * 1024))
+    size = gif.getbuffer().nbytes
+
+    async def scenario(client):
+        tracemalloc.start()
+        try:
+            return await client.upload_with_stats({'image': gif, 'type': 'file'}, anon=True)
+        finally:
+            tracemalloc.stop()
+
+    _, stats = _run(scenario, imgur)
+    assert imgur.requests == [_digest(gif.getvalue())]
+    assert stats.payload_bytes == size
+    assert size < stats.bytes_sent < size + 1024  # only the multipart framing, no base64 inflation
+    assert stats.peak_memory < size / 8  # neither a copy of the buffer nor of its unsent remainder
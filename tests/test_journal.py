@@ -0,0 +1,181 @@
+import asyncio
+import os
+import sqlite3
+import time
+import types
+
+import pytest
+
+from src.cache.result import ResultCache
+from src.execution import task as t
+from src.execution.controller import AioController
+from src.execution.journal import TaskJournal
+from src.model.media_type import MediaType
+from src.model.result import Result
+from src.model.task_stage import TaskStage
+from src.model.task_state import TaskConfigState
+from src.util import config
+from src.util.exception import UploadFailureException
+from src.util.media_buffer import MediaBuffer
+
+
+def _message(name: str):
+    return types.SimpleNamespace(fullname=name, id=name[3:])
+
+
+@pytest.fixture()
+def controller_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CUT_WORKERS', 0)  # cut in threads of the test process
+
+    def from_message(message, oembed_page=None, gif_output_type=None, trace_id=None):
+        return t.TaskConfig(
+            message=message, media_type=MediaType.GIF, start=0, end=2000, watermark=None,
+            state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False,
+            media_url=f'https://i.redd.it/{message.id}.gif', duration=None, extension='gif', output_type=None,
+            trace_id=trace_id,
+        )
+
+    monkeypatch.setattr(t.TaskConfigFactory, 'oembed_page_url', classmethod(lambda cls, message: None))
+    monkeypatch.setattr(t.TaskConfigFactory, 'from_message', staticmethod(from_message))
+
+    def create(upload_fails: bool = False):
+        controller = AioController(
+            input_queue=asyncio.Queue(), output_queue=asyncio.Queue(),
+            result_cache=ResultCache(directory=str(tmp_path / 'results'), max_bytes=10 ** 6, max_entries=10),
+            journal=TaskJournal(directory=str(tmp_path / 'journal')),
+        )
+        controller.imgur = controller.reddit = object()
+        controller.cuts, controller.uploads, controller.replies = [], [], []
+
+        def exert_task(task):
+            controller.cuts.append(task.config.message.fullname)
+            return Result(MediaBuffer.from_bytes(b'GIF89a'), media_type=MediaType.GIF, message=task.config.message,
+                          cache_key='key-' + task.config.message.fullname, trace_id=task.trace_id)
+
+        async def upload_to_imgur(result):
+            controller.uploads.append(result.media_stream.getvalue())
+            if upload_fails:
+                raise UploadFailureException('imgur is down')
+            return f'https://i.imgur.com/{result.message.id}.gif'
+
+        async def answer_in_reddit(message, upload_link):
+            controller.replies.append((message.fullname, upload_link))
+
+        controller._exert_task = exert_task
+        controller._upload_to_imgur = upload_to_imgur
+        controller._answer_in_reddit = answer_in_reddit
+        return controller
+
+    return create
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+async def _process(controller, *messages, upload: bool = True):
+    for message in messages:
+        assert await controller._reddit_message_to_input_queue(message)
+    while not controller.input_queue.empty():
+        await controller.work()
+    while upload and not controller.output_queue.empty():
+        await controller.upload_and_answer()
+
+
+def test_journal_records_stages_in_wal_mode(tmp_path):
+    journal = TaskJournal(directory=str(tmp_path))
+    assert journal.journal_mode == 'wal'
+    journal.ingest('t1_a', trace_id='trace', cache_key='key')
+    journal.advance('t1_a', TaskStage.CUT, media_type=MediaType.MP4, artifact_path='cut.mp4')
+    journal.ingest('t1_a', trace_id='other')  # a requeued message does not start over
+    journal.advance('t1_a', TaskStage.DOWNLOADED)  # nor does it move back
+    journal.close()
+
+    journal = TaskJournal(directory=str(tmp_path))
+    entry = journal.get('t1_a')
+    assert (entry.stage, entry.trace_id, entry.cache_key) == (TaskStage.CUT, 'trace', 'key')
+    assert (entry.media_type, entry.artifact_path) == (MediaType.MP4, 'cut.mp4')
+    with pytest.raises(ValueError):
+        journal.advance('t1_a', TaskStage.UPLOADED, link='https://i.imgur.com/a.gif')
+
+
+def test_expired_entries_are_pruned_with_their_artifacts(tmp_path):
+    journal = TaskJournal(directory=str(tmp_path), retention_seconds=60)
+    artifact = journal.artifact_path('t1_a', MediaType.GIF)
+    with open(artifact, mode='wb') as fp:
+        fp.write(b'GIF89a')
+    journal.ingest('t1_a')
+    journal.advance('t1_a', TaskStage.CUT, artifact_path=artifact)
+    journal.ingest('t1_b')
+    journal.close()
+    db = sqlite3.connect(os.path.join(str(tmp_path), 'journal.sqlite3'))
+    db.execute('UPDATE tasks SET updated = ? WHERE message_id = ?', (time.time() - 120, 't1_a'))
+    db.commit()
+    db.close()
+
+    journal = TaskJournal(directory=str(tmp_path), retention_seconds=60)
+    assert journal.get('t1_a') is None and not os.path.exists(artifact)
+    assert [entry.message_id for entry in journal.pending()] == ['t1_b']
+
+
+def test_requests_are_answered_once(controller_factory):
+    async def scenario():
+        controller = controller_factory()
+        await _process(controller, _message('t1_a'))
+        # the message is fetched again (e.g. its read mark was lost)
+        await _process(controller, _message('t1_a'))
+        return controller
+
+    controller = _run(scenario())
+    assert controller.cuts == ['t1_a'] and controller.replies == [('t1_a', 'https://i.imgur.com/a.gif')]
+    entry = controller.journal.get('t1_a')
+    assert entry.stage == TaskStage.REPLIED and entry.upload_link == 'https://i.imgur.com/a.gif'
+    assert [m.fullname for m in controller._answered] == ['t1_a', 't1_a']  # both are marked read
+    assert os.listdir(os.path.dirname(controller.journal.artifact_path('t1_a', MediaType.GIF))) == []
+
+
+def test_restart_resumes_after_the_last_stage(controller_factory):
+    async def crash_after_cut():
+        controller = controller_factory()
+        await _process(controller, _message('t1_a'), upload=False)
+        controller.journal.close()
+
+    async def crash_after_upload():
+        controller = controller_factory()
+        await _process(controller, _message('t1_b'))
+        # the process crashed before the reply of t1_b was recorded
+        controller.journal._db.execute('UPDATE tasks SET stage = ? WHERE message_id = ?',
+                                       (TaskStage.UPLOADED.value, 't1_b'))
+        controller.journal._db.commit()
+        controller.journal.close()
+
+    async def restart():
+        controller = controller_factory()
+        await _process(controller, _message('t1_a'), _message('t1_b'))
+        return controller
+
+    _run(crash_after_cut())
+    _run(crash_after_upload())
+    controller = _run(restart())
+    assert controller.cuts == []  # neither is cut again
+    assert controller.uploads == [b'GIF89a']  # the kept cut of t1_a is uploaded, t1_b only needs its reply
+    assert controller.replies == [('t1_a', 'https://i.imgur.com/a.gif'), ('t1_b', 'https://i.imgur.com/b.gif')]
+    assert all(controller.journal.get(name).stage == TaskStage.REPLIED for name in ('t1_a', 't1_b'))
+
+
+def test_failed_requests_are_not_repeated(controller_factory):
+    async def scenario():
+        controller = controller_factory(upload_fails=True)
+        await _process(controller, _message('t1_a'))
+        await _process(controller, _message('t1_a'))
+        return controller
+
+    controller = _run(scenario())
+    assert controller.cuts == ['t1_a'] and controller.replies == []
+    assert controller.journal.get('t1_a').stage == TaskStage.FAILED
@@ -0,0 +1,75 @@
+import io
+import os
+import tracemalloc
+
+from src.util.media_buffer import MediaBuffer
+
+MEDIA = bytes(range(256)) * 4096  # 1 MiB
+
+
+def test_small_media_stays_in_memory():
+    with MediaBuffer.from_bytes(b'GIF89a', max_memory_bytes=1024) as buffer:
+        assert buffer.in_memory and buffer.name is None
+        assert buffer.read() == b'GIF89a'
+        with buffer.getbuffer() as view:
+            assert view.nbytes == buffer.size == 6
+
+
+def test_large_media_is_spilled_and_removed_on_close(tmp_path):
+    buffer = MediaBuffer.from_chunks([MEDIA[:512 * 1024], MEDIA[512 * 1024:]], max_memory_bytes=256 * 1024,
+                                     spool_dir=str(tmp_path), suffix='.mp4')
+    assert not buffer.in_memory and buffer.name.endswith('.mp4')
+    assert os.path.dirname(buffer.path) == str(tmp_path)
+    assert (buffer.tell(), buffer.size) == (0, len(MEDIA))
+    with buffer.getbuffer() as view:
+        assert view[:] == MEDIA  # memory map of the file
+    buffer.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_path_spills_in_memory_media(tmp_path):
+    with MediaBuffer.from_bytes(MEDIA, spool_dir=str(tmp_path)) as buffer:
+        assert buffer.in_memory
+        with open(buffer.path, 'rb') as fp:
+            assert fp.read() == MEDIA
+        assert buffer.read() == MEDIA  # the position survives the spill
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_persist_moves_the_file(tmp_path):
+    buffer = MediaBuffer.on_disk(spool_dir=str(tmp_path))
+    buffer.write(MEDIA)
+    spooled = buffer.path
+    buffer.persist(str(tmp_path / 'cut.mp4'))
+    assert buffer.closed and not os.path.exists(spooled)
+    assert (tmp_path / 'cut.mp4').read_bytes() == MEDIA
+
+
+def test_adopted_files_are_kept_unless_owned(tmp_path):
+    path = tmp_path / 'source.mp4'
+    path.write_bytes(MEDIA)
+    with MediaBuffer.from_path(str(path), owned=False) as buffer:
+        assert buffer.read(4) == MEDIA[:4]
+    assert path.exists()
+    with MediaBuffer.from_path(str(path)) as buffer:
+        assert buffer.size == len(MEDIA)
+    assert not path.exists()
+
+
+def test_views_do_not_copy_the_media(tmp_path):
+    def peak_of(read):
+        tracemalloc.start()
+        try:
+            read()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    copied = io.BytesIO(MEDIA * 4)
+    spilled = MediaBuffer.from_bytes(MEDIA * 4, max_memory_bytes=0, spool_dir=str(tmp_path))
+    try:
+        copy_peak = peak_of(lambda: copied.getvalue()[1:])
+        view_peak = peak_of(lambda: spilled.getbuffer()[1:].release())
+    finally:
+        spilled.close()
+    assert view_peak < len(MEDIA) / 64 < copy_peak
@@ -0,0 +1,69 @@
+import asyncio
+
+import aiohttp
+
+from src.util import metrics
+from src.util.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+def test_render_names_counters_and_escapes_labels():
+    registry = Registry()
+    failures = Counter('bot_failures', 'Failures by stage.', ['stage'], registry=registry)
+    failures.labels('upload').inc()
+    failures.labels('up"load\n').inc(2)
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP bot_failures_total Failures by stage.', '# TYPE bot_failures_total counter']
+    assert 'bot_failures_total{stage="upload"} 1' in lines
+    assert 'bot_failures_total{stage="up\\"load\\n"} 2' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram('bot_latency_seconds', 'Latency.', buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+    samples = [line for line in registry.render().splitlines() if not line.startswith('#')]
+    assert samples == [
+        'bot_latency_seconds_bucket{le="0.1"} 2',
+        'bot_latency_seconds_bucket{le="1"} 3',
+        'bot_latency_seconds_bucket{le="+Inf"} 4',
+        'bot_latency_seconds_sum 3.65',
+        'bot_latency_seconds_count 4',
+    ]
+
+
+def test_queue_depth_is_read_when_scraped():
+    registry = Registry()
+    depth = Gauge('bot_queue_depth', 'Queue depth.', ['queue'], registry=registry)
+    queue = asyncio.Queue()
+    depth.labels('input').set_function(queue.qsize)
+    queue.put_nowait('task')
+    queue.put_nowait('task')
+    assert 'bot_queue_depth{queue="input"} 2' in registry.render().splitlines()
+
+
+def test_failures_to_record_are_not_raised():
+    @metrics.guarded
+    def record(result):
+        metrics.OUTPUT_BYTES.labels('gif').observe(result.media_stream.size)
+
+    record(None)  # logged instead of failing the stage
+
+
+def test_server_serves_the_metrics():
+    registry = Registry()
+    Counter('bot_messages', 'Messages.', registry=registry).inc(3)
+
+    async def scrape():
+        server = MetricsServer(port=0, registry=registry)
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{server.port}/metrics') as response:
+                    return response.status, response.headers['Content-Type'], await response.text()
+        finally:
+            await server.close()
+
+    status, content_type, text = asyncio.run(scrape())
+    assert status == 200 and content_type.startswith('text/plain; version=0.0.4')
+    assert 'bot_messages_total 3' in text.splitlines()
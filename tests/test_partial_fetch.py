@@ -0,0 +1,133 @@
+import functools
+import http.server
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+from src.client.media import PartialMediaFetcher
+from src.util import mp4_utilities
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files with support for single `Range: bytes=a-b` requests."""
+    served_bytes = 0
+    ranges_supported = True
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None or not RangeHandler.ranges_supported:
+            self.send_response(200)
+            body = data
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+            RangeHandler.served_bytes += len(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client closed the connection without reading the body
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def media_host(tmp_path):
+    RangeHandler.served_bytes = 0
+    RangeHandler.ranges_supported = True
+    for name in ['test.mp4', 'test.mov']:
+        shutil.copy(os.path.join('test_data', name), tmp_path / name)
+    if shutil.which('ffmpeg') is not None:
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-y', '-i', 'test_data/test.mp4', '-c', 'copy', '-movflags',
+             'frag_keyframe+empty_moov+default_base_moof+global_sidx', str(tmp_path / 'fragmented.mp4')],
+            check=True,
+        )
+    handler = functools.partial(RangeHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _decoded_frames(path: str, start: float, duration: float) -> int:
+    proc = subprocess.run(
+        ['ffmpeg', '-seek_timestamp', '1', '-ss', str(start), '-i', path, '-t', str(duration), '-map', '0:v',
+         '-f', 'null', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+    )
+    return int(re.findall(r'frame=\s*(\d+)', proc.stderr.decode())[-1])
+
+
+@pytest.mark.parametrize('name', ['test.mp4', 'test.mov'])
+def test_sample_tables(name):
+    with open(os.path.join('test_data', name), 'rb') as fp:
+        data = fp.read()
+    moov = next(box for box in mp4_utilities.iter_boxes(data) if box.type == 'moov')
+    tracks = mp4_utilities.parse_tracks(data[moov.offset:moov.end], base_offset=moov.offset)
+    assert {track.handler for track in tracks} == {'vide', 'soun'}
+    video = next(track for track in tracks if track.handler == 'vide')
+    assert len(video.times) == 901 and video.sync_samples[0] == 0
+    keyframe = video.sync_index_at(10)
+    assert keyframe in video.sync_samples and video.time_of(keyframe) <= 10
+    ranges = mp4_utilities.sample_byte_ranges(tracks, start=10, end=12)
+    assert sum(end - start for start, end in ranges) < len(data) / 2
+
+
+@pytest.mark.parametrize('name', ['test.mp4', 'test.mov'])
+def test_progressive_partial_fetch(media_host, name):
+    fetcher = PartialMediaFetcher()
+    total = os.path.getsize(os.path.join('test_data', name))
+    partial = fetcher.fetch(f'{media_host}/{name}', start_ms=20000, end_ms=22000, suffix=os.path.splitext(name)[1])
+    assert partial is not None
+    assert RangeHandler.served_bytes < total / 2
+    if shutil.which('ffmpeg') is not None:
+        expected = _decoded_frames(os.path.join('test_data', name), start=20, duration=2)
+        assert _decoded_frames(partial.name, start=20, duration=2) == expected
+    partial.close()
+    assert not os.path.exists(partial.name)
+
+
+@requires_ffmpeg
+def test_fragmented_partial_fetch(media_host, tmp_path):
+    fetcher = PartialMediaFetcher()
+    total = os.path.getsize(tmp_path / 'fragmented.mp4')
+    partial = fetcher.fetch(f'{media_host}/fragmented.mp4', start_ms=20000, end_ms=22000, suffix='.mp4')
+    assert partial is not None
+    assert RangeHandler.served_bytes < total / 2
+    assert _decoded_frames(partial.name, start=20, duration=2) == _decoded_frames(
+        str(tmp_path / 'fragmented.mp4'), start=20, duration=2
+    )
+    partial.close()
+
+
+def test_falls_back_without_range_support(media_host):
+    RangeHandler.ranges_supported = False
+    assert PartialMediaFetcher().fetch(f'{media_host}/test.mp4', start_ms=0, end_ms=1000) is None
+
+
+def test_is_worthwhile():
+    fetcher = PartialMediaFetcher(min_duration=30, max_ratio=0.5)
+    assert fetcher.is_worthwhile(duration=900, start_ms=60000, end_ms=62000)
+    assert not fetcher.is_worthwhile(duration=10, start_ms=0, end_ms=2000)
+    assert not fetcher.is_worthwhile(duration=None, start_ms=0, end_ms=2000)
+    assert not fetcher.is_worthwhile(duration=60, start_ms=0, end_ms=50000)
@@ -0,0 +1,150 @@
+import asyncio
+from itertools import islice
+from types import SimpleNamespace
+
+from src.cache.result import ResultCache
+from src.cache.ttl import TtlCache
+from src.client.reddit import RedditClient
+from src.execution.controller import AioController
+from src.model.task_stage import TaskStage
+
+
+class FakeInbox(object):
+    def __init__(self, reddit: 'FakeReddit'):
+        self._reddit = reddit
+        self.items = []
+        self.read = []
+
+    async def unread(self, limit=None):
+        unread = [item for item in self.items if item not in self.read]
+        for offset in range(0, len(unread), 100):  # one request per page of 100 items
+            self._reddit.requestor.requests += 1
+            for item in unread[offset:offset + 100]:
+                yield item
+        if not unread:
+            self._reddit.requestor.requests += 1
+
+    async def mark_read(self, items):
+        while items:
+            self._reddit.requestor.requests += 1
+            self.read.extend(items[:25])
+            items = items[25:]
+
+
+class FakeReddit(object):
+    """Serves the inbox and submission lookups and counts the API requests like reddit would."""
+
+    def __init__(self):
+        self.requestor = SimpleNamespace(requests=0)
+        self.inbox = FakeInbox(self)
+
+    async def info(self, fullnames):
+        names = iter(fullnames)
+        while chunk := list(islice(names, 100)):
+            self.requestor.requests += 1
+            for name in chunk:
+                if name != 't3_deleted':
+                    yield SimpleNamespace(fullname=name, loaded=True)
+
+
+def _mention(i: int, submission: str):
+    return SimpleNamespace(
+        body=f'u/gifcutterbot {i}', fullname=f't1_{i}', submission=SimpleNamespace(fullname=submission, loaded=False)
+    )
+
+
+def _controller(client: RedditClient, tmp_path) -> AioController:
+    controller = AioController(
+        input_queue=asyncio.Queue(), output_queue=asyncio.Queue(),
+        result_cache=ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10),
+    )
+    controller.reddit = client
+    return controller
+
+
+def _ingest(reddit: FakeReddit, client: RedditClient, tmp_path, controller=None, answer=True):
+    controller = _controller(client, tmp_path) if controller is None else controller
+    handled = []
+
+    async def to_input_queue(message):
+        handled.append(message)
+        if message.submission.fullname == 't3_failing':
+            raise ConnectionError('host unreachable')
+        if message.submission.fullname == 't3_invalid':
+            return False
+        controller._activate(message, trace_id='-', cache_key=None)
+        if answer:
+            controller._finish(message, TaskStage.REPLIED)  # answered right away
+        return True
+
+    controller._reddit_message_to_input_queue = to_input_queue
+    calls = reddit.requestor.requests
+    asyncio.run(controller._fill_task_queue_from_reddit())
+    return handled, reddit.requestor.requests - calls
+
+
+def test_backlog_is_ingested_in_batches(tmp_path):
+    reddit = FakeReddit()
+    client = RedditClient(submission_cache_seconds=60, instance=reddit)
+    # 200 mentions of 50 submissions, a private message and a mention of a deleted submission
+    reddit.inbox.items = [_mention(i, f't3_{i % 50}') for i in range(200)]
+    reddit.inbox.items += [SimpleNamespace(body='hi'), _mention(200, 't3_deleted')]
+
+    handled, calls = _ingest(reddit, client, tmp_path)
+    assert [m.body for m in handled] == [f'u/gifcutterbot {i}' for i in range(200)]  # inbox order is kept
+    assert all(m.submission.loaded for m in handled)
+    assert handled[0].submission is handled[50].submission  # one load per submission
+    assert len(reddit.inbox.read) == 202
+    # 3 inbox pages, 1 submission lookup and 9 requests to mark 202 messages read instead of 400+ requests
+    assert calls == 3 + 1 + 9
+
+
+def test_recent_submissions_are_not_loaded_again(tmp_path):
+    reddit = FakeReddit()
+    client = RedditClient(submission_cache_seconds=60, instance=reddit)
+    reddit.inbox.items = [_mention(0, 't3_a')]
+    _ingest(reddit, client, tmp_path)
+    reddit.inbox.items += [_mention(1, 't3_a'), _mention(2, 't3_invalid')]
+
+    handled, calls = _ingest(reddit, client, tmp_path)
+    assert [m.body for m in handled] == ['u/gifcutterbot 1', 'u/gifcutterbot 2']
+    assert calls == 1 + 1 + 1  # the inbox page, the lookup of the new submission only and marking read
+    assert [m.body for m in reddit.inbox.read] == ['u/gifcutterbot 0', 'u/gifcutterbot 1']  # invalid stays unread
+
+
+def test_failing_request_does_not_hold_up_the_inbox(tmp_path):
+    reddit = FakeReddit()
+    client = RedditClient(submission_cache_seconds=60, instance=reddit)
+    reddit.inbox.items = [_mention(0, 't3_failing'), _mention(1, 't3_a')]
+    handled, _ = _ingest(reddit, client, tmp_path)
+    assert [m.body for m in handled] == ['u/gifcutterbot 0', 'u/gifcutterbot 1']
+    assert [m.body for m in reddit.inbox.read] == ['u/gifcutterbot 1']
+
+
+def test_messages_stay_unread_until_they_are_answered(tmp_path):
+    reddit = FakeReddit()
+    client = RedditClient(submission_cache_seconds=60, instance=reddit)
+    controller = _controller(client, tmp_path)
+    reddit.inbox.items = [_mention(0, 't3_a'), _mention(1, 't3_a')]
+
+    handled, _ = _ingest(reddit, client, tmp_path, controller=controller, answer=False)
+    assert len(handled) == 2 and reddit.inbox.read == []
+    handled, _ = _ingest(reddit, client, tmp_path, controller=controller, answer=False)
+    assert handled == []  # the unread messages of requests in the stages are not handed over again
+
+    controller._finish(reddit.inbox.items[1], TaskStage.REPLIED)
+    handled, calls = _ingest(reddit, client, tmp_path, controller=controller, answer=False)
+    assert handled == [] and [m.body for m in reddit.inbox.read] == ['u/gifcutterbot 1']
+    assert calls == 1 + 1  # the inbox page and marking the answered message read
+
+
+def test_ttl_cache_expires_entries():
+    now = [0.0]
+    cache = TtlCache(ttl_seconds=10, max_entries=2, clock=lambda: now[0])
+    cache.put('a', 1)
+    now[0] = 5
+    cache.put('b', 2)
+    cache.put('c', 3)
+    assert (cache.get('a'), cache.get('b'), len(cache)) == (None, 2, 2)  # evicted beyond the maximum
+    now[0] = 15
+    assert (cache.get('b'), cache.get('c')) == (None, None)
@@ -0,0 +1,54 @@
+import os
+
+from src.cache.result import ENTRY_OVERHEAD_BYTES, ResultCache, result_cache_key
+from src.model.media_type import MediaType
+from src.util.aux import Watermark
+
+
+def test_key_normalizes_source_and_range():
+    key = result_cache_key('https://v.redd.it/abc/DASH_720.mp4?source=fallback', 350, 1250.2)
+    assert key == result_cache_key('https://V.REDD.IT/abc/DASH_720.mp4', 350.0, 1250)
+    assert key != result_cache_key('https://v.redd.it/abc/DASH_720.mp4', 350, 1300)
+    assert key != result_cache_key(
+        'https://v.redd.it/abc/DASH_720.mp4', 350, 1250, watermark=Watermark('bot', (0, 0), (255, 255, 255))
+    )
+
+
+def test_cache_survives_restart(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10, store_media=True)
+    entry = cache.put('a', link='https://i.imgur.com/a.gif', media_type=MediaType.GIF, media=b'GIF89a')
+    assert os.path.isfile(entry.media_path)
+    cache.close()
+    cache = ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10, store_media=True)
+    cached = cache.get('a')
+    assert cached.link == 'https://i.imgur.com/a.gif'
+    assert cached.media_type == MediaType.GIF
+    with open(cached.media_path, 'rb') as fp:
+        assert fp.read() == b'GIF89a'
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), max_bytes=3 * ENTRY_OVERHEAD_BYTES, max_entries=10)
+    for key in 'abc':
+        cache.put(key, link=f'https://i.imgur.com/{key}.mp4', media_type=MediaType.MP4)
+    assert cache.get('a') is not None  # refresh a, so b is the least recently used entry
+    cache.put('d', link='https://i.imgur.com/d.mp4', media_type=MediaType.MP4)
+    assert 'b' not in cache
+    assert all(key in cache for key in 'acd')
+    assert cache.total_bytes <= 3 * ENTRY_OVERHEAD_BYTES
+
+
+def test_cache_evicts_stored_media_by_size(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), max_bytes=2048, max_entries=10, store_media=True)
+    first = cache.put('a', link='https://i.imgur.com/a.gif', media_type=MediaType.GIF, media=b'\x00' * 1024)
+    cache.put('b', link='https://i.imgur.com/b.gif', media_type=MediaType.GIF, media=b'\x00' * 1024)
+    assert 'a' not in cache
+    assert not os.path.exists(first.media_path)
+
+
+def test_key_separates_transcoded_gif_cuts():
+    url = 'https://i.redd.it/abc.gif'
+    gif_key = result_cache_key(url, 0, 1000)
+    assert result_cache_key(url, 0, 1000, output_type=MediaType.GIF) == gif_key
+    assert len({gif_key, result_cache_key(url, 0, 1000, output_type=MediaType.MP4),
+                result_cache_key(url, 0, 1000, output_type=MediaType.WEBM)}) == 3
@@ -0,0 +1,95 @@
+import asyncio
+import types
+
+import scheduling_simulation
+from src.cache.result import ResultCache
+from src.execution import task as t
+from src.execution.controller import AioController
+from src.execution.scheduling import ShortestJobFirstQueue, estimate_cut_seconds
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+from src.util import config
+from src.util.aux import Watermark
+
+MB = 1024 * 1024
+
+
+def _config(media_type=MediaType.GIF, start=0, end=3000, duration=None, watermark=None, output_type=None,
+            message=None):
+    return t.TaskConfig(
+        message=message, media_type=media_type, start=start, end=end, watermark=watermark,
+        state=TaskConfigState.VALID, is_oembed=False, is_crosspost=False, media_url='https://i.redd.it/a.gif',
+        duration=duration, extension=media_type.name.lower(), output_type=output_type, trace_id=None,
+    )
+
+
+def _item(name, cost, enqueued_at):
+    return types.SimpleNamespace(name=name, cost=cost, enqueued_at=enqueued_at)
+
+
+def _drain(queue):
+    return [queue.get_nowait().name for _ in range(queue.qsize())]
+
+
+def test_cost_estimate_grows_with_range_size_and_work():
+    tiny_gif = estimate_cut_seconds(_config(), source_bytes=2 * MB)
+    long_video = estimate_cut_seconds(_config(MediaType.MP4, 0, 300000, duration=600), source_bytes=400 * MB)
+    assert tiny_gif < 1 < 10 < long_video
+    assert estimate_cut_seconds(_config(), source_bytes=4 * MB) > tiny_gif
+    assert estimate_cut_seconds(_config(end=6000), source_bytes=2 * MB) > tiny_gif
+    assert estimate_cut_seconds(_config(output_type=MediaType.MP4), source_bytes=2 * MB) > tiny_gif
+    watermark = Watermark(text='cut', position=(0, 0), color=(255, 255, 255))
+    assert estimate_cut_seconds(_config(watermark=watermark), source_bytes=2 * MB) > tiny_gif
+    # without a Content-Length the size of a video is assumed from its duration, the range ends with the media
+    assert estimate_cut_seconds(_config(MediaType.MP4, 0, None, duration=600)) == \
+           estimate_cut_seconds(_config(MediaType.MP4, 0, 10 ** 9, duration=600))
+    assert estimate_cut_seconds(_config(MediaType.MP4, 0, 3000, duration=600)) > \
+           estimate_cut_seconds(_config(MediaType.MP4, 0, 3000, duration=60))
+
+
+def test_cheapest_tasks_are_cut_first():
+    queue = ShortestJobFirstQueue(aging=0.1)
+    for name, cost in [('long', 60), ('tiny', 0.2), ('short', 2), ('tiny again', 0.2)]:
+        queue.put_nowait(_item(name, cost, enqueued_at=100))
+    queue.put_nowait(types.SimpleNamespace(name='unknown', enqueued_at=100))  # e.g. a requeued task without cost
+    assert _drain(queue) == ['unknown', 'tiny', 'tiny again', 'short', 'long']
+
+
+def test_aging_bounds_the_wait_of_expensive_tasks():
+    queue = ShortestJobFirstQueue(aging=0.5)
+    queue.put_nowait(_item('long', 60, enqueued_at=0))
+    queue.put_nowait(_item('cheap, 100s later', 1, enqueued_at=100))  # within 60 / 0.5 seconds of the long task
+    queue.put_nowait(_item('cheap, 130s later', 1, enqueued_at=130))
+    assert _drain(queue) == ['cheap, 100s later', 'long', 'cheap, 130s later']
+
+
+def test_shortest_job_first_cuts_reply_latency():
+    latencies = scheduling_simulation.compare(count=1000, seed=1)
+    fifo, sjf = latencies['fifo'], latencies['sjf (aging 0.1)']
+    assert sjf.median < fifo.median / 2 and sjf.p95 < fifo.p95
+    # aging keeps long cuts from starving, unlike pure shortest job first
+    assert sjf.maximum < latencies['sjf (aging 0)'].maximum and sjf.maximum < 3 * fifo.maximum
+
+
+def test_tasks_carry_their_cost_estimate(tmp_path, monkeypatch):
+    monkeypatch.setattr(t.TaskConfigFactory, 'oembed_page_url', classmethod(lambda cls, message: None))
+    monkeypatch.setattr(t.TaskConfigFactory, 'from_message', staticmethod(
+        lambda message, oembed_page=None, gif_output_type=None, trace_id=None: _config(
+            message.media_type, 0, message.end, duration=message.duration, message=message
+        )
+    ))
+    monkeypatch.setattr(config, 'CUT_WORKERS', 0)
+
+    async def scenario():
+        controller = AioController(
+            input_queue=ShortestJobFirstQueue(), output_queue=asyncio.Queue(),
+            result_cache=ResultCache(directory=str(tmp_path), max_bytes=10 ** 6, max_entries=10),
+        )
+        requests = [('long', MediaType.MP4, 300000, 600), ('gif', MediaType.GIF, 3000, None)]
+        for name, media_type, end, duration in requests:
+            message = types.SimpleNamespace(name=name, media_type=media_type, end=end, duration=duration)
+            assert await controller._reddit_message_to_input_queue(message)
+        return [controller.input_queue.get_nowait() for _ in range(2)]
+
+    gif, long = asyncio.run(scenario())
+    assert (gif.config.message.name, long.config.message.name) == ('gif', 'long') and gif.cost < long.cost
@@ -0,0 +1,80 @@
+import functools
+import http.server
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.cache.source import SourceCache
+
+GIF_PATH = 'test_data/cat.gif'
+
+
+class CountingHandler(http.server.SimpleHTTPRequestHandler):
+    requests = []
+    delay = 0.0
+
+    def do_GET(self):
+        CountingHandler.requests.append((self.path, self.headers.get('If-Modified-Since')))
+        time.sleep(CountingHandler.delay)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def media_host():
+    CountingHandler.requests = []
+    CountingHandler.delay = 0.0
+    handler = functools.partial(CountingHandler, directory='test_data')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_source_is_served_memory_mapped(media_host, tmp_path):
+    cache = SourceCache(directory=str(tmp_path), max_bytes=10 ** 8)
+    mapped = cache.open(f'{media_host}/cat.gif')
+    with open(GIF_PATH, 'rb') as fp:
+        assert mapped[:] == fp.read()
+    mapped.close()
+
+
+def test_revalidation_uses_conditional_request(media_host, tmp_path):
+    cache = SourceCache(directory=str(tmp_path), max_bytes=10 ** 8, revalidate_seconds=0)
+    cache.open(f'{media_host}/cat.gif').close()
+    cache.open(f'{media_host}/cat.gif').close()
+    assert len(CountingHandler.requests) == 2
+    assert CountingHandler.requests[0][1] is None
+    assert CountingHandler.requests[1][1] is not None  # answered with 304 Not Modified
+    assert cache.total_bytes > 0
+
+
+def test_fresh_entries_are_not_revalidated(media_host, tmp_path):
+    cache = SourceCache(directory=str(tmp_path), max_bytes=10 ** 8, revalidate_seconds=60)
+    for _ in range(3):
+        cache.open(f'{media_host}/cat.gif').close()
+    assert len(CountingHandler.requests) == 1
+
+
+def test_concurrent_requests_share_one_download(media_host, tmp_path):
+    CountingHandler.delay = 0.2
+    cache = SourceCache(directory=str(tmp_path), max_bytes=10 ** 8)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        sizes = list(pool.map(lambda _: len(cache.open(f'{media_host}/test.mov')), range(8)))
+    assert len(CountingHandler.requests) == 1
+    assert len(set(sizes)) == 1
+
+
+def test_eviction_is_lru_by_bytes(media_host, tmp_path):
+    cache = SourceCache(directory=str(tmp_path), max_bytes=4 * 1024 * 1024)
+    cache.open(f'{media_host}/test.mov').close()  # ~0.8 MB
+    cache.open(f'{media_host}/cat.gif').close()  # ~3.8 MB, pushes test.mov out
+    assert f'{media_host}/test.mov' not in cache
+    assert f'{media_host}/cat.gif' in cache
+    assert cache.open(f'{media_host}/missing.gif') is None
@@ -0,0 +1,74 @@
+import dataclasses
+from types import SimpleNamespace
+
+import pytest
+
+from src.execution.task import TaskConfigFactory
+from src.model.media_type import MediaType
+from src.model.task_state import TaskConfigState
+
+
+def _video_message(body: str = 'start=9000 end=15000'):
+    reddit_video = {
+        'scrubber_media_url': 'https://v.redd.it/abc/DASH_96.mp4',
+        'fallback_url': 'https://v.redd.it/abc/DASH_720.mp4?source=fallback',
+        'duration': 12,
+    }
+    submission = SimpleNamespace(is_video=True, secure_media={'reddit_video': reddit_video}, url='', media=None)
+    return SimpleNamespace(submission=submission, body=body)
+
+
+def _gif_message(body: str = 'start=1250 end=350'):
+    submission = SimpleNamespace(is_video=False, url='https://i.redd.it/abc.gif', media=None)
+    return SimpleNamespace(submission=submission, body=body)
+
+
+@pytest.fixture(autouse=True)
+def no_network(monkeypatch):
+    def _fail(*args, **kwargs):
+        raise AssertionError('TaskConfig resolution must not perform network I/O.')
+
+    monkeypatch.setattr('requests.get', _fail)
+
+
+def test_video_config_is_resolved_once():
+    config = TaskConfigFactory.from_message(_video_message())
+    assert config.is_state(TaskConfigState.VALID)
+    assert config.media_type == MediaType.MP4
+    assert config.media_url == 'https://v.redd.it/abc/DASH_720.mp4?source=fallback'
+    assert config.extension == 'mp4'
+    assert (config.start, config.end) == (9000, 12000)  # end is bounded by the duration
+    assert 'media_url' in repr(config)
+
+
+def test_gif_config_defers_duration_to_handler():
+    config = TaskConfigFactory.from_message(_gif_message())
+    assert config.is_gif and not config.is_video
+    assert config.duration is None
+    assert (config.start, config.end) == (350, 1250)  # start and end are swapped
+
+
+def test_config_is_immutable():
+    config = TaskConfigFactory.from_message(_gif_message())
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        config.start = 0
+    assert not hasattr(config, '__dict__')
+
+
+def test_config_without_range_is_invalid():
+    config = TaskConfigFactory.from_message(_gif_message(body='cut this please'))
+    assert config.is_state([TaskConfigState.INVALID])
+
+
+def test_gif_output_type_is_requested_per_message():
+    assert TaskConfigFactory.from_message(_gif_message()).output_type == MediaType.GIF
+    assert TaskConfigFactory.from_message(_gif_message(), gif_output_type=MediaType.MP4).output_type == MediaType.MP4
+    config = TaskConfigFactory.from_message(_gif_message(body='start=0 end=900 format=WebM'))
+    assert config.output_type == MediaType.WEBM
+    assert TaskConfigFactory.from_message(_video_message(body='start=0 end=900 fmt=gif')).output_type is None
+
+
+def test_config_carries_the_trace_of_the_message():
+    assert TaskConfigFactory.from_message(_gif_message(), trace_id='a' * 32).trace_id == 'a' * 32
+    first, second = (TaskConfigFactory.from_message(_gif_message()).trace_id for _ in range(2))
+    assert len(first) == 32 and first != second  # a new trace per message without one
@@ -0,0 +1,92 @@
+import contextvars
+import http.server
+import json
+import logging
+import threading
+
+import pytest
+
+from src.util.logger import TraceIdFilter
+from src.util.tracing import JsonlExporter, OtlpExporter, Span, Tracer
+
+
+def test_nested_spans_share_the_trace_and_are_exported(tmp_path):
+    tracer = Tracer()
+    tracer.add_exporter(JsonlExporter(str(tmp_path / 'spans.jsonl')))
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'message', None, None)
+    with tracer.span('ingest', trace_id='a' * 32) as root:
+        with tracer.span('download', bytes=10) as child:
+            TraceIdFilter().filter(record)
+        with pytest.raises(ValueError):
+            with tracer.span('encode'):
+                raise ValueError('broken')
+    tracer.close()
+    assert record.trace_id == 'a' * 32  # log lines carry the trace of the current span
+    lines = [json.loads(line) for line in open(tmp_path / 'spans.jsonl')]
+    assert [line['name'] for line in lines] == ['download', 'encode', 'ingest']  # in the order they end
+    assert {line['trace_id'] for line in lines} == {root.trace_id}
+    assert [line['parent_id'] for line in lines] == [root.span_id, root.span_id, None]
+    assert lines[0]['attributes'] == {'bytes': 10} and lines[0]['duration'] >= 0
+    assert lines[1]['status'] == 'error' and lines[1]['attributes']['error'] == 'ValueError: broken'
+    assert child.end is not None and root.start <= child.start <= child.end <= root.end
+
+
+def test_spans_of_other_threads_and_processes_are_collected():
+    tracer = Tracer()
+
+    def handle():
+        with tracer.span('task'):
+            pass
+
+    with tracer.collecting() as spans:
+        with tracer.span('cut') as cut:
+            # like the executor of the controller, the thread runs in a copy of the context
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(handle,))
+            thread.start()
+            thread.join()
+            with tracer.span('cut_worker', trace_id=cut.trace_id, parent_id='f' * 16):
+                pass
+    assert [span.name for span in spans] == ['task', 'cut_worker', 'cut']
+    assert spans[0].parent_id == cut.span_id and spans[0].trace_id == cut.trace_id
+    assert spans[1].parent_id == 'f' * 16  # the parent handed over by another process
+
+
+class Collector(http.server.BaseHTTPRequestHandler):
+    """An OTLP/HTTP collector stand-in that keeps the posted requests."""
+    requests = []
+
+    def do_POST(self):
+        self.requests.append((self.path, json.loads(self.rfile.read(int(self.headers['Content-Length'])))))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_otlp_exporter_posts_batches_to_a_collector():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Collector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        exporter = OtlpExporter(f'http://127.0.0.1:{server.server_address[1]}/v1/traces', interval_seconds=60)
+        exporter.export([
+            Span('upload', trace_id='a' * 32, span_id='b' * 16, parent_id='c' * 16, start=1.5, end=2.0,
+                 attributes={'attempts': 2, 'anon': True, 'media_type': 'gif'}),
+            Span('reply', trace_id='a' * 32, span_id='d' * 16, parent_id=None, start=2.0, end=2.25, status='error'),
+        ])
+        exporter.close()  # posts the queued spans
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(Collector.requests) == 1 and exporter.dropped == 0
+    path, body = Collector.requests[0]
+    scope_spans = body['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert path == '/v1/traces'
+    assert scope_spans[0]['traceId'] == 'a' * 32 and scope_spans[0]['parentSpanId'] == 'c' * 16
+    assert scope_spans[0]['startTimeUnixNano'] == '1500000000' and scope_spans[0]['endTimeUnixNano'] == '2000000000'
+    assert scope_spans[0]['attributes'] == [
+        {'key': 'attempts', 'value': {'intValue': '2'}},
+        {'key': 'anon', 'value': {'boolValue': True}},
+        {'key': 'media_type', 'value': {'stringValue': 'gif'}},
+    ]
+    assert 'parentSpanId' not in scope_spans[1] and scope_spans[1]['status'] == {'code': 2}
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import types
+
+import pytest
+
+from src.cache.result import ResultCache
+from src.execution import task as t
+from src.execution.controller import AioController
+from src.execution.journal import TaskJournal
+from src.execution.record import CutRecord, MessageRef
+from src.execution.transport import CUT_TOPIC, UPLOAD_TOPIC, StageQueue, transport_for
+from src.model.media_type import MediaType
+from src.model.result import Result
+from src.model.task_stage import TaskStage
+from src.model.task_state import TaskConfigState
+from src.util import config
+from src.util.aux import Watermark
+from src.util.media_buffer import MediaBuffer
+
+
+@pytest.fixture(params=['sqlite', 'spool'])
+def transport_url(request, tmp_path):
+    return f'sqlite://{tmp_path}/stages.sqlite3' if request.param == 'sqlite' else f'spool://{tmp_path}/spool'
+
+
+def _config(message, trace_id='trace'):
+    return t.TaskConfig(
+        message=message, media_type=MediaType.GIF, start=500, end=2500,
+        watermark=Watermark(text='cut', position=(4, 8), color=(255, 0, 0)), state=TaskConfigState.VALID,
+        is_oembed=False, is_crosspost=False, media_url=f'https://i.redd.it/{message.fullname}.gif', duration=None,
+        extension='gif', output_type=MediaType.MP4, trace_id=trace_id,
+    )
+
+
+def test_records_are_leased_until_they_are_acknowledged(transport_url):
+    transport = transport_for(transport_url, lease_seconds=60)
+    for i in range(3):
+        transport.put(CUT_TOPIC, {'i': i})
+    assert transport.size(CUT_TOPIC) == 3 and transport.size(UPLOAD_TOPIC) == 0
+
+    first, second = transport.get(CUT_TOPIC), transport.get(CUT_TOPIC)
+    assert [first[1], second[1]] == [{'i': 0}, {'i': 1}] and transport.size(CUT_TOPIC) == 1
+    transport.ack(CUT_TOPIC, first[0])
+    transport.lease_seconds = -1  # the leases of further records have expired right away
+    assert transport.get(CUT_TOPIC)[1] == {'i': 2}
+    assert transport.get(CUT_TOPIC)[1] == {'i': 2}  # received again, e.g. by another process after a crash
+    assert transport.get(UPLOAD_TOPIC) is None
+
+
+def _receive(url, received):
+    transport = transport_for(url)
+    while (delivery := transport.get(CUT_TOPIC)) is not None:
+        received.put(delivery[1]['i'])
+        transport.ack(CUT_TOPIC, delivery[0])
+
+
+def test_competing_processes_receive_each_record_once(transport_url):
+    transport = transport_for(transport_url)
+    for i in range(200):
+        transport.put(CUT_TOPIC, {'i': i})
+    received = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_receive, args=(transport_url, received)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert sorted(received.get() for _ in range(200)) == list(range(200)) and received.empty()
+    assert transport.size(CUT_TOPIC) == 0
+
+
+def test_cut_record_is_serializable():
+    task = types.SimpleNamespace(config=_config(types.SimpleNamespace(fullname='t1_a')), enqueued_at=None)
+    record = CutRecord.from_task(task)
+    received = CutRecord.from_dict(json.loads(json.dumps(record.to_dict())), lease='1')
+    assert (received.message_id, received.cache_key, received.lease) == ('t1_a', record.cache_key, '1')
+    config_ = received.to_config()
+    assert config_.message == MessageRef(fullname='t1_a') and config_.trace_id == 'trace'
+    assert (config_.start, config_.end, config_.output_type) == (500, 2500, MediaType.MP4)
+    assert (config_.watermark.text, config_.watermark.position, config_.watermark.color) == ('cut', (4, 8),
+                                                                                            (255, 0, 0))
+
+
+def test_stages_run_in_separate_controllers(transport_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CUT_WORKERS', 0)
+    monkeypatch.setattr(t.TaskConfigFactory, 'oembed_page_url', classmethod(lambda cls, message: None))
+    monkeypatch.setattr(t.TaskConfigFactory, 'from_message', staticmethod(
+        lambda message, oembed_page=None, gif_output_type=None, trace_id=None: _config(message, trace_id=trace_id)
+    ))
+    replies, marked_read = [], []
+
+    class FakeReddit(object):
+        @staticmethod
+        def inbox_item(fullname):
+            return types.SimpleNamespace(fullname=fullname)
+
+        @staticmethod
+        async def mark_read(items):
+            marked_read.extend(item.fullname for item in items)
+
+    def controller():
+        # every stage process has controllers and queues of its own
+        transport = transport_for(transport_url)
+        controller_ = AioController(
+            input_queue=StageQueue(transport, CUT_TOPIC, poll_seconds=0.01),
+            output_queue=StageQueue(transport, UPLOAD_TOPIC, poll_seconds=0.01),
+            result_cache=ResultCache(directory=str(tmp_path / 'results'), max_bytes=10 ** 6, max_entries=10),
+            journal=TaskJournal(directory=str(tmp_path / 'journal')),
+        )
+        controller_.reddit = FakeReddit()
+        return controller_
+
+    ingester, cutter, uploader = controller(), controller(), controller()
+    cutter._exert_task = lambda task: Result(
+        MediaBuffer.from_bytes(b'GIF89a'), media_type=MediaType.MP4, message=task.config.message,
+        cache_key='key', trace_id=task.trace_id,
+    )
+
+    async def upload_to_imgur(result):
+        assert result.media_stream.getvalue() == b'GIF89a'
+        return 'https://i.imgur.com/a.mp4'
+
+    async def answer_in_reddit(message, upload_link):
+        replies.append((message.fullname, upload_link))
+
+    uploader._upload_to_imgur = upload_to_imgur
+    uploader._answer_in_reddit = answer_in_reddit
+
+    async def scenario():
+        assert await ingester._reddit_message_to_input_queue(types.SimpleNamespace(fullname='t1_a'))
+        await cutter.work()
+        await uploader.upload_and_answer()
+        await uploader.mark_answered_read()
+
+    asyncio.run(scenario())
+    assert replies == [('t1_a', 'https://i.imgur.com/a.mp4')] and marked_read == ['t1_a']
+    assert ingester.input_queue.qsize() == ingester.output_queue.qsize() == 0
+    assert ingester.journal.get('t1_a').stage == TaskStage.REPLIED
+    assert os.listdir(str(tmp_path / 'journal' / 'artifacts')) == []  # the handed over cut is removed once uploaded
+    assert ingester._in_flight == {}  # identical requests do not wait for a cut of another process